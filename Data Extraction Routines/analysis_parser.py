@@ -0,0 +1,438 @@
+'''
+Single-pass parser engine for the OpticStudio analysis exports.
+
+Walks AnalysisExports once, dispatches every <lens>_<Analysis>.txt to the
+table grammar registered for its suffix and writes one CSV per file into
+CSVExports/<Analysis>. Replaces the separate walks done by the four
+process_*.py scripts (which are now thin wrappers around extract_all).
+'''
+
+import os
+import re
+import csv
+import time
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from text_io import read_from_marker
+from extraction_manifest import (
+    MANIFEST_NAME, load_manifest, save_manifest, refresh_section, remove_outputs, manifest_key,
+)
+
+# ---------------- Paths ----------------
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Prime Lenses + Data"))
+ROOT_DIR = os.path.join(DATA_DIR, "AnalysisExports")
+OUTPUT_ROOT = os.path.join(DATA_DIR, "CSVExports")
+
+# ---------------- Table Grammars ----------------
+# Every export writes its tables as
+#
+#   Table series: <series title>
+#   <header row>
+#   --------------  --------------  ...
+#   <numeric rows>
+#   <blank line>
+#
+# A grammar only has to say which header row belongs to the analysis and,
+# optionally, how to pull a per-table wavelength out of the series title.
+GRAMMARS = {}
+
+SERIES_PREFIX = "Table series:"
+header_split = re.compile(r'\t+|\s{2,}')
+
+
+def register_grammar(name, header_pattern, wavelength_pattern=None):
+    """
+    Register the table grammar for <lens>_<name>.txt exports.
+
+    header_pattern     : regex matched against the row after "Table series:"
+    wavelength_pattern : optional regex on the series title; group(1) is
+                         appended to every row of that table as 'Wavelength'
+    """
+    GRAMMARS[name.lower()] = {
+        "name": name,
+        "header": re.compile(header_pattern, re.IGNORECASE),
+        "wavelength": re.compile(wavelength_pattern, re.IGNORECASE) if wavelength_pattern else None,
+    }
+
+
+register_grammar(
+    "FieldCurvature",
+    r'^\s*Y\s*(Angle|Height)',
+    wavelength_pattern=r'Data for wavelength\s*:\s*(.+)$',
+)
+register_grammar("Longitudinal", r'^\s*Rel\.?\s*Pupil')
+register_grammar("RMSvField", r'\bField\b.*\bPoly\b')
+register_grammar("Vignetting", r'^\s*Y\s*Field')
+
+
+def grammar_for(filename):
+    """Return the grammar for an export file name, or None if it is not one of ours."""
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() != ".txt" or "_" not in stem:
+        return None
+    return GRAMMARS.get(stem.rsplit("_", 1)[1].lower())
+
+# ---------------- Parsing ----------------
+# One parsed table: headers, optional wavelength label, float64 block and the
+# raw block text (None when the block was ragged and had to be padded)
+Table = namedtuple("Table", ["headers", "wavelength", "block", "source"])
+
+blank_line = re.compile(r'\n[ \t\r]*(?:\n|$)')
+
+
+def decode_block_fast(text, n_cols):
+    """
+    Decode one numeric block (the text between the dashed rule and the next
+    blank line) into an (n_rows, n_cols) float64 array in a single call.
+
+    OpticStudio writes fixed-width 16-char columns that always keep at least
+    one space between values, so numpy can parse the whole slice directly,
+    including the "-1.3840295E-004" exponent style. Returns None if the block
+    is ragged or holds something that is not a number.
+    """
+    n_rows = text.count("\n") + 1
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(text, dtype=np.float64, sep=" ")
+    except (ValueError, DeprecationWarning):
+        return None
+    if values.size != n_rows * n_cols:
+        return None
+    return values.reshape(n_rows, n_cols)
+
+
+def decode_block(text, n_cols):
+    """Decode a numeric block, padding ragged or non-numeric cells with NaN."""
+    block = decode_block_fast(text, n_cols)
+    if block is not None:
+        return block
+
+    lines = text.split("\n")
+    block = np.full((len(lines), n_cols), np.nan)
+    for r, line in enumerate(lines):
+        for c, token in enumerate(line.split()[:n_cols]):
+            try:
+                block[r, c] = float(token)
+            except ValueError:
+                pass
+    return block
+
+
+def iter_parse_tables(text, grammar):
+    """
+    Yield the tables of one export one at a time, as Table tuples; each
+    block is decoded only when the generator reaches it.
+    """
+    wavelength_pattern = grammar["wavelength"]
+
+    pos = text.find(SERIES_PREFIX)
+    while pos != -1:
+        title_end = text.find("\n", pos)
+        if title_end == -1:
+            break
+        header_end = text.find("\n", title_end + 1)
+        rule_end = text.find("\n", header_end + 1) if header_end != -1 else -1
+        if rule_end == -1:
+            break
+
+        header_line = text[title_end + 1:header_end]
+        next_pos = text.find(SERIES_PREFIX, rule_end)
+        if grammar["header"].search(header_line):
+            headers = [h.strip() for h in header_split.split(header_line.strip()) if h.strip()]
+            n_cols = len(text[header_end + 1:rule_end].split())
+
+            # Numeric block runs from after the dashed rule to the next blank line
+            match = blank_line.search(text, rule_end)
+            block_end = match.start() if match else len(text)
+            if block_end > rule_end + 1 and n_cols:
+                wavelength = None
+                if wavelength_pattern is not None:
+                    title = text[pos + len(SERIES_PREFIX):title_end].strip()
+                    found = wavelength_pattern.search(title)
+                    wavelength = found.group(1).strip() if found else ''
+
+                source = text[rule_end + 1:block_end]
+                block = decode_block_fast(source, n_cols)
+                if block is None:
+                    block, source = decode_block(source, n_cols), None
+                yield Table(headers[:n_cols], wavelength, block, source)
+
+        pos = next_pos
+
+
+def parse_tables(text, grammar):
+    """
+    Parse every table in one export.
+
+    Returns a list of Table tuples, one per table; wavelength is the label
+    pulled out of the series title (None unless the grammar asks for it).
+    """
+    return list(iter_parse_tables(text, grammar))
+
+
+def table_csv_rows(table):
+    """CSV text for the rows of one table (exported tokens are kept verbatim)."""
+    suffix = "" if table.wavelength is None else "," + table.wavelength
+    if table.source is not None:
+        return "".join([",".join(line.split()) + suffix + "\r\n" for line in table.source.split("\n")])
+
+    row_format = ",".join(["%.10g"] * table.block.shape[1]) + suffix.replace("%", "%%")
+    return "".join([row_format % tuple(row) + "\r\n" for row in table.block.tolist()])
+
+
+def write_csv(path, tables):
+    """Write the tables of one export as a single CSV (plus 'Wavelength' when labelled)."""
+    headers = tables[0].headers
+    if tables[0].wavelength is not None:
+        headers = headers + ['Wavelength']
+    with open(path, 'w', newline='', encoding='utf-8') as csvfile:
+        csv.writer(csvfile).writerow(headers)
+        csvfile.write("".join([table_csv_rows(table) for table in tables]))
+
+# ---------------- Main Processing Loop ----------------
+def find_exports(root_dir, wanted):
+    """Walk root_dir once and group export paths by analysis name (sorted for a stable order)."""
+    found = {GRAMMARS[key]["name"]: [] for key in wanted}
+    for subdir, _, files in os.walk(root_dir):
+        for filename in files:
+            grammar = grammar_for(filename)
+            if grammar is not None and grammar["name"].lower() in wanted:
+                found[grammar["name"]].append(os.path.join(subdir, filename))
+    for paths in found.values():
+        paths.sort()
+    return found
+
+
+def extract_file(filepath, grammar, output_root):
+    """
+    Parse one export and write its CSV.
+
+    Returns the output path relative to output_root ('' if the export holds
+    no table), or None if the file could not be read.
+    """
+    filename = os.path.basename(filepath)
+    try:
+        text = read_from_marker(filepath, SERIES_PREFIX)
+    except Exception as e:
+        print(f"⚠️ Skipping {filename}: could not read ({e})")
+        return None
+
+    tables = parse_tables(text, grammar)
+    if not tables:
+        return ''
+
+    output_filename = os.path.splitext(filename)[0] + ".csv"
+    write_csv(os.path.join(output_root, grammar["name"], output_filename), tables)
+    return grammar["name"] + "/" + output_filename
+
+
+# ---------------- Streaming API ----------------
+# One curve table as handed to downstream code
+CurveTable = namedtuple("CurveTable", ["lens_id", "analysis", "wavelength", "headers", "block"])
+
+
+def name_filter(names):
+    """Turn None, a single name, an iterable of names or a predicate into a predicate."""
+    if names is None:
+        return lambda name: True
+    if callable(names):
+        return names
+    if isinstance(names, str):
+        names = [names]
+    wanted = set(names)
+    return wanted.__contains__
+
+
+def iter_tables(root_dir=ROOT_DIR, analyses=None, lenses=None):
+    """
+    Lazily yield CurveTable(lens_id, analysis, wavelength, headers, block)
+    straight from AnalysisExports, in sorted lens order.
+
+    analyses : analysis name(s) to keep (case-insensitive), default all
+    lenses   : lens id(s) or a predicate on the lens id, default all
+    Filters are applied to folder and file names before anything is read,
+    and nothing beyond the table being yielded is parsed, so breaking out
+    of the loop stops the work.
+    """
+    wanted = {a.lower() for a in ([analyses] if isinstance(analyses, str) else analyses)} if analyses else None
+    keep_lens = name_filter(lenses)
+
+    for subdir, dirs, files in os.walk(root_dir):
+        dirs.sort()
+        lens_id = os.path.basename(subdir)
+        if not keep_lens(lens_id):
+            continue
+        for filename in sorted(files):
+            grammar = grammar_for(filename)
+            if grammar is None or (wanted is not None and grammar["name"].lower() not in wanted):
+                continue
+            try:
+                text = read_from_marker(os.path.join(subdir, filename), SERIES_PREFIX)
+            except Exception as e:
+                print(f"⚠️ Skipping {filename}: could not read ({e})")
+                continue
+            for table in iter_parse_tables(text, grammar):
+                yield CurveTable(lens_id, grammar["name"], table.wavelength, table.headers, table.block)
+
+
+# ---------------- Parallel Workers ----------------
+def shard_by_lens(jobs):
+    """Group (filepath, analysis) jobs by lens folder, keeping the sorted order."""
+    shards = {}
+    for filepath, name in jobs:
+        shards.setdefault(os.path.dirname(filepath), []).append((filepath, name))
+    return [shards[lens_dir] for lens_dir in sorted(shards)]
+
+
+def extract_shard(shard, output_root):
+    """Worker: extract every export of one lens folder, return [(filepath, analysis, output)]."""
+    return [(filepath, name, extract_file(filepath, GRAMMARS[name.lower()], output_root))
+            for filepath, name in shard]
+
+
+def parse_shard(shard):
+    """
+    Worker: parse every export of one lens folder without writing anything.
+
+    Returns [(filepath, analysis, tables)] where each table is a compact
+    (headers, wavelength, float64 block) tuple, so only numeric arrays are
+    pickled back to the parent.
+    """
+    results = []
+    for filepath, name in shard:
+        try:
+            text = read_from_marker(filepath, SERIES_PREFIX)
+        except Exception as e:
+            print(f"⚠️ Skipping {os.path.basename(filepath)}: could not read ({e})")
+            continue
+        tables = [(tuple(t.headers), t.wavelength, t.block) for t in parse_tables(text, GRAMMARS[name.lower()])]
+        results.append((filepath, name, tables))
+    return results
+
+
+def run_shards(worker, shards, workers, *args):
+    """
+    Run worker(shard, *args) over every shard, serially or on a process pool.
+
+    Results come back flattened in shard order, so the outcome never depends
+    on which process finished first.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(shards) <= 1:
+        return [item for shard in shards for item in worker(shard, *args)]
+
+    chunksize = max(1, len(shards) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        per_shard = pool.map(worker, shards, *[[arg] * len(shards) for arg in args], chunksize=chunksize)
+        return [item for shard_results in per_shard for item in shard_results]
+
+
+def parse_all(root_dir=ROOT_DIR, analyses=None, workers=1):
+    """
+    Parse every export under root_dir into memory.
+
+    Returns {(lens_id, analysis): [(headers, wavelength, block), ...]} in
+    sorted lens order; lens folders are spread across `workers` processes.
+    """
+    wanted = {a.lower() for a in analyses} if analyses else set(GRAMMARS)
+    found = find_exports(root_dir, wanted)
+    jobs = [(path, name) for name, paths in found.items() for path in paths]
+    results = run_shards(parse_shard, shard_by_lens(jobs), workers)
+    return {(os.path.basename(os.path.dirname(path)), name): tables
+            for path, name, tables in results if tables}
+
+# ---------------- Batch Extraction ----------------
+def extract_all(root_dir=ROOT_DIR, output_root=OUTPUT_ROOT, analyses=None, verbose=False,
+                incremental=False, manifest_path=None, workers=1):
+    """
+    Walk root_dir once and extract every registered analysis.
+
+    analyses      : optional list of analysis names to restrict the run to
+                    (e.g. ["FieldCurvature"]); default is every registered grammar
+    incremental   : only parse exports that are new or changed since the last
+                    run, and delete CSVs whose export has disappeared
+    manifest_path : where the content-hash manifest lives (default:
+                    extraction_manifest.json next to output_root)
+    workers       : number of processes to shard lens folders across
+                    (1 = serial, None = all cores)
+    Returns a dict {analysis: number of CSVs written}.
+    """
+    wanted = {a.lower() for a in analyses} if analyses else set(GRAMMARS)
+    found = find_exports(root_dir, wanted)
+    written = {name: 0 for name in found}
+    skipped = []
+    jobs = []
+
+    if incremental:
+        if manifest_path is None:
+            manifest_path = os.path.join(os.path.dirname(os.path.abspath(output_root)), MANIFEST_NAME)
+        manifest = load_manifest(manifest_path)
+
+    for name, paths in found.items():
+        os.makedirs(os.path.join(output_root, name), exist_ok=True)
+
+        if incremental:
+            section = "AnalysisExports/" + name
+            changed, removed = refresh_section(manifest, section, paths, root_dir)
+            # Re-parse anything whose CSV has gone missing since the last run
+            changed = set(changed)
+            for key, record in manifest[section].items():
+                for output in record["outputs"]:
+                    if not os.path.exists(os.path.join(output_root, *output.split("/"))):
+                        changed.add(key)
+            deleted = remove_outputs(removed, output_root)
+            if verbose or deleted:
+                print(f"{name}: {len(changed)} new/changed, {len(paths) - len(changed)} unchanged, "
+                      f"{len(removed)} removed ({deleted} CSVs deleted)")
+            paths = [path for path in paths if manifest_key(path, root_dir) in changed]
+
+        jobs.extend((path, name) for path in paths)
+
+    results = run_shards(extract_shard, shard_by_lens(jobs), workers, output_root)
+
+    for filepath, name, output in results:
+        if incremental:
+            records = manifest["AnalysisExports/" + name]
+            key = manifest_key(filepath, root_dir)
+            if output is None:
+                # Unreadable: forget it so the next run tries again
+                del records[key]
+                continue
+            record = records[key]
+            stale = [old for old in record["outputs"] if old != output]
+            remove_outputs({key: {"outputs": stale}}, output_root)
+            record["outputs"] = [output] if output else []
+        if output is None:
+            continue
+        if not output:
+            skipped.append(os.path.basename(filepath))
+            continue
+        written[name] += 1
+        if verbose:
+            print(f"✅ Saved: {output}")
+
+    if incremental:
+        save_manifest(manifest, manifest_path)
+
+    if skipped:
+        print(f"⚠️ No data found in {len(skipped)} file(s)")
+        if verbose:
+            for filename in skipped:
+                print(f"   {filename}")
+    return written
+
+
+if __name__ == "__main__":
+    WORKERS = os.cpu_count()  # set to 1 to run serially
+
+    start = time.perf_counter()
+    counts = extract_all(ROOT_DIR, OUTPUT_ROOT, incremental=True, workers=WORKERS)
+    for name, count in counts.items():
+        print(f"✅ {name}: {count} CSVs written")
+    print(f"\n✅ Done Processing ({time.perf_counter() - start:.2f} s)")
@@ -0,0 +1,203 @@
+'''
+Benchmark harness for the extraction pipeline.
+
+For every scale in SCALES (1 = the current 1019-lens corpus) a synthetic
+corpus is generated with synthetic_corpus.py, then each stage is timed in
+its own process so peak RSS is measured per stage (the stage process and,
+apart from it, the largest of the worker processes it ran):
+
+  extract        analysis_parser.extract_all   AnalysisExports -> CSVExports
+  combine        combine_csvs_columns           CSVExports/<Analysis> -> <Analysis>.csv
+  store          lens_store.build_store         AnalysisExports -> LensStore
+  distributions  lens_surface_distributions     LensDataExports -> summaries + plots
+
+Every run is appended as one JSON line to RESULTS_PATH under CSVExports
+(seconds, files/s, rows/s and the two peak RSS figures per stage), so
+regressions show up run over run; only the generated corpora live in the
+temp directory.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is reported as null
+    resource = None
+
+import synthetic_corpus
+
+# ---------------- Settings ----------------
+SCALES = [1, 10, 100]
+WORKERS = os.cpu_count()
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Prime Lenses + Data"))
+BENCH_DIR = os.path.join(tempfile.gettempdir(), "lens_benchmark")   # scratch corpora, deleted per scale
+RESULTS_PATH = os.path.join(DATA_DIR, "CSVExports", "benchmark_results.jsonl")
+KEEP_CORPUS = False           # keep the generated trees after each scale
+
+# ---------------- Stages ----------------
+def stage_extract(corpus, work_dir, workers):
+    from analysis_parser import extract_all
+    counts = extract_all(corpus["root_dir"], os.path.join(work_dir, "CSVExports"), workers=workers)
+    return {"files": corpus["export_files"], "rows": sum(corpus["rows"].values()), "outputs": sum(counts.values())}
+
+
+def stage_combine(corpus, work_dir, workers):
+    from combine_csvs_columns import combine_csvs
+    base_folder = os.path.join(work_dir, "CSVExports")
+    files = rows = 0
+    for name in synthetic_corpus.ANALYSES:
+        folder = os.path.join(base_folder, name)
+        paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".csv"))
+        n_files, n_rows, _ = combine_csvs(paths, os.path.join(base_folder, name + ".csv"), "lens_id", name)
+        files += n_files
+        rows += n_rows
+    return {"files": files, "rows": rows}
+
+
+def stage_store(corpus, work_dir, workers):
+    from lens_store import build_store
+    rows = build_store(corpus["root_dir"], os.path.join(work_dir, "LensStore"), workers=workers)
+    return {"files": corpus["export_files"], "rows": sum(rows.values())}
+
+
+def stage_distributions(corpus, work_dir, workers):
+    import matplotlib
+    matplotlib.use("Agg")
+    import lens_surface_distributions
+    lens_surface_distributions.main(corpus["lens_data_dir"], os.path.join(work_dir, "LensDataAnalysis"),
+                                    workers=workers, incremental=False)
+    return {"files": corpus["lenses"], "rows": corpus["lens_data_rows"]}
+
+
+STAGES = {
+    "extract": stage_extract,
+    "combine": stage_combine,
+    "store": stage_store,
+    "distributions": stage_distributions,
+}
+
+# ---------------- Measurement ----------------
+def peak_rss_mb(who):
+    """ru_maxrss of getrusage(who) in MB, or None without the resource module."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def peak_rss():
+    """
+    {"stage_peak_rss_mb", "child_max_rss_mb"}: the peak RSS of this process
+    and the largest peak RSS of any one of its finished children (worker
+    pools). RUSAGE_CHILDREN reports that single largest child, not a sum,
+    so the two are kept apart rather than combined.
+    """
+    if resource is None:
+        return {"stage_peak_rss_mb": None, "child_max_rss_mb": None}
+    return {"stage_peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+            "child_max_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def stage_process(name, corpus, work_dir, workers, conn):
+    """Child process: run one stage quietly, send back its counts, wall time and peak_rss()."""
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    try:
+        start = time.perf_counter()
+        counts = STAGES[name](corpus, work_dir, workers)
+        seconds = time.perf_counter() - start
+        conn.send({"ok": True, "seconds": seconds, **peak_rss(), **counts})
+    except Exception as e:
+        conn.send({"ok": False, "error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_stage(name, corpus, work_dir, workers):
+    """Run a stage in a fresh process and return its measurements."""
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=stage_process, args=(name, corpus, work_dir, workers, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"ok": False, "error": "stage process died"}
+    process.join()
+
+    if result.get("ok"):
+        seconds = result["seconds"]
+        result["files_per_s"] = result["files"] / seconds if seconds else None
+        result["rows_per_s"] = result["rows"] / seconds if seconds else None
+    return result
+
+
+def run_benchmark(scales=SCALES, bench_dir=BENCH_DIR, results_path=RESULTS_PATH, workers=WORKERS,
+                  stages=None, keep_corpus=KEEP_CORPUS, verbose=True):
+    """
+    Generate each scale, time every stage on it and append the run to results_path.
+
+    Returns the run record that was written.
+    """
+    stages = stages or list(STAGES)
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": workers,
+        "scales": [],
+    }
+
+    for scale in scales:
+        scale_dir = os.path.join(bench_dir, f"scale_{scale}")
+        shutil.rmtree(scale_dir, ignore_errors=True)
+
+        start = time.perf_counter()
+        corpus = synthetic_corpus.generate_corpus(os.path.join(scale_dir, "corpus"), scale)
+        entry = {
+            "scale": scale,
+            "lenses": corpus["lenses"],
+            "export_files": corpus["export_files"],
+            "utf16_files": corpus["utf16_files"],
+            "empty_files": corpus["empty_files"],
+            "generate_seconds": time.perf_counter() - start,
+            "stages": {},
+        }
+        if verbose:
+            print(f"Scale {scale}: {corpus['lenses']} lenses, {corpus['export_files']} exports "
+                  f"({entry['generate_seconds']:.1f} s to generate)")
+
+        for name in stages:
+            result = run_stage(name, corpus, os.path.join(scale_dir, "work"), workers)
+            entry["stages"][name] = result
+            if verbose:
+                if result.get("ok"):
+                    rss, child = result["stage_peak_rss_mb"], result["child_max_rss_mb"]
+                    print(f"  {name:<14}{result['seconds']:8.2f} s  {result['files_per_s']:10.0f} files/s  "
+                          f"{result['rows_per_s']:12.0f} rows/s  "
+                          + (f"{rss:8.0f} MB stage peak, {child:6.0f} MB largest worker" if rss is not None else ""))
+                else:
+                    print(f"  ⚠️ {name} failed: {result['error']}")
+
+        run["scales"].append(entry)
+        if not keep_corpus:
+            shutil.rmtree(scale_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    return run
+
+
+if __name__ == "__main__":
+    run = run_benchmark()
+    print(json.dumps(run, indent=1))
+    print(f"\n✅ Results appended to {RESULTS_PATH}")
@@ -1,101 +1,149 @@
+'''
+Combine the per-lens CSVs of one analysis folder into a single CSV.
+
+Two passes, constant memory:
+  1. read only the header row of every file and build the union of all
+     column names (first-seen order, dict lookups);
+  2. stream every file's rows straight into the output, aligning each row
+     to the union schema and flushing through a bounded buffer.
+
+Optionally prepends a SourceFile or lens_id column. combine_csvs.py is a
+thin wrapper around combine_csvs() with the same settings as before.
+'''
+
 import os
 import csv
 
-# Define paths
-base_folder = r"C:\Users\Ruth\Documents\GitHub\2.156-Lens-Project\Prime Lenses + Data\CSVExports"
-
-# 0 = FieldCurvature, 1 = Longitudinal, 2 = RMSvField, 3 = Vignetting
-name = 2
-
-if name == 0:
-    input_folder = os.path.join(base_folder, "FieldCurvature")
-    output_combined = os.path.join(base_folder, "FieldCurvature.csv")
-elif name == 1:
-    input_folder = os.path.join(base_folder, "Longitudinal")
-    output_combined = os.path.join(base_folder, "Longitudinal.csv")
-elif name == 2:
-    input_folder = os.path.join(base_folder, "RMSvField")
-    output_combined = os.path.join(base_folder, "RMSvField.csv")
-elif name == 3:
-    input_folder = os.path.join(base_folder, "Vignetting")
-    output_combined = os.path.join(base_folder, "Vignetting.csv")
-else:
-    raise ValueError("Invalid value for 'name' (must be 0–3).")
-
-# Get all CSV files in the folder
-csv_files = [f for f in os.listdir(input_folder) if f.lower().endswith(".csv")]
-csv_files.sort()  # optional: sort for consistent order
-
-if not csv_files:
-    raise FileNotFoundError(f"No CSV files found in {input_folder}")
-
-# ---------------- Build global header set + collect rows ----------------
-global_headers = []       # union of all column names (in first-seen order)
-rows = []                 # list of dicts, one per data row
-
-# # Optional: include which file each row came from
-# add_source_col = True
-# source_col_name = "SourceFile"
-# if add_source_col:
-#     global_headers.append(source_col_name)
-
-for fname in csv_files:
-    fpath = os.path.join(input_folder, fname)
-    # print(f"Reading {fpath}")
-
-    with open(fpath, "r", encoding="utf-8", newline="") as infile:
-        reader = csv.reader(infile)
+from analysis_parser import OUTPUT_ROOT
+
+# ---------------- Settings ----------------
+ANALYSES = ["FieldCurvature", "Longitudinal", "RMSvField", "Vignetting"]
+BUFFER_ROWS = 10000          # rows held in memory before each write
+SOURCE_COLUMNS = ("SourceFile", "lens_id")
+
 
+def lens_id_from_filename(filename, analysis):
+    """Lens id from a '<lens>_<Analysis>.csv' file name."""
+    stem = os.path.splitext(filename)[0]
+    if stem.endswith(analysis):
+        stem = stem[:-len(analysis)]
+    return stem.strip("_ -")
+
+
+def read_header(path):
+    """Header row of a CSV (stripped), or None for an empty file."""
+    with open(path, "r", encoding="utf-8", newline="") as infile:
         try:
-            # Read header row
-            headers = next(reader)
+            return [h.strip() for h in next(csv.reader(infile))]
         except StopIteration:
-            # Empty file, skip
-            print(f"  ⚠️ Skipping {fname}: empty file")
+            return None
+
+# ---------------- Pass 1: Union Schema ----------------
+def union_headers(paths):
+    """
+    Read only the header rows and build the union schema.
+
+    Returns (global_headers, {path: header list}); files that are empty are
+    left out of the mapping.
+    """
+    global_index = {}        # column name -> position in the union (O(1) lookups)
+    file_headers = {}
+    for path in paths:
+        headers = read_header(path)
+        if headers is None:
+            print(f"  ⚠️ Skipping {os.path.basename(path)}: empty file")
             continue
-
-        # Strip whitespace from header names
-        headers = [h.strip() for h in headers]
-
-        # Update global header list with any new columns
+        file_headers[path] = headers
         for h in headers:
-            if h and h not in global_headers:
-                global_headers.append(h)
-
-        # Read data rows
-        for row in reader:
-            # Skip completely empty rows
-            if not any(cell.strip() for cell in row):
-                continue
-
-            row_dict = {}
-
-            # Map this file's columns into the row dict
-            for h, val in zip(headers, row):
-                h = h.strip()
-                if h:  # ignore empty header names just in case
-                    row_dict[h] = val
-
-            # # Track source file if requested
-            # if add_source_col:
-            #     row_dict[source_col_name] = fname
-
-            rows.append(row_dict)
-
-# ---------------- Write combined CSV ----------------
-print(f"\nWriting combined CSV to: {output_combined}")
-with open(output_combined, "w", encoding="utf-8", newline="") as outfile:
-    writer = csv.writer(outfile)
-
-    # Write unified header row
-    writer.writerow(global_headers)
-
-    # Write each data row, aligning columns by header name
-    for row_dict in rows:
-        row_out = [row_dict.get(col, "") for col in global_headers]
-        writer.writerow(row_out)
-
-print(f"✅ Combined CSV saved to: {output_combined}")
-print(f"   Total input files: {len(csv_files)}")
-print(f"   Total rows: {len(rows)}")
-print(f"   Total columns: {len(global_headers)}")
+            if h and h not in global_index:
+                global_index[h] = len(global_index)
+    return list(global_index), file_headers
+
+# ---------------- Pass 2: Streaming Rows ----------------
+def combine_csvs(paths, output_path, source_column=None, analysis="", buffer_rows=BUFFER_ROWS):
+    """
+    Stream the rows of every CSV in paths into output_path under the union schema.
+
+    source_column : None, "SourceFile" (file name) or "lens_id" (file name
+                    minus the _<analysis> suffix), written as the first column
+    Returns (number of files combined, number of rows, number of columns).
+    """
+    if source_column is not None and source_column not in SOURCE_COLUMNS:
+        raise ValueError(f"source_column must be one of {SOURCE_COLUMNS} or None")
+
+    global_headers, file_headers = union_headers(paths)
+    global_index = {h: i for i, h in enumerate(global_headers)}
+    n_cols = len(global_headers)
+    n_rows = 0
+
+    with open(output_path, "w", encoding="utf-8", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(([source_column] if source_column else []) + global_headers)
+        buffer = []
+
+        for path, headers in file_headers.items():
+            fname = os.path.basename(path)
+            # Where each of this file's columns lands in the union (None = unnamed column, dropped)
+            positions = [global_index[h] if h else None for h in headers]
+            prefix = []
+            if source_column == "SourceFile":
+                prefix = [fname]
+            elif source_column == "lens_id":
+                prefix = [lens_id_from_filename(fname, analysis)]
+
+            with open(path, "r", encoding="utf-8", newline="") as infile:
+                reader = csv.reader(infile)
+                next(reader, None)
+                for row in reader:
+                    # Skip completely empty rows
+                    if not any(cell.strip() for cell in row):
+                        continue
+                    row_out = [""] * n_cols
+                    for pos, val in zip(positions, row):
+                        if pos is not None:
+                            row_out[pos] = val
+                    buffer.append(prefix + row_out)
+                    if len(buffer) >= buffer_rows:
+                        writer.writerows(buffer)
+                        n_rows += len(buffer)
+                        buffer.clear()
+
+        writer.writerows(buffer)
+        n_rows += len(buffer)
+
+    return len(file_headers), n_rows, n_cols + (1 if source_column else 0)
+
+
+def combine_analysis(base_folder, analysis, output_path=None, source_column=None):
+    """Combine CSVExports/<analysis>/*.csv into CSVExports/<analysis>.csv (sorted file order)."""
+    input_folder = os.path.join(base_folder, analysis)
+    if output_path is None:
+        output_path = os.path.join(base_folder, analysis + ".csv")
+
+    csv_files = sorted(f for f in os.listdir(input_folder) if f.lower().endswith(".csv"))
+    if not csv_files:
+        raise FileNotFoundError(f"No CSV files found in {input_folder}")
+
+    paths = [os.path.join(input_folder, f) for f in csv_files]
+    print(f"\nWriting combined CSV to: {output_path}")
+    n_files, n_rows, n_cols = combine_csvs(paths, output_path, source_column, analysis)
+    print(f"✅ Combined CSV saved to: {output_path}")
+    print(f"   Total input files: {n_files}")
+    print(f"   Total rows: {n_rows}")
+    print(f"   Total columns: {n_cols}")
+    return output_path
+
+
+if __name__ == "__main__":
+    # Define paths
+    base_folder = OUTPUT_ROOT
+
+    # 0 = FieldCurvature, 1 = Longitudinal, 2 = RMSvField, 3 = Vignetting
+    name = 2
+    if name not in range(len(ANALYSES)):
+        raise ValueError("Invalid value for 'name' (must be 0–3).")
+
+    # None, "SourceFile" or "lens_id"
+    source_column = None
+
+    combine_analysis(base_folder, ANALYSES[name], source_column=source_column)
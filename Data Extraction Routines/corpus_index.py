@@ -0,0 +1,404 @@
+'''
+Persistent SQLite index of the lens corpus.
+
+One scan of the .zmx headers and the export folders fills corpus_index.sqlite
+(next to the lens files) so lookups and filters no longer re-list directories
+or re-parse prescriptions:
+
+  lenses        lens_id, title (NAME), FNUM / ENPD, field type, field and
+                wavelength counts, max field, primary wavelength, surface
+                count, stop surface, the paraxial EFL / EPD / F/# (EFL/EPD,
+                so also set for Float By Stop Size lenses, whose header FNUM
+                is NULL), plus the .zmx path / size / mtime
+  fields        lens_id, i, value          the YFLN entries in use
+  wavelengths   lens_id, i, um             the WAVM entries in use
+  glasses       lens_id, name, nd, vd      the catalog glasses a lens uses, with
+                the nd / Vd of its first GLAS record for the name that
+                materials.glass_record vouches for (NULL if none does)
+  exports       path, lens_id, analysis, kind, size, mtime, has_table
+                kind is "txt" (AnalysisExports), "csv" (CSVExports/<Analysis>)
+                or "lensdata" (LensDataExports); has_table is 1 only if a
+                table parses out of the file (an aborted analysis leaves a
+                .txt with a header and no table)
+
+update_index() only re-parses .zmx files whose size or mtime changed and
+drops rows of files that have gone away, so a refresh on an unchanged corpus
+is a directory walk plus a handful of stat calls; new or changed exports are
+parsed once to set has_table. The glasses rows stand in for the corpus-wide
+GLAS catalog of paraxial.scan_zmx(), so tracing the re-parsed lenses reads
+no other .zmx file; only lenses that lean on a catalog entry the refresh
+changed are re-parsed with them. find_lenses() answers
+filters such as "F/2 lenses with more than 10 surfaces missing an RMSvField
+export" with one indexed query.
+'''
+
+import os
+import sqlite3
+import time
+
+import paraxial
+from materials import model_glass
+from zmx_reader import DATA_DIR, LENS_DIR, read_zmx
+from analysis_parser import SERIES_PREFIX, grammar_for, iter_parse_tables
+from text_io import read_from_marker
+
+# ---------------- Paths ----------------
+INDEX_PATH = os.path.join(DATA_DIR, "corpus_index.sqlite")
+ANALYSIS_DIR = os.path.join(DATA_DIR, "AnalysisExports")
+CSV_DIR = os.path.join(DATA_DIR, "CSVExports")
+LENS_DATA_DIR = os.path.join(DATA_DIR, "LensDataExports")
+
+# ---------------- Settings ----------------
+INDEX_VERSION = 3             # bump when the schema changes; older files are rebuilt
+FNUM_TOLERANCE = 0.05         # relative F/# match window of find_lenses(fnum=...)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lenses (
+    lens_id            TEXT PRIMARY KEY,
+    title              TEXT,
+    fnum               REAL,
+    enpd               REAL,
+    field_type         INTEGER,
+    n_fields           INTEGER,
+    max_field          REAL,
+    n_wavelengths      INTEGER,
+    primary_wavelength REAL,
+    n_surfaces         INTEGER,
+    stop_surface       INTEGER,
+    efl                REAL,
+    epd                REAL,
+    paraxial_fnum      REAL,
+    path               TEXT NOT NULL,
+    size               INTEGER NOT NULL,
+    mtime              INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fields (
+    lens_id TEXT NOT NULL,
+    i       INTEGER NOT NULL,
+    value   REAL,
+    PRIMARY KEY (lens_id, i)
+);
+CREATE TABLE IF NOT EXISTS wavelengths (
+    lens_id TEXT NOT NULL,
+    i       INTEGER NOT NULL,
+    um      REAL,
+    PRIMARY KEY (lens_id, i)
+);
+CREATE TABLE IF NOT EXISTS glasses (
+    lens_id TEXT NOT NULL,
+    name    TEXT NOT NULL,
+    nd      REAL,
+    vd      REAL,
+    PRIMARY KEY (lens_id, name)
+);
+CREATE TABLE IF NOT EXISTS exports (
+    path     TEXT PRIMARY KEY,
+    lens_id  TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    kind     TEXT NOT NULL,
+    size      INTEGER NOT NULL,
+    mtime     INTEGER NOT NULL,
+    has_table INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lenses_fnum ON lenses (COALESCE(paraxial_fnum, fnum));
+CREATE INDEX IF NOT EXISTS lenses_surfaces ON lenses (n_surfaces);
+CREATE INDEX IF NOT EXISTS glasses_name ON glasses (name);
+CREATE INDEX IF NOT EXISTS exports_analysis ON exports (analysis, lens_id);
+CREATE INDEX IF NOT EXISTS exports_lens ON exports (lens_id);
+"""
+
+# ---------------- Connection ----------------
+def connect(path=INDEX_PATH):
+    """Open (creating if needed) the index; a file from an older INDEX_VERSION is emptied first."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+        for table in ("lenses", "fields", "wavelengths", "glasses", "exports"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+# ---------------- Scanning ----------------
+def finite_or_none(value):
+    """SQLite has no NaN; store missing numbers as NULL."""
+    return value if value == value else None
+
+
+def lens_files(lens_dir=LENS_DIR):
+    """{lens_id: path} of the .zmx / .ZMX files directly in lens_dir."""
+    found = {}
+    for entry in os.scandir(lens_dir):
+        if entry.is_file() and entry.name.lower().endswith(".zmx"):
+            found[os.path.splitext(entry.name)[0]] = entry.path
+    return found
+
+
+def export_files(analysis_dir=ANALYSIS_DIR, csv_dir=CSV_DIR, lens_data_dir=LENS_DATA_DIR):
+    """
+    {path: (lens_id, analysis, kind)} for every <lens>_<Analysis>.txt / .csv
+    export. Files without an "_<Analysis>" suffix (Lenses_Vignetting.csv,
+    summary tables) are not exports and are skipped.
+    """
+    found = {}
+    for root, kind, ext in ((analysis_dir, "txt", ".txt"), (csv_dir, "csv", ".csv"),
+                            (lens_data_dir, "lensdata", ".csv")):
+        if not os.path.isdir(root):
+            continue
+        for subdir, _, files in os.walk(root):
+            for filename in files:
+                stem, file_ext = os.path.splitext(filename)
+                if file_ext.lower() != ext or "_" not in stem:
+                    continue
+                lens_id, analysis = stem.rsplit("_", 1)
+                # CSVExports/<Analysis>/<lens>_<Analysis>.csv; skip the summary tables at its top level
+                if kind == "csv" and os.path.basename(subdir) != analysis:
+                    continue
+                found[os.path.join(subdir, filename)] = (lens_id, analysis, kind)
+    return found
+
+
+def export_has_table(path, kind):
+    """
+    True if the export holds at least one table: a parsed table series for
+    a .txt, a header plus a data row for a .csv.
+    """
+    if kind == "txt":
+        grammar = grammar_for(os.path.basename(path))
+        text = read_from_marker(path, SERIES_PREFIX)
+        return grammar is not None and next(iter_parse_tables(text, grammar), None) is not None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        header, first_row = f.readline(), f.readline()
+    return bool(header.strip() and first_row.strip())
+
+
+def lens_glasses(system):
+    """
+    {glass name: (nd, Vd) or None} of the catalog glasses of a read_zmx()
+    system, each with its first GLAS record that vouches for one (the
+    record paraxial.scan_zmx() would take from this file).
+    """
+    found = {}
+    for surface in system["surfaces"]:
+        name = surface["Material"].strip().upper()
+        # Air and ___BLANK model glasses ("n,V") are not catalog entries
+        if not name or model_glass(name):
+            continue
+        if found.get(name) is None:
+            found[name] = surface["model_glass"]
+    return found
+
+
+def lens_row(lens_id, path, st):
+    """
+    (lenses row, field values, wavelengths, glasses, prescription, stop)
+    parsed from one .zmx file; the paraxial columns of the row are left
+    NULL for trace_lenses() to fill in.
+    """
+    system, rows = read_zmx(path)
+    prescription, stop = paraxial.system_prescription(system, rows)
+    ftyp, fields, waves = system["ftyp"], system["fields"], system["wavelengths"]
+    primary = system["primary_wavelength"]
+    finite_fields = [abs(f) for f in fields if f == f]
+    row = (lens_id, system["name"], finite_or_none(system["fnum"]), finite_or_none(system["enpd"]),
+           ftyp[0] if ftyp else None, len(fields), max(finite_fields) if finite_fields else None,
+           len(waves), finite_or_none(waves[primary - 1]) if 0 < primary <= len(waves) else None,
+           len(system["surfaces"]), system["stop"], None, None, None, path, st.st_size, st.st_mtime_ns)
+    return row, fields, waves, lens_glasses(system), prescription, stop
+
+
+def glass_catalog(conn):
+    """
+    {glass name: (nd, Vd)} from the glasses rows, as paraxial.scan_zmx()
+    builds it from the files: the first file (by name) to vouch for a glass
+    wins.
+    """
+    rows = conn.execute("SELECT l.path, g.name, g.nd, g.vd FROM glasses g JOIN lenses l USING (lens_id) "
+                        "WHERE g.nd IS NOT NULL")
+    catalog = {}
+    for _, name, nd, vd in sorted(rows, key=lambda row: os.path.basename(row[0])):
+        catalog.setdefault(name, (nd, vd))
+    return catalog
+
+
+def catalog_users(conn, names):
+    """lens_ids whose glasses named in names have no nd / Vd of their own (they resolve through the catalog)."""
+    names = sorted(names)
+    return {row[0] for row in conn.execute(
+        f"SELECT DISTINCT lens_id FROM glasses WHERE nd IS NULL AND name IN ({', '.join('?' * len(names))})", names)}
+
+
+def trace_lenses(conn, prescriptions, stops, catalog):
+    """
+    Fill the paraxial EFL / EPD / F/# columns of the given lenses with one
+    batched paraxial.first_order() call, resolving catalog glasses through
+    catalog (glass_catalog()).
+    """
+    results = paraxial.first_order(prescriptions, catalog=catalog, stops=stops)
+    conn.executemany("UPDATE lenses SET efl = ?, epd = ?, paraxial_fnum = ? WHERE lens_id = ?", [
+        (finite_or_none(float(results["efl"][i])), finite_or_none(float(results["epd"][i])),
+         finite_or_none(float(results["fnum"][i])), lens_id)
+        for i, lens_id in enumerate(results["lens_id"])])
+
+# ---------------- Refresh ----------------
+def delete_lens(conn, lens_id):
+    """Drop a lens and its field / wavelength / glass rows."""
+    for table in ("lenses", "fields", "wavelengths", "glasses"):
+        conn.execute(f"DELETE FROM {table} WHERE lens_id = ?", (lens_id,))
+
+
+def update_index(conn, lens_dir=LENS_DIR, analysis_dir=ANALYSIS_DIR, csv_dir=CSV_DIR,
+                 lens_data_dir=LENS_DATA_DIR):
+    """
+    Bring the index up to date with the files on disk in one transaction.
+
+    Lenses whose .zmx size and mtime match their row are trusted without
+    being read. The lenses that are parsed are traced together at the end,
+    with the glass catalog of the updated glasses rows; unchanged lenses
+    are re-read and traced with them only if a catalog glass they use
+    without a record of their own changed. Export rows only need a stat,
+    plus one parse for those that are new or changed. Returns a dict of
+    counts (lenses parsed / removed / retraced for a catalog change,
+    exports added or changed / removed).
+    """
+    counts = {"lenses_parsed": 0, "lenses_removed": 0, "lenses_retraced": 0,
+              "exports_changed": 0, "exports_removed": 0}
+    with conn:
+        known = {row["lens_id"]: (row["size"], row["mtime"])
+                 for row in conn.execute("SELECT lens_id, size, mtime FROM lenses")}
+        current = lens_files(lens_dir)
+        before = glass_catalog(conn)
+        prescriptions, stops, read = {}, {}, set()
+        for lens_id in known.keys() - current.keys():
+            delete_lens(conn, lens_id)
+            counts["lenses_removed"] += 1
+        for lens_id, path in current.items():
+            st = os.stat(path)
+            if known.get(lens_id) == (st.st_size, st.st_mtime_ns):
+                continue
+            read.add(lens_id)
+            try:
+                row, fields, waves, glasses, prescription, stop = lens_row(lens_id, path, st)
+            except Exception as e:
+                print(f"⚠️ Skipping {os.path.basename(path)}: could not parse ({e})")
+                continue
+            delete_lens(conn, lens_id)
+            conn.execute(f"INSERT INTO lenses VALUES ({', '.join('?' * len(row))})", row)
+            conn.executemany("INSERT INTO fields VALUES (?, ?, ?)",
+                             [(lens_id, i, finite_or_none(v)) for i, v in enumerate(fields)])
+            conn.executemany("INSERT INTO wavelengths VALUES (?, ?, ?)",
+                             [(lens_id, i, finite_or_none(v)) for i, v in enumerate(waves)])
+            conn.executemany("INSERT INTO glasses VALUES (?, ?, ?, ?)",
+                             [(lens_id, name, *(nd_vd or (None, None))) for name, nd_vd in glasses.items()])
+            if prescription is not None:
+                prescriptions[lens_id] = prescription
+                if stop is not None:
+                    stops[lens_id] = stop
+            counts["lenses_parsed"] += 1
+
+        # Unchanged lenses that resolve a glass through a catalog entry that moved
+        catalog = glass_catalog(conn)
+        moved = {name for name in before.keys() | catalog.keys() if before.get(name) != catalog.get(name)}
+        for lens_id in sorted(catalog_users(conn, moved) - read) if moved else ():
+            prescription, stop = paraxial.zmx_prescription(current[lens_id])
+            if prescription is not None:
+                prescriptions[lens_id] = prescription
+                if stop is not None:
+                    stops[lens_id] = stop
+                counts["lenses_retraced"] += 1
+        if prescriptions:
+            trace_lenses(conn, prescriptions, stops, catalog)
+
+        known = {row["path"]: (row["size"], row["mtime"])
+                 for row in conn.execute("SELECT path, size, mtime FROM exports")}
+        current = export_files(analysis_dir, csv_dir, lens_data_dir)
+        changed = []
+        for path, (lens_id, analysis, kind) in current.items():
+            st = os.stat(path)
+            if known.get(path) == (st.st_size, st.st_mtime_ns):
+                continue
+            try:
+                has_table = export_has_table(path, kind)
+            except Exception as e:
+                print(f"⚠️ {os.path.basename(path)}: could not parse ({e}), indexed as holding no table")
+                has_table = False
+            changed.append((path, lens_id, analysis, kind, st.st_size, st.st_mtime_ns, int(has_table)))
+        conn.executemany("INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?, ?, ?, ?)", changed)
+        removed = [(path,) for path in known.keys() - current.keys()]
+        conn.executemany("DELETE FROM exports WHERE path = ?", removed)
+        counts["exports_changed"], counts["exports_removed"] = len(changed), len(removed)
+    return counts
+
+# ---------------- Queries ----------------
+def find_lenses(conn, fnum=None, fnum_tolerance=FNUM_TOLERANCE, min_surfaces=None, max_surfaces=None,
+                has=(), missing=(), kind=None):
+    """
+    lens_ids (sorted) matching every given filter:
+
+      fnum            paraxial F/# (EFL/EPD; the header FNUM where the trace
+                      failed) within ±fnum_tolerance (relative) of this
+      min_surfaces / max_surfaces
+                      bounds on the surface count (object and image included)
+      has / missing   analyses that must / must not have an export holding
+                      a table, of the given kind ("txt", "csv", "lensdata")
+                      or any kind
+    """
+    where, params = [], []
+    if fnum is not None:
+        where.append("COALESCE(l.paraxial_fnum, l.fnum) BETWEEN ? AND ?")
+        params += [fnum * (1 - fnum_tolerance), fnum * (1 + fnum_tolerance)]
+    if min_surfaces is not None:
+        where.append("l.n_surfaces >= ?")
+        params.append(min_surfaces)
+    if max_surfaces is not None:
+        where.append("l.n_surfaces <= ?")
+        params.append(max_surfaces)
+    kind_filter = " AND e.kind = ?" if kind else ""
+    for analyses, negate in ((has, ""), (missing, "NOT ")):
+        for analysis in ([analyses] if isinstance(analyses, str) else analyses):
+            where.append(f"{negate}EXISTS (SELECT 1 FROM exports e WHERE e.lens_id = l.lens_id "
+                         f"AND e.analysis = ? AND e.has_table = 1{kind_filter})")
+            params += [analysis] + ([kind] if kind else [])
+    sql = "SELECT l.lens_id FROM lenses l"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return [row[0] for row in conn.execute(sql + " ORDER BY l.lens_id", params)]
+
+
+def lens_info(conn, lens_id):
+    """One lenses row as a dict with its 'fields' and 'wavelengths' lists and {analysis: [kinds]} 'exports', or None."""
+    row = conn.execute("SELECT * FROM lenses WHERE lens_id = ?", (lens_id,)).fetchone()
+    if row is None:
+        return None
+    info = dict(row)
+    info["fields"] = [r[0] for r in conn.execute("SELECT value FROM fields WHERE lens_id = ? ORDER BY i", (lens_id,))]
+    info["wavelengths"] = [r[0] for r in conn.execute("SELECT um FROM wavelengths WHERE lens_id = ? ORDER BY i",
+                                                      (lens_id,))]
+    info["exports"] = {}
+    for r in conn.execute("SELECT analysis, kind FROM exports WHERE lens_id = ? AND has_table = 1 ORDER BY analysis, kind",
+                          (lens_id,)):
+        info["exports"].setdefault(r["analysis"], []).append(r["kind"])
+    return info
+
+
+def export_counts(conn):
+    """{(analysis, kind): lenses with an export holding a table}."""
+    return {(r[0], r[1]): r[2] for r in conn.execute(
+        "SELECT analysis, kind, COUNT(DISTINCT lens_id) FROM exports WHERE has_table = 1 GROUP BY analysis, kind")}
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    conn = connect(INDEX_PATH)
+    counts = update_index(conn)
+    n_lenses = conn.execute("SELECT COUNT(*) FROM lenses").fetchone()[0]
+    print(f"✅ Indexed {n_lenses} lenses to {INDEX_PATH} ({time.perf_counter() - start:.2f} s): {counts}")
+    for (analysis, kind), n in sorted(export_counts(conn).items()):
+        print(f"   {analysis:<16} {kind:<9} {n}")
+
+    start = time.perf_counter()
+    matches = find_lenses(conn, fnum=2.0, min_surfaces=11, missing="RMSvField")
+    print(f"F/2 lenses with > 10 surfaces and no RMSvField export: {len(matches)} "
+          f"({(time.perf_counter() - start) * 1e3:.1f} ms)")
+    conn.close()
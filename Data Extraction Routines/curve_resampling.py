@@ -0,0 +1,270 @@
+'''
+Resample every analysis curve onto one common grid for cross-lens work.
+
+The exports come out on lens-specific axes (Y Angle in degrees or Y Field
+in mm, each lens up to its own maximum field, its own wavelength set).
+This stage puts every curve of every lens on GRID_POINTS points of the
+normalized axis (field / max field, or relative pupil) and stacks them in
+one dense float32 tensor:
+
+    values       (lenses, channels, GRID_POINTS)   NaN where a lens lacks the curve
+    axis_max     (lenses, channels)                 the axis value at 1.0 (max field, ...)
+    wavelengths  (lenses, len(WAVELENGTH_SLOTS))    the µm each slot was filled from
+
+A channel is one value column of one analysis at one wavelength slot, e.g.
+"FieldCurvature/tan_shift@d" or "RMSvField/rms_radius@poly". Curves are
+assigned to the reference wavelength (F, d, C) they sit closest to, within
+WAVELENGTH_TOLERANCE, so lenses exported at 0.4861 and 0.486133 µm line up.
+
+Parsing stays per table (through lens_store's long-form layouts); the
+resampling is one batched linear interpolation over all curves at once.
+The tensor is cached in LensStore/curves.npz with the size / mtime of every
+export, and refresh_tensor() only re-reads lenses whose exports changed.
+'''
+
+import os
+import json
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from analysis_parser import ROOT_DIR, iter_tables
+from lens_store import DATA_DIR, LAYOUTS, table_columns
+
+# ---------------- Paths ----------------
+CACHE_PATH = os.path.join(DATA_DIR, "LensStore", "curves.npz")
+
+# ---------------- Settings ----------------
+GRID_POINTS = 32              # samples per curve on the normalized axis
+WAVELENGTH_SLOTS = {"F": 0.486133, "d": 0.587562, "C": 0.656273}
+WAVELENGTH_TOLERANCE = 0.02   # µm; curves further from every slot are dropped
+
+# analysis -> wavelength slots of its channels: per-wavelength analyses get
+# one channel per slot (RMSvField also its polychromatic curve), the rest one
+SLOTS = {
+    "FieldCurvature": list(WAVELENGTH_SLOTS),
+    "Longitudinal": list(WAVELENGTH_SLOTS),
+    "RMSvField": ["poly"] + list(WAVELENGTH_SLOTS),
+    "Vignetting": [None],
+}
+
+
+def value_columns(analysis):
+    """Value columns of an analysis in lens_store's long form."""
+    layout = LAYOUTS[analysis]
+    return [layout["melt"]] if "melt" in layout else layout["columns"]
+
+
+def channel_name(analysis, column, slot):
+    return f"{analysis}/{column}" + (f"@{slot}" if slot else "")
+
+
+CHANNELS = [channel_name(analysis, column, slot)
+            for analysis, slots in SLOTS.items() for column in value_columns(analysis) for slot in slots]
+CHANNEL_INDEX = {name: c for c, name in enumerate(CHANNELS)}
+GRID = np.linspace(0.0, 1.0, GRID_POINTS)
+
+CurveTensor = namedtuple("CurveTensor", ["lens_ids", "channels", "grid", "values", "axis_max", "wavelengths",
+                                         "signature"])
+
+# ---------------- Batched Interpolation ----------------
+def batch_interp(curve, x, y, n_curves, grid=GRID):
+    """
+    Linear interpolation of many ragged curves at once.
+
+    curve, x, y : equal-length arrays, point i belongs to curve[i]
+    Returns ((n_curves, len(grid)) values on grid * max x of each curve, max x
+    per curve). Like np.interp, values past the ends are clamped; curves
+    with fewer than two finite points, or no positive x, are NaN.
+    """
+    keep = np.isfinite(x) & np.isfinite(y)
+    curve, x, y = curve[keep], x[keep], y[keep]
+    if not curve.size:
+        return np.full((n_curves, len(grid)), np.nan), np.full(n_curves, np.nan)
+    order = np.lexsort((x, curve))
+    curve, x, y = curve[order], x[order], y[order]
+
+    counts = np.bincount(curve, minlength=n_curves)
+    offsets = np.zeros(n_curves + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    x_max = np.full(n_curves, np.nan)
+    filled = counts > 0
+    x_max[filled] = x[offsets[1:][filled] - 1]
+    valid = (counts >= 2) & (x_max > 0)
+
+    # One sorted key over all curves: normalized x lies in [-1, 1], so curve c owns [4c - 1, 4c + 1]
+    key = x / np.where(valid, x_max, 1.0)[curve] + 4.0 * curve
+    query = grid[None, :] + 4.0 * np.arange(n_curves)[:, None]
+    lo = np.searchsorted(key, query, side="right") - 1
+    # Stay on a segment inside the curve (clamped at its ends, like np.interp)
+    lo = np.clip(lo, offsets[:-1, None], np.maximum(offsets[1:, None] - 2, offsets[:-1, None]))
+    lo = np.minimum(lo, key.size - 1)
+    hi = np.minimum(lo + 1, key.size - 1)
+    span = key[hi] - key[lo]
+    t = np.clip(np.divide(query - key[lo], span, out=np.zeros_like(query), where=span > 0), 0.0, 1.0)
+    values = y[lo] + t * (y[hi] - y[lo])
+    values[~valid] = np.nan
+    return values, np.where(valid, x_max, np.nan)
+
+# ---------------- Collection ----------------
+def wavelength_slot(wavelength):
+    """Slot name for a curve wavelength in µm ("poly" for NaN), or None if none is close enough."""
+    if not np.isfinite(wavelength):
+        return "poly"
+    names = list(WAVELENGTH_SLOTS)
+    distance = np.abs(np.array(list(WAVELENGTH_SLOTS.values())) - wavelength)
+    best = int(np.argmin(distance))
+    return names[best] if distance[best] <= WAVELENGTH_TOLERANCE else None
+
+
+def collect_points(lens_ids, root_dir=ROOT_DIR, analyses=None):
+    """
+    Parse the exports of lens_ids into flat (curve id, x, y) point arrays,
+    curve id = lens row * len(CHANNELS) + channel, plus the (lenses, slots)
+    wavelengths the slots were filled from. The first curve found for a
+    channel wins if two wavelengths land in the same slot. analyses limits
+    which exports are read (their channels in other lenses stay NaN).
+    """
+    row = {lens_id: i for i, lens_id in enumerate(lens_ids)}
+    slot_index = {name: s for s, name in enumerate(WAVELENGTH_SLOTS)}
+    wavelengths = np.full((len(lens_ids), len(WAVELENGTH_SLOTS)), np.nan)
+    curves, xs, ys, seen = [], [], [], set()
+    if not lens_ids:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), wavelengths
+
+    for table in iter_tables(root_dir, analyses or list(SLOTS), set(lens_ids)):
+        analysis, r = table.analysis, row[table.lens_id]
+        _, axis, table_wavelengths, values = table_columns(LAYOUTS[analysis], table.headers, table.wavelength,
+                                                           table.block)
+        # Rows of one wavelength are contiguous (melted curves or one table per wavelength)
+        for wavelength in dict.fromkeys(table_wavelengths.tolist()):
+            slot = wavelength_slot(wavelength) if SLOTS[analysis] != [None] else None
+            if slot not in SLOTS[analysis]:
+                continue
+            rows = table_wavelengths == wavelength if np.isfinite(wavelength) else np.isnan(table_wavelengths)
+            if slot in slot_index and np.isnan(wavelengths[r, slot_index[slot]]):
+                wavelengths[r, slot_index[slot]] = wavelength
+            for column in value_columns(analysis):
+                curve = r * len(CHANNELS) + CHANNEL_INDEX[channel_name(analysis, column, slot)]
+                if curve in seen:
+                    continue
+                seen.add(curve)
+                curves.append(np.full(int(rows.sum()), curve, dtype=np.int64))
+                xs.append(axis[rows])
+                ys.append(values[column][rows])
+
+    def concat(parts, dtype=np.float64):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    return concat(curves, np.int64), concat(xs), concat(ys), wavelengths
+
+
+def resample_lenses(lens_ids, root_dir=ROOT_DIR, grid=GRID, analyses=None):
+    """(values, axis_max, wavelengths) for lens_ids, in their order; see the module docstring for shapes."""
+    curve, x, y, wavelengths = collect_points(lens_ids, root_dir, analyses)
+    n_curves = len(lens_ids) * len(CHANNELS)
+    values, x_max = batch_interp(curve, x, y, n_curves, grid)
+    return (values.astype(np.float32).reshape(len(lens_ids), len(CHANNELS), len(grid)),
+            x_max.reshape(len(lens_ids), len(CHANNELS)), wavelengths)
+
+# ---------------- Cache ----------------
+def lens_folders(root_dir=ROOT_DIR):
+    """Sorted lens ids (sub-folders) of AnalysisExports."""
+    return sorted(entry.name for entry in os.scandir(root_dir) if entry.is_dir())
+
+
+def signature(lens_id, root_dir=ROOT_DIR):
+    """(size, mtime_ns) of each analysis export of a lens, 0 for missing ones."""
+    values = []
+    for analysis in SLOTS:
+        try:
+            st = os.stat(os.path.join(root_dir, lens_id, f"{lens_id}_{analysis}.txt"))
+            values += [st.st_size, st.st_mtime_ns]
+        except OSError:
+            values += [0, 0]
+    return values
+
+
+def cache_settings():
+    """Everything that changes the tensor layout; a mismatch forces a full rebuild."""
+    return {"channels": CHANNELS, "points": GRID_POINTS, "slots": WAVELENGTH_SLOTS,
+            "tolerance": WAVELENGTH_TOLERANCE}
+
+
+def save_tensor(tensor, path=CACHE_PATH):
+    """Write the tensor as one uncompressed .npz, atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, settings=np.array(json.dumps(cache_settings())), **tensor._asdict())
+    os.replace(tmp_path, path)
+
+
+def load_tensor(path=CACHE_PATH):
+    """The cached tensor, or None if it is missing or was built with other settings."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if json.loads(str(data["settings"])) != json.loads(json.dumps(cache_settings())):
+                return None
+            return CurveTensor(**{field: data[field] for field in CurveTensor._fields})
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def refresh_tensor(path=CACHE_PATH, root_dir=ROOT_DIR, verbose=False):
+    """
+    Bring the cached tensor up to date with AnalysisExports and return it:
+    only lenses whose exports changed (or are new) are parsed again.
+    """
+    old = load_tensor(path)
+    lens_ids = lens_folders(root_dir)
+    signatures = np.array([signature(lens_id, root_dir) for lens_id in lens_ids], dtype=np.int64)
+    stored = {} if old is None else {str(lens_id): i for i, lens_id in enumerate(old.lens_ids)}
+    changed = [i for i, lens_id in enumerate(lens_ids)
+               if lens_id not in stored or not np.array_equal(old.signature[stored[lens_id]], signatures[i])]
+    removed = len(stored.keys() - set(lens_ids))
+    if old is not None and not changed and not removed:
+        return old
+
+    n = len(lens_ids)
+    values = np.full((n, len(CHANNELS), GRID_POINTS), np.nan, dtype=np.float32)
+    axis_max = np.full((n, len(CHANNELS)), np.nan)
+    wavelengths = np.full((n, len(WAVELENGTH_SLOTS)), np.nan)
+    kept = sorted(set(range(n)) - set(changed))
+    if kept:
+        source = [stored[lens_ids[i]] for i in kept]
+        values[kept], axis_max[kept], wavelengths[kept] = old.values[source], old.axis_max[source], \
+            old.wavelengths[source]
+    if changed:
+        values[changed], axis_max[changed], wavelengths[changed] = \
+            resample_lenses([lens_ids[i] for i in changed], root_dir)
+
+    tensor = CurveTensor(np.array(lens_ids, dtype=str), np.array(CHANNELS, dtype=str), GRID, values, axis_max,
+                         wavelengths, signatures.reshape(n, -1))
+    save_tensor(tensor, path)
+    if verbose:
+        print(f"Resampled {len(changed)} lenses, dropped {removed}")
+    return tensor
+
+
+def channel(tensor, name):
+    """(lenses, points) view of one channel."""
+    return tensor.values[:, CHANNEL_INDEX[name]]
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    tensor = refresh_tensor(verbose=True)
+    built = time.perf_counter()
+    tensor = refresh_tensor()
+    refreshed = time.perf_counter()
+    print(f"✅ Curve tensor {tensor.values.shape} ({tensor.values.nbytes / 1e6:.1f} MB) in {CACHE_PATH} "
+          f"({built - start:.2f} s to build, {refreshed - built:.3f} s to refresh unchanged)")
+
+    # Cross-lens statistics are now plain array reductions
+    present = np.isfinite(tensor.values[:, :, 0]).sum(axis=0)
+    for name in ["RMSvField/rms_radius@poly", "Vignetting/rel_illumination", "FieldCurvature/distortion@d"]:
+        median = np.nanmedian(channel(tensor, name), axis=0)
+        print(f"   {name:<30} {present[CHANNEL_INDEX[name]]:5d} lenses, median at 0 / 0.5 / 1: "
+              f"{median[0]:.4g} / {median[GRID_POINTS // 2]:.4g} / {median[-1]:.4g}")
@@ -0,0 +1,101 @@
+'''
+Content-hash manifest for incremental re-extraction.
+
+Stored next to CSVExports as extraction_manifest.json. Every tracked input
+(AnalysisExports .txt, LensDataExports .csv) is recorded with its size,
+mtime and content hash plus the outputs written from it, so a refresh only
+re-parses files that actually changed and can delete outputs whose source
+has disappeared.
+'''
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = "extraction_manifest.json"
+MANIFEST_VERSION = 1
+HASH_CHUNK = 1 << 20
+
+
+def manifest_key(path, base_dir):
+    """Portable manifest key: path relative to base_dir with forward slashes."""
+    return os.path.relpath(path, base_dir).replace(os.sep, "/")
+
+
+def file_hash(path):
+    """blake2b content hash of a file, read in 1 MiB chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    """Load a manifest, or return an empty one if it is missing, unreadable or outdated."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION}
+    return manifest
+
+
+def save_manifest(manifest, path):
+    """Write the manifest atomically (temp file + rename) so an interrupted run never corrupts it."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def refresh_section(manifest, section, paths, base_dir):
+    """
+    Bring one manifest section up to date with the files currently on disk.
+
+    Files whose size and mtime match their record are trusted without being
+    read; anything else is re-hashed, so a touched-but-identical file is not
+    reported as changed.
+
+    Returns (changed, removed): manifest keys of new or modified inputs, and
+    the records {key: record} of inputs that no longer exist.
+    """
+    previous = manifest.get(section, {})
+    current = {}
+    changed = []
+
+    for path in paths:
+        key = manifest_key(path, base_dir)
+        st = os.stat(path)
+        old = previous.get(key)
+        if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime_ns:
+            current[key] = old
+            continue
+
+        digest = file_hash(path)
+        current[key] = {
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "hash": digest,
+            "outputs": old["outputs"] if old else [],
+        }
+        if not old or old["hash"] != digest:
+            changed.append(key)
+
+    removed = {key: record for key, record in previous.items() if key not in current}
+    manifest[section] = current
+    return changed, removed
+
+
+def remove_outputs(records, output_root):
+    """Delete the outputs recorded for inputs that have gone away. Returns how many were deleted."""
+    deleted = 0
+    for record in records.values():
+        for output in record.get("outputs", []):
+            output_path = os.path.join(output_root, *output.split("/"))
+            if os.path.exists(output_path):
+                os.remove(output_path)
+                deleted += 1
+    return deleted
@@ -0,0 +1,278 @@
+'''
+Batch Lens Data Editor export over ZOS-API.
+
+Loads every lens of a folder into one OpticStudio session and reads its LDE
+into LensDataExports rows (the Surface..A16 schema of zmx_reader.COLUMNS),
+then packs the whole folder into the prescription store in one write.
+
+ZOS-API has no whole-table getter for the LDE, so every .NET round-trip
+counts. Two readers:
+
+  "cells"     one GetSurfaceAt per row, the seven row properties read once
+              each, and Par cells only for the surface types whose
+              coefficients the LDE reports (even asphere terms, the focal
+              length of a paraxial surface) instead of probing A4/A6/A8 on
+              every row with nested fallbacks (the default)
+  "snapshot"  one SaveAs of the loaded system to a scratch .zmx: a single
+              interop call per lens, but the rows are then just
+              zmx_reader's parse of that saved file, so it reads nothing
+              zmx_reader could not already read from the lens file itself
+
+read_lde() only needs an object with NumberOfSurfaces / GetSurfaceAt and
+rows with the ILDERow properties, so mock_lde() stands in for the editor
+off Windows. Off Windows, __main__ reads MOCK_SURFACES (a hand-written LDE
+holding its Par cells the way OpticStudio does, independent of
+zmx_reader) through the mock and checks the rows against MOCK_EXPECTED.
+'''
+
+import os
+import math
+import time
+import tempfile
+from types import SimpleNamespace
+
+import paraxial
+import prescription_store
+from zmx_reader import EVEN_ORDERS, LENS_DIR, read_zmx, write_lens_csv
+
+# ---------------- Settings ----------------
+METHOD = "cells"              # "cells" (row-by-row reads) or "snapshot" (one SaveAs per lens, re-parsed)
+LENS_EXTENSIONS = (".zmx", ".zar")
+
+# ILDERow properties -> LensDataExports column, with the value a failed read leaves
+ROW_PROPERTIES = [
+    ("TypeName", "TypeName", ""),
+    ("Comment", "Comment", ""),
+    ("Radius", "Radius", math.nan),
+    ("Thickness", "Thickness", math.nan),
+    ("Material", "Material", ""),
+    ("SemiDiameter", "SemiDiameter", math.nan),
+    ("Conic", "Conic", math.nan),
+]
+
+# Surface type -> [(LensDataExports column, Par cell number)] the LDE reports
+PAR_CELLS = {
+    "Even Asphere": [(f"A{order}", n) for n, order in enumerate(EVEN_ORDERS, start=1)],
+    "Paraxial": [("A2", 1)],
+}
+
+# ---------------- Row Reading ----------------
+def par_columns(zosapi):
+    """{Par cell number: SurfaceColumn} for GetSurfaceCell, looked up once per session."""
+    surface_column = zosapi.Editors.LDE.SurfaceColumn
+    return {n: getattr(surface_column, f"Par{n}") for n in range(1, len(EVEN_ORDERS) + 1)}
+
+
+def cast_value(value, default):
+    """A .NET property value as str / float like the default; None and failed casts give the default."""
+    if value is None:
+        return default
+    try:
+        return str(value) if isinstance(default, str) else float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def read_property(row, name, default):
+    """One row property, or default if the getter throws (some special rows do)."""
+    try:
+        return cast_value(getattr(row, name), default)
+    except Exception:
+        return default
+
+
+def read_row(surface, row, columns):
+    """
+    One LensDataExports row from an ILDERow: every property read once, Par
+    cells only for types listed in PAR_CELLS (other coefficients are NaN,
+    as in the MATLAB export).
+    """
+    record = {"Surface": surface}
+    for name, column, default in ROW_PROPERTIES:
+        record[column] = read_property(row, name, default)
+    for order in EVEN_ORDERS:
+        record[f"A{order}"] = math.nan
+    for column, n in PAR_CELLS.get(record["TypeName"], []):
+        try:
+            record[column] = cast_value(row.GetSurfaceCell(columns[n]).DoubleValue, math.nan)
+        except Exception:
+            pass
+    # The LDE reports a paraxial or coordinate-break conic as Inf; match the exports
+    if record["TypeName"] in ("Paraxial", "Coordinate Break"):
+        record["Conic"] = math.inf
+    if record["TypeName"] == "Coordinate Break" and not record["Material"]:
+        record["Material"] = "-"
+    return record
+
+
+def read_lde(lde, columns):
+    """Every surface of an LDE (object surface 0 to image) as LensDataExports rows."""
+    rows = []
+    for i in range(lde.NumberOfSurfaces):
+        try:
+            row = lde.GetSurfaceAt(i)
+        except Exception as e:
+            print(f"⚠️ Could not GetSurfaceAt({i}): {e}")
+            continue
+        rows.append(read_row(i, row, columns))
+    return rows
+
+
+def snapshot_rows(system, scratch_dir):
+    """The loaded system's rows from one SaveAs to a scratch .zmx (parsed by zmx_reader)."""
+    path = os.path.join(scratch_dir, "lde_snapshot.zmx")
+    system.SaveAs(path)
+    try:
+        return read_zmx(path)[1]
+    finally:
+        os.remove(path)
+
+# ---------------- Mock Editor ----------------
+# A hand-written LDE: (ILDERow properties, {Par cell: value}) per row, the Par
+# cells as OpticStudio holds them. Even Asphere Par1..Par8 are the r^2..r^16
+# terms, Paraxial Par1 / Par2 the focal length and OPD mode, Coordinate
+# Break Par1..Par6 the decenters, tilts and order; Standard rows have none.
+MOCK_SURFACES = [
+    ({"TypeName": "Standard", "Comment": "", "Radius": math.inf, "Thickness": math.inf, "Material": "",
+      "SemiDiameter": 0.0, "Conic": 0.0}, {}),
+    ({"TypeName": "Even Asphere", "Comment": "front", "Radius": 25.0, "Thickness": 4.0, "Material": "N-BK7",
+      "SemiDiameter": 10.0, "Conic": -0.5},
+     {1: 1e-3, 2: -1.2e-5, 3: 3.4e-8, 4: -5.6e-11, 5: 7.8e-14, 6: 0.0, 7: 0.0, 8: -9.1e-20}),
+    ({"TypeName": "Standard", "Comment": "", "Radius": -80.0, "Thickness": 2.0, "Material": "",
+      "SemiDiameter": 9.5, "Conic": 0.0}, {}),
+    ({"TypeName": "Coordinate Break", "Comment": "tilt", "Radius": math.inf, "Thickness": 0.0, "Material": "",
+      "SemiDiameter": 0.0, "Conic": 0.0}, {1: 0.1, 2: -0.2, 3: 2.0, 4: 0.0, 5: 0.0, 6: 0.0}),
+    ({"TypeName": "Paraxial", "Comment": "", "Radius": math.inf, "Thickness": 50.0, "Material": "",
+      "SemiDiameter": 8.0, "Conic": 0.0}, {1: 50.0, 2: 1.0}),
+    ({"TypeName": "Standard", "Comment": "", "Radius": math.inf, "Thickness": 0.0, "Material": "",
+      "SemiDiameter": 5.0, "Conic": 0.0}, {}),
+]
+
+# The LensDataExports rows the MATLAB export writes for MOCK_SURFACES:
+# (TypeName, Comment, Radius, Thickness, Material, SemiDiameter, Conic, A2..A16)
+NAN = math.nan
+MOCK_EXPECTED = [
+    ("Standard", "", math.inf, math.inf, "", 0.0, 0.0, [NAN] * 8),
+    ("Even Asphere", "front", 25.0, 4.0, "N-BK7", 10.0, -0.5,
+     [1e-3, -1.2e-5, 3.4e-8, -5.6e-11, 7.8e-14, 0.0, 0.0, -9.1e-20]),
+    ("Standard", "", -80.0, 2.0, "", 9.5, 0.0, [NAN] * 8),
+    ("Coordinate Break", "tilt", math.inf, 0.0, "-", 0.0, math.inf, [NAN] * 8),
+    ("Paraxial", "", math.inf, 50.0, "", 8.0, math.inf, [50.0] + [NAN] * 7),
+    ("Standard", "", math.inf, 0.0, "", 5.0, 0.0, [NAN] * 8),
+]
+
+
+def mock_lde(surfaces, calls=None):
+    """
+    An object with the LDE interface read_lde uses, built from (properties,
+    Par cells) rows like MOCK_SURFACES; its Par columns are the cell
+    numbers themselves. Cells a row does not have read 0, as unused cells
+    do in the editor. calls (a dict) counts the interop calls a real editor
+    would make.
+    """
+    calls = calls if calls is not None else {}
+
+    def counted(value):
+        calls["count"] = calls.get("count", 0) + 1
+        return value
+
+    class Row:
+        def __init__(self, properties, cells):
+            self.properties, self.cells = properties, cells
+
+        def __getattr__(self, name):
+            return counted(self.properties[name])
+
+        def GetSurfaceCell(self, column):
+            return SimpleNamespace(DoubleValue=counted(self.cells.get(column, 0.0)))
+
+    return SimpleNamespace(NumberOfSurfaces=len(surfaces),
+                           GetSurfaceAt=lambda i: counted(Row(*surfaces[i])))
+
+
+def expected_rows(expected=MOCK_EXPECTED):
+    """MOCK_EXPECTED as LensDataExports rows."""
+    keys = ["TypeName", "Comment", "Radius", "Thickness", "Material", "SemiDiameter", "Conic"]
+    return [{"Surface": i, **dict(zip(keys, values)), **{f"A{order}": a for order, a in zip(EVEN_ORDERS, coeffs)}}
+            for i, (*values, coeffs) in enumerate(expected)]
+
+# ---------------- Folder Export ----------------
+def lens_files(lens_dir=LENS_DIR):
+    """Sorted paths of the lens files (.zmx / .zar, any case) in lens_dir."""
+    return [os.path.join(lens_dir, f) for f in sorted(os.listdir(lens_dir))
+            if os.path.splitext(f)[1].lower() in LENS_EXTENSIONS]
+
+
+def export_lenses(system, paths, method=METHOD, columns=None, csv_dir=None, verbose=False):
+    """
+    Load each lens into system (an IOpticalSystem) and read its LDE.
+
+    Returns {lens_id: rows}; lenses that fail to load or read are skipped.
+    With csv_dir, each lens is also written as <lens>_LensData.csv.
+    """
+    exported = {}
+    if csv_dir:
+        os.makedirs(csv_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="lde_export_") as scratch_dir:
+        for k, path in enumerate(paths, start=1):
+            lens_id = os.path.splitext(os.path.basename(path))[0]
+            try:
+                if not system.LoadFile(path, False):
+                    print(f"⚠️ Could not load {path}")
+                    continue
+                rows = snapshot_rows(system, scratch_dir) if method == "snapshot" else read_lde(system.LDE, columns)
+            except Exception as e:
+                print(f"⚠️ Skipping {lens_id}: {e}")
+                continue
+            exported[lens_id] = rows
+            if csv_dir:
+                write_lens_csv(os.path.join(csv_dir, f"{lens_id}_LensData.csv"), rows)
+            if verbose:
+                print(f"({k}/{len(paths)}) {lens_id}: {len(rows)} surfaces")
+    return exported
+
+
+def store_lenses(exported, path=prescription_store.STORE_PATH, merge=True):
+    """
+    Write {lens_id: rows} into the prescription store; with merge, lenses
+    already in the store and not re-exported are kept. Returns the PackedCorpus.
+    """
+    prescriptions = {}
+    if merge and os.path.exists(path):
+        prescriptions = prescription_store.prescriptions(prescription_store.load_store(path))
+    prescriptions.update({lens_id: paraxial.rows_prescription(rows) for lens_id, rows in exported.items()})
+    corpus = prescription_store.pack_prescriptions(prescriptions)
+    prescription_store.save_store(corpus, path)
+    return corpus
+
+
+if __name__ == "__main__":
+    paths = lens_files(LENS_DIR)
+    start = time.perf_counter()
+    if os.name == "nt":
+        from zos_scheduler import zos_start, zos_stop
+
+        session = zos_start(0, {})
+        try:
+            exported = export_lenses(session["system"], paths, METHOD, par_columns(session["zosapi"]), verbose=True)
+        finally:
+            zos_stop(session)
+        corpus = store_lenses(exported)
+        print(f"✅ Exported {len(exported)}/{len(paths)} lenses to {prescription_store.STORE_PATH} "
+              f"({time.perf_counter() - start:.1f} s)")
+    else:
+        # No OpticStudio here: read the hand-written LDE through the "cells" reader
+        columns = {n: n for n in range(1, len(EVEN_ORDERS) + 1)}
+        calls = {}
+        read = read_lde(mock_lde(MOCK_SURFACES, calls), columns)
+        expected = expected_rows()
+        mismatched = [f"surface {e['Surface']} {c}: read {q[c]!r}, expected {e[c]!r}"
+                      for e, q in zip(expected, read) for c in e
+                      if not (q[c] == e[c] or (q[c] != q[c] and e[c] != e[c]))]
+        if len(read) != len(expected):
+            mismatched.append(f"read {len(read)} surfaces, expected {len(expected)}")
+        for line in mismatched:
+            print(f"⚠️ {line}")
+        print(f"{'✅' if not mismatched else '⚠️'} Read {len(read)} mock LDE surfaces through the cells reader "
+              f"({calls.get('count', 0) / max(len(read), 1):.1f} interop calls per surface); "
+              f"{len(mismatched)} cells differ from the expected rows")
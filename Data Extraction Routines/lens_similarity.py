@@ -0,0 +1,410 @@
+'''
+Nearest-neighbour search over lens prescriptions and performance curves.
+
+Every lens is embedded as one fixed-length vector:
+
+  prescription  PRESCRIPTION_FEATURES from the .zmx file and its paraxial
+                first-order trace (log EFL, F/#, half field, track / EFL, ...)
+  rms           polychromatic RMS wavefront error (log10 waves) from the
+                RMSvField export, resampled onto CURVE_POINTS normalized fields
+                by curve_resampling
+  vignetting    relative illumination from the Vignetting export, same grid
+
+Columns are z-scored over the corpus (missing values become the corpus
+mean) and each block is weighted by BLOCK_WEIGHTS / sqrt(block width), so
+the nine prescription numbers count as much as a sixteen-point curve.
+Because a missing value sits at the mean, queries only rank lenses that
+actually have the compared data: nearest() skips lenses sharing no finite
+block with the query, spec_query() lenses missing a queried feature.
+
+The index (LensStore/similarity.npz) keeps the raw features together with
+the size / mtime of every source file: refresh_index() only re-embeds lenses
+whose .zmx or exports changed. Below IVF_MIN_LENSES a query is one exact
+distance pass over the float32 matrix (well under a millisecond for the
+real corpus); larger (synthetic) corpora get an IVF index, k-means cells
+stored CSR style like the prescription store, of which IVF_PROBE are
+scanned per query.
+'''
+
+import os
+import json
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import paraxial
+import curve_resampling
+from analysis_parser import ROOT_DIR
+
+# ---------------- Paths ----------------
+INDEX_PATH = os.path.join(paraxial.DATA_DIR, "LensStore", "similarity.npz")
+
+# ---------------- Settings ----------------
+CURVE_POINTS = 16             # normalized-field samples per curve
+BLOCK_WEIGHTS = {"prescription": 1.0, "rms": 1.0, "vignetting": 1.0}
+IVF_MIN_LENSES = 20_000       # below this, exact search is faster than IVF
+IVF_PROBE = 8                 # IVF cells scanned per query
+KMEANS_ITERATIONS = 12
+RETRAIN_FRACTION = 0.2        # retrain normalization / IVF once this share of lenses changed
+SEED = 0
+
+PRESCRIPTION_FEATURES = ["log_efl", "fnum", "half_field_deg", "track_ratio", "bfl_ratio",
+                         "n_elements", "n_aspheres", "stop_position", "petzval_efl"]
+CURVES = {"rms": "RMSvField/rms_radius@poly", "vignetting": "Vignetting/rel_illumination"}   # block -> channel
+FIELD_GRID = np.linspace(0.0, 1.0, CURVE_POINTS)
+
+BLOCKS = {"prescription": len(PRESCRIPTION_FEATURES), "rms": CURVE_POINTS, "vignetting": CURVE_POINTS}
+N_FEATURES = sum(BLOCKS.values())
+
+# raw / signature are per lens; mean, scale and the IVF arrays are frozen at the last training
+SimilarityIndex = namedtuple("SimilarityIndex", ["lens_ids", "raw", "signature", "mean", "scale", "vectors",
+                                                 "centroids", "order", "list_offsets"])
+# The stored index handed to build_index, and whether it has drifted too far to reuse
+Previous = namedtuple("Previous", ["index", "stale"])
+
+# ---------------- Prescription Features ----------------
+def prescription_features(prescriptions, stops, catalog=None):
+    """(lenses, len(PRESCRIPTION_FEATURES)) raw features, rows in sorted lens_id order."""
+    lens_ids = sorted(prescriptions)
+    features = np.full((len(lens_ids), len(PRESCRIPTION_FEATURES)), np.nan)
+    if not lens_ids:
+        return features
+    first = paraxial.first_order(prescriptions, catalog=catalog, stops=stops)
+    efl = first["efl"]
+    for i, lens_id in enumerate(lens_ids):
+        p = prescriptions[lens_id]
+        thickness = np.asarray(p["thickness"][1:-1], dtype=np.float64)
+        materials = [m.strip().upper() for m in p["material"][1:-1]]
+        asphere = np.asarray(p["asphere"], dtype=np.float64)[:, 1:]
+        n_surfaces = len(p["radius"])
+        f = efl[i]
+        if p.get("field_type", 0) == 0:
+            half_field = p.get("max_field", math.nan)
+        elif p.get("field_type") in (2, 3) and f:
+            half_field = math.degrees(math.atan(p.get("max_field", math.nan) / abs(f)))
+        else:
+            half_field = math.nan
+        features[i] = [
+            math.log(abs(f)) if f else math.nan,
+            first["fnum"][i],
+            half_field,
+            np.nansum(thickness[np.isfinite(thickness)]) / abs(f) if f else math.nan,
+            first["bfl"][i] / f if f else math.nan,
+            sum(1 for m in materials if m not in ("", "-", "MIRROR")),
+            sum(1 for t, a in zip(p["type"], asphere) if t == "Even Asphere" and np.any(np.nan_to_num(a) != 0)),
+            first["stop_surface"][i] / max(n_surfaces - 1, 1),
+            first["petzval_sum"][i] * f,
+        ]
+    features[~np.isfinite(features)] = np.nan
+    return features
+
+# ---------------- Curve Features ----------------
+def curve_features(lens_ids, root_dir=ROOT_DIR):
+    """{block: (lenses, CURVE_POINTS)} resampled curves for lens_ids (NaN rows where the export is missing)."""
+    analyses = [name.split("/")[0] for name in CURVES.values()]
+    values, _, _ = curve_resampling.resample_lenses(list(lens_ids), root_dir, FIELD_GRID, analyses)
+    curves = {}
+    for block, name in CURVES.items():
+        curve = values[:, curve_resampling.CHANNEL_INDEX[name]].astype(np.float64)
+        curves[block] = np.log10(np.maximum(curve, 1e-6)) if block == "rms" else curve
+    return curves
+
+# ---------------- Sources ----------------
+def source_paths(lens_id, zmx_name, lens_dir, root_dir):
+    """The files a lens embedding is computed from: the .zmx and the curve exports."""
+    return [os.path.join(lens_dir, zmx_name)] + [
+        os.path.join(root_dir, lens_id, f"{lens_id}_{name.split('/')[0]}.txt") for name in CURVES.values()]
+
+
+def signature(lens_id, zmx_name, lens_dir, root_dir):
+    """(size, mtime_ns) of every source file, 0 for missing ones."""
+    values = []
+    for path in source_paths(lens_id, zmx_name, lens_dir, root_dir):
+        try:
+            st = os.stat(path)
+            values += [st.st_size, st.st_mtime_ns]
+        except OSError:
+            values += [0, 0]
+    return values
+
+
+def corpus_lenses(lens_dir):
+    """{lens_id: .zmx file name} for the lens folder."""
+    return {os.path.splitext(f)[0]: f for f in sorted(os.listdir(lens_dir)) if f.lower().endswith(".zmx")}
+
+
+def embed_lenses(lens_ids, lens_dir, root_dir, catalog=None):
+    """Raw (lenses, N_FEATURES) features for lens_ids, parsing only their sources."""
+    files = corpus_lenses(lens_dir)
+    prescriptions, stops = {}, {}
+    for lens_id in lens_ids:
+        p, stop = paraxial.zmx_prescription(os.path.join(lens_dir, files[lens_id]))
+        if p is not None:
+            prescriptions[lens_id] = p
+            if stop is not None:
+                stops[lens_id] = stop
+    raw = np.full((len(lens_ids), N_FEATURES), np.nan)
+    rows = {lens_id: i for i, lens_id in enumerate(lens_ids)}
+    parsed = sorted(prescriptions)
+    raw[[rows[lens_id] for lens_id in parsed], :BLOCKS["prescription"]] = \
+        prescription_features(prescriptions, stops, catalog)
+    curves = curve_features(lens_ids, root_dir)
+    start = BLOCKS["prescription"]
+    for block in CURVES:
+        raw[:, start:start + CURVE_POINTS] = curves[block]
+        start += CURVE_POINTS
+    return raw
+
+# ---------------- Normalization / IVF ----------------
+def column_weights():
+    """Per-column weight: each block's weight spread over its columns."""
+    return np.concatenate([np.full(width, BLOCK_WEIGHTS[block] / math.sqrt(width))
+                           for block, width in BLOCKS.items()])
+
+
+def fit_normalization(raw):
+    """(mean, scale) per column over the finite values; scale folds in the block weights."""
+    finite = np.isfinite(raw)
+    counts = finite.sum(axis=0)
+    filled = np.where(finite, raw, 0.0)
+    mean = np.divide(filled.sum(axis=0), counts, out=np.zeros(raw.shape[1]), where=counts > 0)
+    var = np.divide((np.where(finite, raw - mean, 0.0) ** 2).sum(axis=0), counts,
+                    out=np.zeros(raw.shape[1]), where=counts > 0)
+    std = np.sqrt(var)
+    scale = np.divide(column_weights(), std, out=np.zeros(raw.shape[1]), where=std > 0)
+    return mean, scale
+
+
+def normalize(raw, mean, scale):
+    """Weighted z-scores as float32; missing values land on the corpus mean (0)."""
+    z = (raw - mean) * scale
+    return np.where(np.isfinite(z), z, 0.0).astype(np.float32)
+
+
+def squared_distances(vectors, query):
+    """Squared Euclidean distances of every row of vectors to query."""
+    diff = vectors - query
+    return np.einsum("ij,ij->i", diff, diff)
+
+
+def kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=SEED):
+    """Lloyd's k-means; returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    for _ in range(iterations):
+        assignment = assign(vectors, centroids, norms)
+        counts = np.bincount(assignment, minlength=n_lists)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, assignment, vectors)
+        moved = counts > 0
+        centroids[moved] = (sums[moved] / counts[moved, None]).astype(np.float32)
+    return centroids, assign(vectors, centroids, norms)
+
+
+def assign(vectors, centroids, norms=None):
+    """Nearest centroid of every vector (one matrix product)."""
+    norms = np.einsum("ij,ij->i", vectors, vectors) if norms is None else norms
+    d = norms[:, None] - 2.0 * vectors @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    return np.argmin(d, axis=1)
+
+
+def inverted_lists(assignment, n_lists):
+    """(order, list_offsets): lens rows grouped by IVF cell, CSR style."""
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+    return order, offsets
+
+
+def build_index(lens_ids, raw, signature, ivf_min=IVF_MIN_LENSES, previous=None):
+    """
+    SimilarityIndex over raw features. The normalization and IVF cells of
+    previous are reused (new lenses only assigned to cells) unless there
+    are none or the corpus has drifted by more than RETRAIN_FRACTION.
+    """
+    empty = np.empty((0, N_FEATURES), dtype=np.float32)
+    retrain = previous is None or previous.stale
+    if retrain:
+        mean, scale = fit_normalization(raw) if len(lens_ids) else (np.zeros(N_FEATURES), np.zeros(N_FEATURES))
+    else:
+        mean, scale = previous.index.mean, previous.index.scale
+    vectors = normalize(raw, mean, scale)
+
+    centroids, order, offsets = empty, np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    if len(lens_ids) >= ivf_min:
+        if retrain or previous.index.centroids.size == 0:
+            centroids, assignment = kmeans(vectors, max(1, int(math.sqrt(len(lens_ids)))))
+        else:
+            centroids = previous.index.centroids
+            assignment = assign(vectors, centroids)
+        order, offsets = inverted_lists(assignment, len(centroids))
+    return SimilarityIndex(np.array(lens_ids, dtype=str), raw, np.asarray(signature, dtype=np.int64).reshape(
+        len(lens_ids), -1), mean, scale, vectors, centroids, order, offsets)
+
+# ---------------- Persistence ----------------
+def save_index(index, path=INDEX_PATH):
+    """Write the index as one uncompressed .npz, atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, settings=np.array(json.dumps(index_settings())), **index._asdict())
+    os.replace(tmp_path, path)
+
+
+def index_settings():
+    """Everything that changes the meaning of a stored vector; a mismatch forces a full rebuild."""
+    return {"features": PRESCRIPTION_FEATURES, "curves": CURVES, "points": CURVE_POINTS, "weights": BLOCK_WEIGHTS}
+
+
+def load_index(path=INDEX_PATH):
+    """The stored index, or None if it is missing or was built with other settings."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if json.loads(str(data["settings"])) != json.loads(json.dumps(index_settings())):
+                return None
+            return SimilarityIndex(**{field: data[field] for field in SimilarityIndex._fields})
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def refresh_index(path=INDEX_PATH, lens_dir=paraxial.LENS_DIR, root_dir=ROOT_DIR, ivf_min=IVF_MIN_LENSES,
+                  verbose=False):
+    """
+    Bring the stored index up to date and return it: lenses whose sources
+    changed (or are new) are re-embedded, removed lenses dropped, the rest
+    reused as stored.
+    """
+    old = load_index(path)
+    files = corpus_lenses(lens_dir)
+    lens_ids = list(files)
+    signatures = {lens_id: signature(lens_id, files[lens_id], lens_dir, root_dir) for lens_id in lens_ids}
+    stored = {} if old is None else {str(lens_id): i for i, lens_id in enumerate(old.lens_ids)}
+
+    changed = [lens_id for lens_id in lens_ids
+               if lens_id not in stored or old.signature[stored[lens_id]].tolist() != signatures[lens_id]]
+    removed = len(stored.keys() - set(lens_ids))
+    if old is not None and not changed and not removed:
+        return old
+
+    raw = np.full((len(lens_ids), N_FEATURES), np.nan)
+    changed_set = set(changed)
+    kept = [i for i, lens_id in enumerate(lens_ids) if lens_id not in changed_set]
+    if kept:
+        raw[kept] = old.raw[[stored[lens_ids[i]] for i in kept]]
+    if changed:
+        # Placeholder glasses are resolved through the GLAS records of the whole folder
+        catalog, _ = paraxial.scan_zmx(lens_dir)
+        rows = {lens_id: i for i, lens_id in enumerate(lens_ids)}
+        raw[[rows[lens_id] for lens_id in changed]] = embed_lenses(changed, lens_dir, root_dir, catalog)
+
+    drift = (len(changed) + removed) / max(len(lens_ids), 1)
+    previous = None if old is None else Previous(old, drift > RETRAIN_FRACTION)
+    index = build_index(lens_ids, raw, [signatures[lens_id] for lens_id in lens_ids], ivf_min, previous)
+    save_index(index, path)
+    if verbose:
+        print(f"Re-embedded {len(changed)} lenses, dropped {removed}"
+              f"{' (retrained)' if previous is None or previous.stale else ''}")
+    return index
+
+# ---------------- Queries ----------------
+def lens_row(index, lens_id):
+    """Row of a lens in the index."""
+    matches = np.flatnonzero(index.lens_ids == lens_id)
+    if not matches.size:
+        raise KeyError(lens_id)
+    return int(matches[0])
+
+
+def lens_vector(index, lens_id):
+    """Embedded vector of a lens in the index."""
+    return index.vectors[lens_row(index, lens_id)]
+
+
+def finite_blocks(raw):
+    """Which BLOCKS hold at least one finite raw feature: (..., len(BLOCKS)) booleans."""
+    edges = np.cumsum([0] + list(BLOCKS.values()))
+    finite = np.isfinite(raw)
+    return np.stack([finite[..., a:b].any(axis=-1) for a, b in zip(edges[:-1], edges[1:])], axis=-1)
+
+
+def nearest(index, query, k=10, probe=IVF_PROBE, exclude=None, blocks=None):
+    """
+    The k lenses closest to an embedded query vector: [(lens_id, distance)],
+    nearest first. With IVF cells, only the probe cells nearest the query are
+    scanned; exclude is a lens_id left out of the result (the query lens).
+    blocks flags the BLOCKS the query has data in (default: all); lenses
+    with no finite block among them are skipped, so an empty lens, all at
+    the corpus mean, never matches.
+    """
+    blocks = np.ones(len(BLOCKS), dtype=bool) if blocks is None else np.asarray(blocks, dtype=bool)
+    if index.centroids.size:
+        cells = np.argsort(squared_distances(index.centroids, query))[:probe]
+        rows = np.concatenate([index.order[index.list_offsets[c]:index.list_offsets[c + 1]] for c in cells])
+    else:
+        rows = np.arange(len(index.lens_ids))
+    d = squared_distances(index.vectors[rows], query)
+    d[~(finite_blocks(index.raw[rows]) & blocks).any(axis=1)] = np.inf
+    if exclude is not None:
+        d[index.lens_ids[rows] == exclude] = np.inf
+    take = min(k, d.size)
+    best = np.argpartition(d, take - 1)[:take] if take else np.empty(0, dtype=int)
+    best = best[np.argsort(d[best])]
+    return [(str(index.lens_ids[rows[i]]), float(math.sqrt(d[i]))) for i in best if np.isfinite(d[i])]
+
+
+def similar_lenses(index, lens_id, k=10, probe=IVF_PROBE):
+    """The k lenses most similar to one in the index (itself excluded)."""
+    row = lens_row(index, lens_id)
+    return nearest(index, index.vectors[row], k, probe, exclude=lens_id, blocks=finite_blocks(index.raw[row]))
+
+
+def spec_query(index, k=10, efl=None, fnum=None, half_field_deg=None, **features):
+    """
+    The k lenses closest on the given prescription features only, e.g.
+    spec_query(index, efl=50, fnum=1.8) for "closest to this F/1.8 50mm".
+    Other PRESCRIPTION_FEATURES can be passed by name. Exact over the corpus;
+    lenses missing any queried feature are not ranked.
+    """
+    targets = dict(features)
+    if efl is not None:
+        targets["log_efl"] = math.log(efl)
+    if fnum is not None:
+        targets["fnum"] = fnum
+    if half_field_deg is not None:
+        targets["half_field_deg"] = half_field_deg
+    columns = [PRESCRIPTION_FEATURES.index(name) for name in targets]
+    query = (np.array(list(targets.values())) - index.mean[columns]) * index.scale[columns]
+    rows = np.flatnonzero(np.isfinite(index.raw[:, columns]).all(axis=1))
+    d = squared_distances(index.vectors[rows][:, columns], query.astype(np.float32))
+    take = min(k, d.size)
+    best = np.argpartition(d, take - 1)[:take] if take else np.empty(0, dtype=int)
+    best = best[np.argsort(d[best])]
+    return [(str(index.lens_ids[rows[i]]), float(math.sqrt(d[i]))) for i in best]
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    index = refresh_index(verbose=True)
+    built = time.perf_counter()
+    index = refresh_index()
+    refreshed = time.perf_counter()
+    print(f"✅ Similarity index: {len(index.lens_ids)} lenses x {N_FEATURES} features "
+          f"({built - start:.2f} s to build, {refreshed - built:.3f} s to refresh unchanged)")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        matches = spec_query(index, 10, efl=50.0, fnum=1.8)
+    print(f"10 closest to an F/1.8 50 mm ({(time.perf_counter() - start) * 10:.2f} ms per query):")
+    for lens_id, distance in matches:
+        i = int(np.flatnonzero(index.lens_ids == lens_id)[0])
+        print(f"   {lens_id:<32} EFL {math.exp(index.raw[i, 0]):7.2f}  F/{index.raw[i, 1]:.2f}  d={distance:.3f}")
+
+    lens_id = matches[0][0]
+    start = time.perf_counter()
+    for _ in range(100):
+        neighbours = similar_lenses(index, lens_id, 10)
+    print(f"10 most similar to {lens_id} ({(time.perf_counter() - start) * 10:.2f} ms per query): "
+          f"{', '.join(n for n, _ in neighbours[:5])}, ...")
@@ -0,0 +1,200 @@
+'''
+Columnar lens-corpus store (Arrow IPC, one file per analysis).
+
+Replaces the ~4,000 per-lens CSVs in CSVExports (and the combined files that
+combine_csvs*.py rebuild from them) with one uncompressed Arrow IPC file per
+analysis under LensStore/:
+
+    LensStore/FieldCurvature.arrow
+    LensStore/Longitudinal.arrow
+    LensStore/RMSvField.arrow
+    LensStore/Vignetting.arrow
+
+Every file is in long form, sorted by lens_id, with typed columns:
+
+    lens_id       dictionary<string>  lens folder name
+    axis_label    dictionary<string>  exported x-axis header ("Y Angle (deg)", "Rel. Pupil", ...)
+    field / pupil float64             x-axis value (pupil for Longitudinal)
+    wavelength_um float64             NaN for the polychromatic RMSvField curve
+                                      and for Vignetting (not per wavelength)
+    <values>      float64             analysis-specific, see LAYOUTS
+
+The row range of every lens is kept in the schema metadata ("lens_index"),
+so a single lens is a zero-copy slice. Files are opened through a memory
+map, so loading every RMSvField curve is one mmap-backed read.
+'''
+
+import os
+import re
+import json
+import time
+
+import numpy as np
+import pyarrow as pa
+
+from analysis_parser import ROOT_DIR, parse_all
+
+# ---------------- Paths ----------------
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Prime Lenses + Data"))
+STORE_DIR = os.path.join(DATA_DIR, "LensStore")
+STORE_EXT = ".arrow"
+
+# ---------------- Layouts ----------------
+# "columns" : the table is already long (one value column per exported column)
+# "melt"    : columns after the first are one curve per wavelength, melted
+#             into (wavelength_um, value); a "Poly" column becomes NaN
+LAYOUTS = {
+    "FieldCurvature": {"axis": "field", "columns": ["tan_shift", "sag_shift", "real_height", "ref_height", "distortion"]},
+    "Longitudinal": {"axis": "pupil", "melt": "focal_shift"},
+    "RMSvField": {"axis": "field", "melt": "rms_radius"},
+    "Vignetting": {"axis": "field", "columns": ["rel_illumination", "effective_fnum"]},
+}
+
+number_prefix = re.compile(r'\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+
+
+def label_wavelength(label):
+    """Wavelength in µm from a header or series label ('0.4861', '0.486133 µm.'); NaN for 'Poly'."""
+    match = number_prefix.match(label or "")
+    return float(match.group(1)) if match else np.nan
+
+
+def table_columns(layout, headers, wavelength, block):
+    """
+    Long-form columns for one parsed table.
+
+    Returns (axis_label, axis values, wavelengths, {value column: values}),
+    all arrays of equal length.
+    """
+    axis = block[:, 0]
+    if "melt" in layout:
+        n_rows, n_curves = block.shape[0], block.shape[1] - 1
+        curve_wavelengths = np.array([label_wavelength(h) for h in headers[1:n_curves + 1]]
+                                     + [np.nan] * (n_curves - len(headers[1:])))
+        return (headers[0], np.tile(axis, n_curves), np.repeat(curve_wavelengths, n_rows),
+                {layout["melt"]: block[:, 1:].T.ravel()})
+
+    wavelengths = np.full(block.shape[0], label_wavelength(wavelength) if wavelength is not None else np.nan)
+    values = {}
+    for c, column in enumerate(layout["columns"], start=1):
+        values[column] = block[:, c] if c < block.shape[1] else np.full(block.shape[0], np.nan)
+    return headers[0], axis, wavelengths, values
+
+
+def dictionary_column(codes, labels):
+    """Dictionary-encoded string column from integer codes into labels."""
+    return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(labels, type=pa.string()))
+
+
+def build_table(name, parsed):
+    """
+    Assemble one analysis into an Arrow table.
+
+    parsed : {lens_id: [(headers, wavelength, block), ...]} in the order the
+             rows should be stored (sorted by lens_id)
+    """
+    layout = LAYOUTS[name]
+    value_names = [layout["melt"]] if "melt" in layout else layout["columns"]
+
+    lens_ids, lens_index = [], {}
+    axis_labels, axis_codes = [], []
+    lens_codes, axis_parts, wavelength_parts = [], [], []
+    value_parts = {column: [] for column in value_names}
+    offset = 0
+
+    for lens_id, tables in parsed.items():
+        start = offset
+        for headers, wavelength, block in tables:
+            label, axis, wavelengths, values = table_columns(layout, headers, wavelength, block)
+            if label not in axis_labels:
+                axis_labels.append(label)
+            n = axis.size
+            lens_codes.append(np.full(n, len(lens_ids), dtype=np.int32))
+            axis_codes.append(np.full(n, axis_labels.index(label), dtype=np.int32))
+            axis_parts.append(axis)
+            wavelength_parts.append(wavelengths)
+            for column in value_names:
+                value_parts[column].append(values[column])
+            offset += n
+        lens_index[lens_id] = [start, offset - start]
+        lens_ids.append(lens_id)
+
+    def concat(parts, dtype=np.float64):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    columns = {
+        "lens_id": dictionary_column(concat(lens_codes, np.int32), lens_ids),
+        "axis_label": dictionary_column(concat(axis_codes, np.int32), axis_labels),
+        layout["axis"]: pa.array(concat(axis_parts)),
+        "wavelength_um": pa.array(concat(wavelength_parts)),
+    }
+    for column in value_names:
+        columns[column] = pa.array(concat(value_parts[column]))
+
+    table = pa.table(columns)
+    metadata = {"analysis": name, "lens_index": json.dumps(lens_index)}
+    return table.replace_schema_metadata(metadata)
+
+# ---------------- Writing ----------------
+def write_table(table, path):
+    """Write an uncompressed Arrow IPC file atomically (so it can be memory-mapped zero-copy)."""
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def build_store(root_dir=ROOT_DIR, store_dir=STORE_DIR, analyses=None, workers=1, verbose=False):
+    """
+    Parse AnalysisExports once and write one Arrow file per analysis.
+
+    Returns a dict {analysis: number of rows written}.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    parsed = parse_all(root_dir, analyses, workers)
+
+    by_analysis = {name: {} for name in (analyses or LAYOUTS)}
+    for (lens_id, name), tables in parsed.items():
+        by_analysis.setdefault(name, {})[lens_id] = tables
+
+    rows = {}
+    for name, lenses in by_analysis.items():
+        table = build_table(name, dict(sorted(lenses.items())))
+        write_table(table, os.path.join(store_dir, name + STORE_EXT))
+        rows[name] = table.num_rows
+        if verbose:
+            print(f"✅ {name}: {len(lenses)} lenses, {table.num_rows} rows")
+    return rows
+
+# ---------------- Reading ----------------
+def open_analysis(name, store_dir=STORE_DIR):
+    """Memory-map one analysis file and return it as an Arrow table (no copy of the data)."""
+    source = pa.memory_map(os.path.join(store_dir, name + STORE_EXT), "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def lens_index(table):
+    """{lens_id: (first row, number of rows)} from the table's metadata."""
+    return {lens_id: tuple(span) for lens_id, span in json.loads(table.schema.metadata[b"lens_index"]).items()}
+
+
+def lens_rows(table, lens_id, index=None):
+    """Zero-copy slice holding the rows of one lens (empty if the lens is not in the store)."""
+    start, length = (index or lens_index(table)).get(lens_id, (0, 0))
+    return table.slice(start, length)
+
+
+def available_analyses(store_dir=STORE_DIR):
+    """Names of the analyses present in the store."""
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(store_dir) if f.endswith(STORE_EXT))
+
+
+if __name__ == "__main__":
+    WORKERS = os.cpu_count()  # set to 1 to run serially
+
+    start = time.perf_counter()
+    build_store(ROOT_DIR, STORE_DIR, workers=WORKERS, verbose=True)
+    print(f"\n✅ Lens store written to {STORE_DIR} ({time.perf_counter() - start:.2f} s)")
@@ -1,8 +1,16 @@
 import os
-import math
+from collections import Counter, namedtuple
+
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import streaming_stats
+from text_io import sniff_file_encoding
+from analysis_parser import run_shards
+from materials import resolve_material
+from extraction_manifest import MANIFEST_NAME, load_manifest, save_manifest, refresh_section
 
 # ============================================================
 # CONFIGURATION
@@ -15,10 +23,29 @@ OUTPUT_DIR = os.path.join(
     r"C:\Users\Ruth\Documents\GitHub\2.156-Lens-Project\Prime Lenses + Data\CSVExports",
     "LensDataAnalysis"
 )
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
 PLOTS_DIR = os.path.join(OUTPUT_DIR, "plots")
-os.makedirs(PLOTS_DIR, exist_ok=True)
+
+# Processes used to read the per-lens CSVs (1 = serial, None = all cores)
+WORKERS = None
+
+# Rows read per chunk; with the streaming accumulators this bounds memory
+# whatever the number or size of the CSVs
+CHUNK_ROWS = 50_000
+
+# Render the PNGs after the summaries (False = summary-only, e.g. for CI)
+PLOTS = True
+PLOT_DPI = 200
+TOP_N = 20                    # categories shown per bar plot
+
+# Folder of .zmx files whose GLAS records give catalog glasses an nd / Vd in
+# the Material summary (None = only "n,V" model glasses and glass_catalog.csv)
+ZMX_DIR = None
+
+# Skip the whole run when no LensDataExports CSV changed since the last one.
+# The manifest is shared with analysis_parser.py and lives next to CSVExports.
+INCREMENTAL = True
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.dirname(OUTPUT_DIR)), MANIFEST_NAME)
+PLOTS_KEY = "LensDataExports plots"   # manifest entry: did the last run render the plots
 
 # Columns we expect to be numeric (based on your example)
 NUMERIC_COLS = {
@@ -36,207 +63,350 @@ NUMERIC_COLS = {
 
 def read_csv_robust(path):
     """
-    Try reading CSV as UTF-8, then UTF-16 if needed.
-    Returns a pandas DataFrame or raises the last exception.
+    Read a CSV as UTF-8 or UTF-16, picking the codec from its first bytes
+    so the file is parsed only once.
+    Returns a pandas DataFrame or raises the exception.
     """
-    try:
-        return pd.read_csv(path)
-    except UnicodeDecodeError:
-        return pd.read_csv(path, encoding="utf-16")
-
-
-# ============================================================
-# STEP 1: WALK ALL CSV FILES & COLLECT DATAFRAMES
-# ============================================================
+    return pd.read_csv(path, encoding=sniff_file_encoding(path))
 
-all_dfs = []
-row_counts = []  # list of dicts: {"file": ..., "n_rows": ...}
-
-print(f"Scanning CSV files under:\n  {ROOT_DIR}\n")
-
-for root, dirs, files in os.walk(ROOT_DIR):
-    for fname in files:
-        if not fname.lower().endswith(".csv"):
-            continue
-
-        fpath = os.path.join(root, fname)
-        # print(f"Reading: {fpath}")
 
+def summarise_shard(paths):
+    """
+    Pool worker: one pass over a shard of lens CSVs into mergeable
+    accumulators (streaming_stats.py for NUMERIC_COLS, value counters for
+    the other columns). Files are buffered and folded in about CHUNK_ROWS
+    rows at a time, so memory stays bounded by the chunk size (or the
+    largest single file) and the number of distinct categorical values,
+    not by the number of files. A file that fails to read part-way is
+    left out entirely.
+    Returns [(row counts, numeric stats, categorical counts, columns, errors)].
+    """
+    row_counts, numeric, categorical, columns, errors = [], {}, {}, [], []
+    buffered, n_buffered = [], 0
+
+    def fold(frames):
+        chunk = pd.concat(frames, ignore_index=True, sort=False)
+        for col in chunk.columns:
+            if col not in columns:
+                columns.append(col)
+            raw = chunk[col]
+            if col in NUMERIC_COLS:
+                values = pd.to_numeric(raw, errors="coerce")
+                non_numeric = raw.notna().sum() - values.notna().sum()
+                streaming_stats.update(numeric.setdefault(col, streaming_stats.new_stats()),
+                                       values.to_numpy(dtype=np.float64), non_numeric)
+            else:
+                # Files without the column are padded with NaN by the concat
+                categorical.setdefault(col, Counter()).update(raw.fillna("<NaN>").tolist())
+
+    for path in paths:
         try:
-            df = read_csv_robust(fpath)
+            frames = list(pd.read_csv(path, encoding=sniff_file_encoding(path), chunksize=CHUNK_ROWS))
         except Exception as e:
-            print(f"  ⚠️ Skipping (could not read): {e}")
+            errors.append(str(e))
             continue
+        n_rows = sum(len(frame) for frame in frames)
+        row_counts.append({"file": path, "n_rows": n_rows})
+        buffered.extend(frames)
+        n_buffered += n_rows
+        if n_buffered >= CHUNK_ROWS:
+            fold(buffered)
+            buffered, n_buffered = [], 0
+    if buffered:
+        fold(buffered)
+    return [(row_counts, numeric, categorical, columns, errors)]
+
+
+def summarise_all(paths, workers=WORKERS):
+    """
+    Stream every lens CSV once, with files sharded across a process pool,
+    and merge the per-shard accumulators in shard order.
+    Returns (row counts, numeric stats, categorical counts, columns, errors).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n_shards = max(1, min(len(paths), workers * 4))
+    shards = [paths[i::n_shards] for i in range(n_shards)]
+    row_counts, numeric, categorical, columns, errors = [], {}, {}, [], []
+    for shard_rows, shard_numeric, shard_categorical, shard_columns, shard_errors in run_shards(
+            summarise_shard, shards, workers):
+        row_counts.extend(shard_rows)
+        errors.extend(shard_errors)
+        columns.extend(c for c in shard_columns if c not in columns)
+        for col, stats in shard_numeric.items():
+            numeric[col] = streaming_stats.merge(numeric[col], stats) if col in numeric else stats
+        for col, counts in shard_categorical.items():
+            categorical.setdefault(col, Counter()).update(counts)
+
+    # Rows of files that lack a column count as NaN, as in one concatenated frame
+    total_rows = sum(r["n_rows"] for r in row_counts)
+    for col, stats in numeric.items():
+        streaming_stats.pad_missing(stats, total_rows - stats["total"])
+    for col, counts in categorical.items():
+        missing = total_rows - sum(counts.values())
+        if missing:
+            counts["<NaN>"] += missing
+    row_counts.sort(key=lambda r: r["file"])
+    return row_counts, numeric, categorical, columns, errors
 
-        # Number of data rows (excluding header) = len(df)
-        n_rows = len(df)
-        row_counts.append({
-            "file": fpath,
-            "n_rows": n_rows
-        })
-
-        all_dfs.append(df)
-
-if not all_dfs:
-    print("No CSV files found or readable. Exiting.")
-    raise SystemExit
-
-print(f"\nLoaded {len(all_dfs)} CSV files.")
-
-# ============================================================
-# STEP 2: COMBINE ALL DATA
-# ============================================================
-
-combined = pd.concat(all_dfs, ignore_index=True, sort=False)
-print(f"Combined DataFrame shape: {combined.shape}")
 
 # ============================================================
-# STEP 3: DISTRIBUTION OF ROW COUNTS PER FILE (+ PLOT)
+# HELPER: DEFERRED PLOTS
 # ============================================================
 
-row_counts_df = pd.DataFrame(row_counts)
-
-# Save distribution of number of rows per file
-row_counts_path = os.path.join(OUTPUT_DIR, "row_counts_per_file.csv")
-row_counts_df.to_csv(row_counts_path, index=False)
-
-print(f"\nSaved row-count distribution to:\n  {row_counts_path}")
-
-print("\nRow count stats (per file):")
-print(row_counts_df["n_rows"].describe())
-
-# Plot histogram of row counts per file
-plt.figure()
-row_counts_df["n_rows"].hist(bins=20)
-plt.xlabel("Number of data rows per file")
-plt.ylabel("Count of files")
-plt.title("Distribution of number of rows per file")
-plt.tight_layout()
-row_hist_path = os.path.join(PLOTS_DIR, "row_counts_histogram.png")
-plt.savefig(row_hist_path, dpi=200)
-plt.close()
-print(f"Saved row-count histogram to:\n  {row_hist_path}")
+# One PNG to render: kind is "histogram" (data = bin edges, counts),
+# "bar" (labels, counts) or "scatter" (x, y, marker sizes)
+PlotJob = namedtuple("PlotJob", ["kind", "path", "data", "title", "xlabel", "ylabel", "size"])
+
+
+def histogram_job(path, edges, counts, title, xlabel, ylabel="Count"):
+    """A histogram from precomputed bin edges and counts."""
+    return PlotJob("histogram", path, (edges, counts), title, xlabel, ylabel, (6.4, 4.8))
+
+
+def draw(ax, job):
+    """Draw one job on an empty axes."""
+    if job.kind == "histogram":
+        edges, counts = job.data
+        ax.hist(edges[:-1], bins=edges, weights=counts)
+        ax.grid(True)
+    elif job.kind == "bar":
+        labels, counts = job.data
+        ax.bar(range(len(labels)), counts)
+        ax.set_xticks(range(len(labels)))
+        ax.set_xticklabels(labels, rotation=45, ha="right")
+    elif job.kind == "scatter":
+        x, y, sizes = job.data
+        ax.scatter(x, y, s=sizes, alpha=0.6)
+        ax.invert_xaxis()
+    ax.set_xlabel(job.xlabel)
+    ax.set_ylabel(job.ylabel)
+    ax.set_title(job.title)
+
+
+def render_shard(jobs, dpi=PLOT_DPI):
+    """
+    Pool worker: render a shard of PlotJobs on one reused Agg figure (no
+    pyplot state, no GUI backend). Returns the paths written.
+    """
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    written = []
+    for job in jobs:
+        figure.clear()
+        figure.set_size_inches(job.size)
+        draw(figure.add_subplot(), job)
+        figure.tight_layout()
+        figure.savefig(job.path, dpi=dpi)
+        written.append(job.path)
+    return written
+
+
+def render_plots(jobs, workers=WORKERS, dpi=PLOT_DPI):
+    """Render every PlotJob, spread over a process pool. Returns the paths written."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n_shards = max(1, min(len(jobs), workers))
+    return run_shards(render_shard, [jobs[i::n_shards] for i in range(n_shards)], workers, dpi)
 
 # ============================================================
-# STEP 4: NUMERIC COLUMN DISTRIBUTIONS (+ PLOTS)
+# HELPER: MATERIALS AS GLASSES
 # ============================================================
 
-numeric_summary = []
-
-# Only consider numeric columns that actually exist
-numeric_cols_present = [c for c in combined.columns if c in NUMERIC_COLS]
-
-for col in numeric_cols_present:
-    s_raw = combined[col]
-
-    # Convert to numeric, coercing non-numeric to NaN
-    s = pd.to_numeric(s_raw, errors="coerce")
+def material_table(counts, zmx_dir=ZMX_DIR):
+    """
+    Material value counts with the nd / Vd of every distinct material,
+    resolved once each through materials.py (NaN for MIRROR, "-" and
+    catalog names with neither a GLAS record nor a glass_catalog.csv row).
+    """
+    catalog = {}
+    if zmx_dir:
+        from paraxial import scan_zmx
+        catalog, _ = scan_zmx(zmx_dir)
+    glasses = [resolve_material(str(m), catalog) for m in counts.index]
+    return pd.DataFrame({
+        "count": counts.values,
+        "nd": [nd for nd, _ in glasses],
+        "Vd": [vd for _, vd in glasses],
+    }, index=counts.index)
+
+
+def glass_map_job(glasses, path):
+    """PlotJob for nd vs. Vd of the resolved glasses, marker area by surface count (None if none resolve)."""
+    solid = glasses[np.isfinite(glasses["nd"]) & np.isfinite(glasses["Vd"])]
+    if solid.empty:
+        print("No resolvable glasses in 'Material', skipping glass map.")
+        return None
+    sizes = 5 + 45 * solid["count"] / solid["count"].max()
+    return PlotJob("scatter", path, (solid["Vd"].to_numpy(), solid["nd"].to_numpy(), sizes.to_numpy()),
+                   f"Glass map ({len(solid)} of {len(glasses)} materials resolved)", "Vd", "nd", (6.4, 4.8))
+
+
+def main(root_dir=ROOT_DIR, output_dir=OUTPUT_DIR, workers=WORKERS,
+         incremental=INCREMENTAL, manifest_path=MANIFEST_PATH, plots=PLOTS):
+    """
+    Summarise every LensDataExports CSV under root_dir into output_dir.
+    Defaults come from the CONFIGURATION block; the arguments let other
+    scripts (e.g. benchmark_pipeline.py) run it on another tree.
+    The statistics steps only queue PlotJobs with precomputed counts; they
+    are rendered in a last stage, which plots=False skips.
+    """
+    plots_dir = os.path.join(output_dir, "plots")
+    os.makedirs(output_dir, exist_ok=True)
+    if plots:
+        os.makedirs(plots_dir, exist_ok=True)
+    plot_jobs = []
+
+    print(f"Scanning CSV files under:\n  {root_dir}\n")
+
+    csv_paths = sorted(
+        os.path.join(root, fname)
+        for root, dirs, files in os.walk(root_dir)
+        for fname in files
+        if fname.lower().endswith(".csv")
+    )
+
+    # ============================================================
+    # STEP 0: CHECK THE MANIFEST FOR CHANGED INPUTS
+    # ============================================================
+
+    if incremental:
+        manifest = load_manifest(manifest_path)
+        changed, removed = refresh_section(manifest, "LensDataExports", csv_paths, root_dir)
+        summary_path = os.path.join(output_dir, "numeric_column_summary.csv")
+        # A summary-only run leaves no plots behind, so a plotting run must not stop at its summaries
+        plotted = manifest.get(PLOTS_KEY, False)
+        if not changed and not removed and os.path.exists(summary_path) and (plotted or not plots):
+            print("✅ No LensDataExports CSV changed since the last run; summaries are up to date.")
+            return
+        if not changed and not removed and os.path.exists(summary_path):
+            print("No LensDataExports CSV changed, but the last run skipped the plots; rendering them.")
+        print(f"{len(changed)} new/changed and {len(removed)} removed LensDataExports CSVs since the last run.")
+
+    # ============================================================
+    # STEP 1: STREAM ALL CSV FILES INTO ACCUMULATORS
+    # ============================================================
+
+    row_counts, numeric_stats, categorical_counts, columns, errors = summarise_all(csv_paths, workers)
+    for error in errors:
+        print(f"  ⚠️ Skipping (could not read): {error}")
+
+    if not row_counts:
+        print("No CSV files found or readable. Exiting.")
+        return
+
+    print(f"\nLoaded {len(row_counts)} CSV files.")
+    print(f"Combined shape: ({sum(r['n_rows'] for r in row_counts)}, {len(columns)})")
+
+    # ============================================================
+    # STEP 2: DISTRIBUTION OF ROW COUNTS PER FILE (+ PLOT)
+    # ============================================================
+
+    row_counts_df = pd.DataFrame(row_counts)
+
+    # Save distribution of number of rows per file
+    row_counts_path = os.path.join(output_dir, "row_counts_per_file.csv")
+    row_counts_df.to_csv(row_counts_path, index=False)
+
+    print(f"\nSaved row-count distribution to:\n  {row_counts_path}")
+
+    print("\nRow count stats (per file):")
+    print(row_counts_df["n_rows"].describe())
+
+    # Histogram of row counts per file
+    counts, edges = np.histogram(row_counts_df["n_rows"], bins=20)
+    plot_jobs.append(histogram_job(os.path.join(plots_dir, "row_counts_histogram.png"), edges, counts,
+                                   "Distribution of number of rows per file",
+                                   "Number of data rows per file", "Count of files"))
+
+    # ============================================================
+    # STEP 3: NUMERIC COLUMN DISTRIBUTIONS (+ PLOTS)
+    # ============================================================
+
+    numeric_summary = []
+
+    # Only consider numeric columns that actually exist
+    numeric_cols_present = [c for c in columns if c in NUMERIC_COLS]
+
+    for col in numeric_cols_present:
+        stats = numeric_stats[col]
+        numeric_summary.append(streaming_stats.summary(stats, col))
+        finite_count, nan_count = stats["finite"], stats["nan"]
+
+        # -------- Histogram for this numeric column --------
+        if finite_count > 0:
+            # Finite values, re-binned from the accumulator's fixed bins
+            centres, counts = streaming_stats.bin_centres(stats)
+            counts, edges = np.histogram(centres, bins=40, weights=counts, range=(stats["min"], stats["max"]))
+            plot_jobs.append(histogram_job(
+                os.path.join(plots_dir, f"{col}_histogram.png"), edges, counts,
+                f"{col} (finite values only)\n"
+                f"N={finite_count}, NaN={nan_count}, +Inf={stats['posinf']}, -Inf={stats['neginf']}", col))
+        else:
+            print(f"No finite values for numeric column '{col}', skipping histogram.")
+
+    numeric_summary_df = pd.DataFrame(numeric_summary)
+    numeric_summary_path = os.path.join(output_dir, "numeric_column_summary.csv")
+    numeric_summary_df.to_csv(numeric_summary_path, index=False)
+
+    print(f"\nSaved numeric column summary to:\n  {numeric_summary_path}")
+
+
+    # ============================================================
+    # STEP 4: CATEGORICAL / TEXT COLUMN DISTRIBUTIONS (+ PLOTS)
+    # ============================================================
+
+    # Define categorical columns as "everything that's not in NUMERIC_COLS"
+    categorical_cols = [c for c in columns if c not in NUMERIC_COLS]
+
+    if categorical_cols:
+        cat_dir = os.path.join(output_dir, "categorical_distributions")
+        os.makedirs(cat_dir, exist_ok=True)
+
+        for col in categorical_cols:
+            vc = pd.Series(dict(categorical_counts[col].most_common()), name="count")
+            vc.index.name = col
+
+            # Save full value counts table
+            out_path = os.path.join(cat_dir, f"{col}_value_counts.csv")
+            if col == "Material":
+                glasses = material_table(vc)
+                glasses.to_csv(out_path)
+                glass_map = glass_map_job(glasses, os.path.join(plots_dir, "Material_glass_map.png"))
+                if glass_map:
+                    plot_jobs.append(glass_map)
+            else:
+                vc.to_csv(out_path, header=["count"])
+            print(f"Saved categorical distribution for '{col}' to:\n  {out_path}")
+
+            # Bar plot of the top N categories (to keep plots readable)
+            top_vals = vc.head(TOP_N)
+            plot_jobs.append(PlotJob("bar", os.path.join(plots_dir, f"{col}_top_values.png"),
+                                     ([str(v) for v in top_vals.index], top_vals.to_numpy()),
+                                     f"Top {len(top_vals)} values for '{col}'", col, "Count",
+                                     (max(6, 0.4 * len(top_vals)), 4)))
+    else:
+        print("\nNo categorical columns detected (all columns treated as numeric?).")
 
-    total = len(s)
-    nan_count = s.isna().sum()
-    posinf_count = np.isposinf(s).sum()
-    neginf_count = np.isneginf(s).sum()
-    finite_mask = np.isfinite(s)
-    finite_count = finite_mask.sum()
+    # ============================================================
+    # STEP 5: RENDER PLOTS
+    # ============================================================
 
-    # Stats over finite vals only
-    if finite_count > 0:
-        finite_vals = s[finite_mask]
-        mean = finite_vals.mean()
-        std = finite_vals.std()
-        vmin = finite_vals.min()
-        vmax = finite_vals.max()
-    else:
-        finite_vals = pd.Series([], dtype=float)
-        mean = std = vmin = vmax = np.nan
-
-    # Count how many entries in the original column
-    # were non-empty but couldn't be parsed as numbers
-    non_empty_original = s_raw.notna().sum()
-    non_numeric_original = non_empty_original - (total - nan_count)
-
-    numeric_summary.append({
-        "column": col,
-        "total_entries": int(total),
-        "finite_count": int(finite_count),
-        "nan_count": int(nan_count),
-        "posinf_count": int(posinf_count),
-        "neginf_count": int(neginf_count),
-        "non_numeric_original_count": int(max(non_numeric_original, 0)),
-        "finite_fraction": finite_count / total if total else math.nan,
-        "nan_fraction": nan_count / total if total else math.nan,
-        "posinf_fraction": posinf_count / total if total else math.nan,
-        "neginf_fraction": neginf_count / total if total else math.nan,
-        "mean_over_finite": mean,
-        "std_over_finite": std,
-        "min_over_finite": vmin,
-        "max_over_finite": vmax,
-    })
-
-    # -------- Plot histogram for this numeric column --------
-    if finite_count > 0:
-        plt.figure()
-        # Finite values histogram
-        finite_vals.hist(bins=40)
-        plt.xlabel(col)
-        plt.ylabel("Count")
-        plt.title(
-            f"{col} (finite values only)\n"
-            f"N={finite_count}, NaN={nan_count}, +Inf={posinf_count}, -Inf={neginf_count}"
-        )
-        plt.tight_layout()
-        col_hist_path = os.path.join(PLOTS_DIR, f"{col}_histogram.png")
-        plt.savefig(col_hist_path, dpi=200)
-        plt.close()
-        print(f"Saved numeric histogram for '{col}' to:\n  {col_hist_path}")
+    if plots:
+        written = render_plots(plot_jobs, workers)
+        print(f"\nRendered {len(written)} plots to:\n  {plots_dir}")
     else:
-        print(f"No finite values for numeric column '{col}', skipping histogram.")
-
-numeric_summary_df = pd.DataFrame(numeric_summary)
-numeric_summary_path = os.path.join(OUTPUT_DIR, "numeric_column_summary.csv")
-numeric_summary_df.to_csv(numeric_summary_path, index=False)
+        print("\nSummary-only run: skipped plot rendering.")
 
-print(f"\nSaved numeric column summary to:\n  {numeric_summary_path}")
+    if incremental:
+        manifest[PLOTS_KEY] = plots
+        save_manifest(manifest, manifest_path)
 
+    print("\n✅ Done. All summaries" + (" and plots" if plots else "") + " written to:")
+    print(f"  {output_dir}")
+    if plots:
+        print(f"  {plots_dir}")
 
-# ============================================================
-# STEP 5: CATEGORICAL / TEXT COLUMN DISTRIBUTIONS (+ PLOTS)
-# ============================================================
 
-# Define categorical columns as "everything that's not in NUMERIC_COLS"
-categorical_cols = [c for c in combined.columns if c not in NUMERIC_COLS]
-
-if categorical_cols:
-    cat_dir = os.path.join(OUTPUT_DIR, "categorical_distributions")
-    os.makedirs(cat_dir, exist_ok=True)
-
-    for col in categorical_cols:
-        vc = combined[col].fillna("<NaN>").value_counts(dropna=False)
-
-        # Save full value counts table
-        out_path = os.path.join(cat_dir, f"{col}_value_counts.csv")
-        vc.to_csv(out_path, header=["count"])
-        print(f"Saved categorical distribution for '{col}' to:\n  {out_path}")
-
-        # Plot top N categories (to keep plots readable)
-        top_n = 20
-        top_vals = vc.head(top_n)
-
-        plt.figure(figsize=(max(6, 0.4 * len(top_vals)), 4))
-        top_vals.plot(kind="bar")
-        plt.xlabel(col)
-        plt.ylabel("Count")
-        plt.title(f"Top {len(top_vals)} values for '{col}'")
-        plt.xticks(rotation=45, ha="right")
-        plt.tight_layout()
-
-        cat_plot_path = os.path.join(PLOTS_DIR, f"{col}_top_values.png")
-        plt.savefig(cat_plot_path, dpi=200)
-        plt.close()
-        print(f"Saved categorical bar plot for '{col}' to:\n  {cat_plot_path}")
-else:
-    print("\nNo categorical columns detected (all columns treated as numeric?).")
-
-print("\n✅ Done. All summaries and plots written to:")
-print(f"  {OUTPUT_DIR}")
-print(f"  {PLOTS_DIR}")
+if __name__ == "__main__":
+    main()
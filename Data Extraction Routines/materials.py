@@ -0,0 +1,174 @@
+'''
+Material resolution shared by the paraxial and real-ray tracers and the
+LensDataExports summaries.
+
+Every distinct material string is interned once into a material id, and
+ids index a dense (materials, wavelengths) float array of refractive
+indices, so a batched trace looks indices up with one fancy-index instead
+of re-parsing "n,V" strings and re-evaluating the dispersion per surface
+and wavelength:
+
+  ""            air (id AIR)
+  "n,V"         model glass, e.g. "1.55,63.5" (GLAS ___BLANK records)
+  catalog name  nd / Vd from the GLAS records of the .zmx files, else from
+                glass_catalog.csv (the catalog glasses the corpus uses
+                whose files were saved with a 1.5 / 40 placeholder)
+  "517642"      six-digit glass code: nd 1.517, Vd 64.2
+  MIRROR, "-"   reflect / keep the current medium (negative codes, no row)
+
+Glasses use a Cauchy fit n(λ) = A + B/λ² + C/λ⁴ through nd, Vd and the
+normal-line partial dispersion. index_table() is built at the wavelength
+list being traced: the F, d, C lines, or a WAVM list shared by a group of
+lenses (raytrace.wavelength_groups). Parsed strings and per-glass index rows
+sit in LRU caches bounded by CACHE_SIZE, so pool workers and long sweeps
+reuse them without growing without limit.
+'''
+
+import os
+import csv
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# ---------------- Constants ----------------
+LAMBDA_F, LAMBDA_D, LAMBDA_C = 0.486133, 0.587562, 0.656273
+AIR, SAME_MEDIUM, MIRROR = 0, -1, -2
+PLACEHOLDER_GLASS = (1.5, 40.0)
+SUBSTITUTE_SOLVE = "3"        # GLAS solve type whose nd / Vd belong to the last glass it held
+UNKNOWN_GLASS = (math.nan, math.nan)
+# P_F,d = a + b·Vd through N-BK7, F2 and N-SF6 (the "normal line" of the glass map)
+NORMAL_LINE = (0.7262, -0.000533)
+CAUCHY_TERMS = np.array([[1.0, w ** -2, w ** -4] for w in (LAMBDA_F, LAMBDA_D, LAMBDA_C)])
+
+# ---------------- Settings ----------------
+CACHE_SIZE = 4096             # distinct strings / (glass, wavelengths) rows kept per cache
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glass_catalog.csv")
+
+# Interned materials: {upper-case material string: id} and (nd, Vd) per id
+Materials = namedtuple("Materials", ["ids", "glasses"])
+
+# ---------------- Parsing ----------------
+@lru_cache(maxsize=CACHE_SIZE)
+def model_glass(material):
+    """(nd, Vd) from an "n,V" model-glass string, or None."""
+    parts = material.split(",")
+    if len(parts) != 2:
+        return None
+    try:
+        return float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+
+
+def glass_record(tokens):
+    """
+    (nd, Vd) a .zmx GLAS record vouches for, or None. Files saved without
+    the catalog loaded carry a 1.5 / 40 placeholder, and a substitution
+    solve keeps the nd / Vd of whatever glass it last held (S-BSL7 for an
+    S-LAH66), so only ___BLANK model glasses and fixed catalog glasses count.
+    """
+    if len(tokens) < 6:
+        return None
+    try:
+        nd, vd = float(tokens[4]), float(tokens[5])
+    except ValueError:
+        return None
+    if tokens[1] != "___BLANK" and tokens[2] == SUBSTITUTE_SOLVE:
+        return None
+    if (nd, vd) == PLACEHOLDER_GLASS or nd <= 1.0 or vd <= 0.0:
+        return None
+    return nd, vd
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def glass_code(material):
+    """(nd, Vd) from a six-digit glass code such as "517642", or None."""
+    if len(material) != 6 or not material.isdigit():
+        return None
+    return 1.0 + int(material[:3]) / 1000.0, int(material[3:]) / 10.0
+
+
+@lru_cache(maxsize=None)
+def catalog_table(path=CATALOG_PATH):
+    """{glass name: (nd, Vd)} from glass_catalog.csv, or {} if it is missing."""
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            return {row["Glass"].strip().upper(): (float(row["nd"]), float(row["Vd"])) for row in csv.DictReader(f)}
+    except OSError:
+        return {}
+
+
+def resolve_material(material, catalog=None):
+    """
+    (nd, Vd) of one material string: air is (1, inf); catalog names come
+    from the GLAS records (catalog) first, then glass_catalog.csv. Unknown
+    names (and MIRROR / "-", which are not media) are (NaN, NaN).
+    """
+    key = material.strip().upper()
+    if not key:
+        return 1.0, math.inf
+    return (model_glass(key) or (catalog or {}).get(key) or catalog_table().get(key)
+            or glass_code(key) or UNKNOWN_GLASS)
+
+# ---------------- Dispersion ----------------
+def cauchy_index(nd, vd, wavelengths):
+    """
+    n(λ) = A + B/λ² + C/λ⁴ through nF, nd and nC, with (nF - nC) = (nd - 1) / Vd
+    split by the normal-glass partial dispersion P_F,d = (nF - nd) / (nF - nC).
+    """
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    if nd == 1.0 or not np.isfinite(vd) or vd == 0:
+        return np.full(wavelengths.shape, nd)
+    d_fc = (nd - 1.0) / vd
+    n_f = nd + (NORMAL_LINE[0] + NORMAL_LINE[1] * vd) * d_fc
+    a, b, c = np.linalg.solve(CAUCHY_TERMS, [n_f, nd, n_f - d_fc])
+    return a + b / wavelengths ** 2 + c / wavelengths ** 4
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def glass_index(nd, vd, wavelengths):
+    """cauchy_index for a wavelengths tuple, cached; the row is read-only."""
+    row = cauchy_index(nd, vd, wavelengths)
+    row.flags.writeable = False
+    return row
+
+# ---------------- Interning ----------------
+def material_codes(prescriptions, catalog=None, materials=None):
+    """
+    Intern every material string of the prescriptions.
+
+    Returns ({lens_id: [code per surface]}, Materials) where code AIR is
+    air, SAME_MEDIUM keeps the current medium and MIRROR reflects; other
+    codes are ids into Materials.glasses. Passing the Materials of an
+    earlier call extends it, so ids stay stable across corpora.
+    Unknown materials get (NaN, NaN) so the lenses using them come out NaN.
+    """
+    if materials is None:
+        materials = Materials({"": AIR}, [(1.0, math.inf)])
+    ids, glasses = materials
+    codes = {}
+    for lens_id, p in prescriptions.items():
+        lens_codes = []
+        for material in p["material"]:
+            key = material.strip().upper()
+            if key == "MIRROR":
+                lens_codes.append(MIRROR)
+            elif key == "-":
+                lens_codes.append(SAME_MEDIUM)
+            else:
+                if key not in ids:
+                    ids[key] = len(glasses)
+                    glasses.append(resolve_material(key, catalog))
+                lens_codes.append(ids[key])
+        codes[lens_id] = lens_codes
+    return codes, materials
+
+
+def index_table(materials, wavelengths):
+    """Dense (materials, wavelengths) refractive indices, row = material id."""
+    wavelengths = tuple(float(w) for w in wavelengths)
+    if not materials.glasses:
+        return np.empty((0, len(wavelengths)))
+    return np.array([glass_index(nd, vd, wavelengths) for nd, vd in materials.glasses])
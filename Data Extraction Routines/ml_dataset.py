@@ -0,0 +1,294 @@
+'''
+Memory-mapped training dataset for lens-design ML, and its batch loader.
+
+export_dataset() turns a packed prescription corpus (prescription_store)
+into fixed-shape arrays, SHARD_LENSES lenses per shard directory:
+
+  surfaces.npy      (lenses, MAX_SURFACES, len(SURFACE_FEATURES)) float32
+                    curvature, thickness, semi-diameter, conic, nd, Vd,
+                    A2..A16; rows past the last surface are zero
+  mask.npy          (lenses, MAX_SURFACES) bool, True on real surfaces
+  finite.npy        like surfaces.npy, bool, False where the input was not finite
+  surface_type.npy  (lenses, MAX_SURFACES) int16 into meta "type_names"
+  targets.npy       (lenses, len(paraxial.METRICS)) float32 first-order metrics
+  target_mask.npy   (lenses, len(paraxial.METRICS)) bool, False where NaN
+  curves.npy        (lenses, channels, points) float32 from curve_resampling
+  curve_mask.npy    (lenses, channels) bool          (only with a curve tensor)
+  lens_ids.npy      (lenses,) str
+
+Non-finite inputs (an object at infinity, an infinite semi-diameter) are
+stored as 0 with finite.npy False. meta.json lists the shards, features and
+targets. Everything is plain .npy, so open_dataset() memory-maps it and
+batches() only gathers rows: a training epoch never parses text, and a
+synthetic corpus 100x the size is just more shards. batches() shuffles
+across shards and assembles upcoming batches on a background thread while
+the current one is in use.
+'''
+
+import os
+import json
+import time
+import queue
+import shutil
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+import paraxial
+import prescription_store
+from materials import MIRROR, SAME_MEDIUM, material_codes
+
+# ---------------- Paths ----------------
+DATASET_DIR = os.path.join(paraxial.DATA_DIR, "LensStore", "ml_dataset")
+
+# ---------------- Settings ----------------
+MAX_SURFACES = 64             # padded surface axis; longer lenses are left out
+SHARD_LENSES = 4096           # lenses per shard
+BATCH_SIZE = 64
+PREFETCH = 4                  # batches assembled ahead of the consumer
+SEED = 0
+
+SURFACE_FEATURES = ["curvature", "thickness", "semi_diameter", "conic", "nd", "vd"] + \
+                   [f"a{order}" for order in paraxial.EVEN_ORDERS]
+
+# An opened dataset: meta.json plus one {array name: memmap} dict per shard
+Dataset = namedtuple("Dataset", ["meta", "shards", "offsets"])
+
+# ---------------- Surface Arrays ----------------
+def material_table(corpus, catalog=None):
+    """(nd, Vd) per corpus material code, as (materials, 2); air is (1, 0), unknown glasses NaN."""
+    codes, materials = material_codes({"names": {"material": [str(m) for m in corpus.material_names]}}, catalog)
+    glasses = np.array(materials.glasses, dtype=np.float64)
+    glasses[:, 1][np.isinf(glasses[:, 1])] = 0.0
+    table = np.full((len(corpus.material_names), 2), np.nan)
+    special = np.array(codes["names"]) < 0
+    table[~special] = glasses[np.array(codes["names"])[~special]]
+    return table, np.array(codes["names"])
+
+
+def surface_arrays(corpus, lenses, table, codes, max_surfaces=MAX_SURFACES):
+    """
+    Padded (surfaces, mask, finite, surface_type) arrays for the lens
+    positions in lenses (all shorter than max_surfaces), vectorized over
+    every surface of the chunk.
+    """
+    starts, stops = corpus.offsets[lenses], corpus.offsets[lenses + 1]
+    counts = stops - starts
+    rows = np.repeat(np.arange(len(lenses)), counts)
+    flat = np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)]) if len(lenses) else np.empty(0, int)
+    cols = flat - np.repeat(starts, counts)
+
+    # Media: "-" keeps the previous medium and a mirror keeps the glass it reflects in
+    material = codes[corpus.material_code[flat]]
+    nd_vd = table[corpus.material_code[flat]]
+    for special in (SAME_MEDIUM, MIRROR):
+        where = np.flatnonzero(material == special)
+        for i in where:
+            nd_vd[i] = nd_vd[i - 1] if cols[i] > 0 else (1.0, 0.0)
+
+    radius = corpus.radius[flat]
+    curvature = np.divide(1.0, radius, out=np.zeros_like(radius), where=np.isfinite(radius) & (radius != 0))
+    values = np.column_stack([curvature, corpus.thickness[flat], corpus.semi_diameter[flat], corpus.conic[flat],
+                              nd_vd, corpus.asphere[flat]])
+    finite = np.isfinite(values)
+
+    shape = (len(lenses), max_surfaces)
+    surfaces = np.zeros(shape + (len(SURFACE_FEATURES),), dtype=np.float32)
+    finite_out = np.zeros(shape + (len(SURFACE_FEATURES),), dtype=bool)
+    mask = np.zeros(shape, dtype=bool)
+    surface_type = np.full(shape, -1, dtype=np.int16)
+    surfaces[rows, cols] = np.where(finite, values, 0.0)
+    finite_out[rows, cols] = finite
+    mask[rows, cols] = True
+    surface_type[rows, cols] = corpus.type_code[flat]
+    return surfaces, mask, finite_out, surface_type
+
+# ---------------- Targets ----------------
+def target_arrays(corpus, lenses, catalog=None, stops=None):
+    """(targets, target_mask) first-order metrics of the lens positions in lenses."""
+    index = prescription_store.lens_index(corpus)
+    lens_ids = [str(corpus.lens_ids[i]) for i in lenses]
+    chunk = {lens_id: prescription_store.prescription(corpus, lens_id, index) for lens_id in lens_ids}
+    targets = np.full((len(lens_ids), len(paraxial.METRICS)), np.nan)
+    if chunk:
+        with np.errstate(all="ignore"):
+            results = paraxial.first_order(chunk, catalog=catalog, stops=stops)
+        row = {lens_id: i for i, lens_id in enumerate(results["lens_id"])}
+        order = [row[lens_id] for lens_id in lens_ids]
+        for m, metric in enumerate(paraxial.METRICS):
+            targets[:, m] = np.asarray(results[metric], dtype=np.float64)[order]
+    finite = np.isfinite(targets)
+    return np.where(finite, targets, 0.0).astype(np.float32), finite
+
+
+def curve_arrays(curves, lens_ids):
+    """(curves, curve_mask) rows of a curve_resampling.CurveTensor for lens_ids (absent lenses all masked)."""
+    row = {str(lens_id): i for i, lens_id in enumerate(curves.lens_ids)}
+    out = np.zeros((len(lens_ids),) + curves.values.shape[1:], dtype=np.float32)
+    present = np.zeros((len(lens_ids), curves.values.shape[1]), dtype=bool)
+    for i, lens_id in enumerate(lens_ids):
+        r = row.get(lens_id)
+        if r is not None:
+            values = curves.values[r]
+            present[i] = np.isfinite(values).all(axis=1)
+            out[i] = np.where(np.isfinite(values), values, 0.0)
+    return out, present
+
+# ---------------- Export ----------------
+def save_array(shard_dir, name, array):
+    np.save(os.path.join(shard_dir, name + ".npy"), array)
+
+
+def export_dataset(corpus, out_dir=DATASET_DIR, catalog=None, stops=None, curves=None, shard_lenses=SHARD_LENSES,
+                   max_surfaces=MAX_SURFACES, verbose=False):
+    """
+    Write the dataset for a PackedCorpus, one shard at a time (memory stays
+    bounded by the shard size). The previous dataset in out_dir is replaced
+    only once the new one is complete. Returns the meta dict.
+    """
+    counts = np.diff(corpus.offsets)
+    keep = np.flatnonzero(counts <= max_surfaces)
+    if verbose and len(keep) < len(counts):
+        print(f"⚠️ Leaving out {len(counts) - len(keep)} lenses with more than {max_surfaces} surfaces")
+    table, codes = material_table(corpus, catalog)
+
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    shards = []
+    for s, start in enumerate(range(0, len(keep), shard_lenses)):
+        lenses = keep[start:start + shard_lenses]
+        lens_ids = [str(corpus.lens_ids[i]) for i in lenses]
+        name = f"shard_{s:05d}"
+        shard_dir = os.path.join(tmp_dir, name)
+        os.makedirs(shard_dir)
+        surfaces, mask, finite, surface_type = surface_arrays(corpus, lenses, table, codes, max_surfaces)
+        targets, target_mask = target_arrays(corpus, lenses, catalog, stops)
+        arrays = {"surfaces": surfaces, "mask": mask, "finite": finite, "surface_type": surface_type,
+                  "targets": targets, "target_mask": target_mask, "lens_ids": np.array(lens_ids, dtype=str)}
+        if curves is not None:
+            arrays["curves"], arrays["curve_mask"] = curve_arrays(curves, lens_ids)
+        for array_name, array in arrays.items():
+            save_array(shard_dir, array_name, array)
+        shards.append({"name": name, "lenses": len(lenses)})
+        if verbose:
+            print(f"   {name}: {len(lenses)} lenses")
+
+    meta = {
+        "max_surfaces": max_surfaces,
+        "surface_features": SURFACE_FEATURES,
+        "type_names": [str(t) for t in corpus.type_names],
+        "targets": paraxial.METRICS,
+        "curve_channels": [str(c) for c in curves.channels] if curves is not None else [],
+        "shards": shards,
+        "lenses": int(len(keep)),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+# ---------------- Loading ----------------
+def open_dataset(path=DATASET_DIR):
+    """Memory-map every shard (nothing is read until a batch touches it)."""
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    shards = []
+    for shard in meta["shards"]:
+        shard_dir = os.path.join(path, shard["name"])
+        shards.append({os.path.splitext(f)[0]: np.load(os.path.join(shard_dir, f), mmap_mode="r")
+                       for f in sorted(os.listdir(shard_dir)) if f.endswith(".npy")})
+    offsets = np.zeros(len(shards) + 1, dtype=np.int64)
+    np.cumsum([shard["lenses"] for shard in meta["shards"]], out=offsets[1:])
+    return Dataset(meta, shards, offsets)
+
+
+def gather(dataset, rows):
+    """One batch: {array name: array} for global lens rows, read shard by shard in row order."""
+    rows = np.sort(rows)
+    shard_of = np.searchsorted(dataset.offsets, rows, side="right") - 1
+    parts = {}
+    for s in np.unique(shard_of):
+        local = rows[shard_of == s] - dataset.offsets[s]
+        for name, array in dataset.shards[s].items():
+            parts.setdefault(name, []).append(array[local])
+    return {name: np.concatenate(chunks) for name, chunks in parts.items()}
+
+
+def batches(dataset, batch_size=BATCH_SIZE, shuffle=True, seed=SEED, drop_last=False, prefetch=PREFETCH):
+    """
+    Yield batches (dicts of arrays) for one epoch. With shuffle, rows are
+    drawn in a fresh permutation across all shards; upcoming batches are
+    gathered on a background thread, up to prefetch ahead.
+    """
+    n = int(dataset.offsets[-1])
+    order = np.random.default_rng(seed).permutation(n) if shuffle else np.arange(n)
+    stop = n - n % batch_size if drop_last else n
+    starts = range(0, stop, batch_size)
+
+    ready = queue.Queue(maxsize=max(1, prefetch))
+    done = threading.Event()
+    end = object()
+
+    def hand_over(item):
+        """Queue item unless the consumer has gone; False once it has."""
+        while not done.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for start in starts:
+                if not hand_over(gather(dataset, order[start:start + batch_size])):
+                    return
+            hand_over(end)
+        except BaseException as e:
+            hand_over(e)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is end:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        done.set()
+        worker.join()
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    if os.path.exists(prescription_store.STORE_PATH):
+        corpus = prescription_store.load_store()
+    else:
+        corpus = prescription_store.build_store()
+    catalog, stops = paraxial.scan_zmx(paraxial.LENS_DIR)
+    curves = None
+    try:
+        import curve_resampling
+        curves = curve_resampling.refresh_tensor()
+    except Exception as e:
+        print(f"⚠️ No curve targets ({e})")
+    meta = export_dataset(corpus, DATASET_DIR, catalog, stops, curves, verbose=True)
+    exported = time.perf_counter()
+    print(f"✅ Dataset of {meta['lenses']} lenses in {len(meta['shards'])} shard(s) written to {DATASET_DIR} "
+          f"({exported - start:.2f} s)")
+
+    dataset = open_dataset(DATASET_DIR)
+    n_batches = 0
+    for batch in batches(dataset, BATCH_SIZE):
+        n_batches += 1
+    epoch = time.perf_counter() - exported
+    print(f"One shuffled epoch: {n_batches} batches of {BATCH_SIZE} in {epoch:.3f} s "
+          f"({meta['lenses'] / epoch:,.0f} lenses/s); batch shapes "
+          f"{ {name: array.shape for name, array in batch.items()} }")
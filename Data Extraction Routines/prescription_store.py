@@ -0,0 +1,135 @@
+'''
+Packed struct-of-arrays store of the LensDataExports prescriptions.
+
+The whole corpus is one uncompressed .npz (LensStore/prescriptions.npz)
+holding contiguous columns over every surface of every lens, CSR style:
+
+    lens_ids        (lenses,)          lens names, sorted
+    offsets         (lenses + 1,)      int64, lens i owns surfaces offsets[i]:offsets[i + 1]
+    radius, thickness, semi_diameter, conic
+                    (surfaces,)        float64
+    asphere         (surfaces, 8)      float64, A2..A16
+    type_code       (surfaces,)        int16 into type_names
+    material_code   (surfaces,)        int32 into material_names (the exact strings)
+
+Numbers are parsed once when the store is built, so analyses get typed
+float arrays instead of re-coercing object-dtype DataFrame columns, and a
+lens is an O(1) slice of every column. prescription() hands a lens back in
+the paraxial.read_prescription layout, so the tracers can run off the store.
+'''
+
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import paraxial
+
+# ---------------- Paths ----------------
+STORE_PATH = os.path.join(paraxial.DATA_DIR, "LensStore", "prescriptions.npz")
+
+# The packed corpus; every per-surface column has offsets[-1] rows
+PackedCorpus = namedtuple("PackedCorpus", ["lens_ids", "offsets", "radius", "thickness", "semi_diameter",
+                                           "conic", "asphere", "type_code", "type_names", "material_code",
+                                           "material_names"])
+
+# ---------------- Packing ----------------
+def intern(values, names):
+    """Codes of values into names ({name: code}, extended in place)."""
+    return [names.setdefault(value, len(names)) for value in values]
+
+
+def pack_prescriptions(prescriptions):
+    """Pack {lens_id: prescription} (paraxial.read_prescription layout) into a PackedCorpus, sorted by lens_id."""
+    lens_ids = sorted(prescriptions)
+    counts = [len(prescriptions[lens_id]["radius"]) for lens_id in lens_ids]
+    offsets = np.zeros(len(lens_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    def column(key):
+        if not lens_ids:
+            return np.empty(0)
+        return np.concatenate([np.asarray(prescriptions[lens_id][key], dtype=np.float64) for lens_id in lens_ids])
+
+    asphere = np.empty((int(offsets[-1]), len(paraxial.EVEN_ORDERS)))
+    for lens_id, start, stop in zip(lens_ids, offsets[:-1], offsets[1:]):
+        asphere[start:stop] = np.asarray(prescriptions[lens_id]["asphere"], dtype=np.float64).reshape(stop - start, -1)
+
+    types, materials = {}, {}
+    type_code = np.array([c for lens_id in lens_ids for c in intern(prescriptions[lens_id]["type"], types)],
+                         dtype=np.int16)
+    material_code = np.array([c for lens_id in lens_ids for c in intern(prescriptions[lens_id]["material"], materials)],
+                             dtype=np.int32)
+    return PackedCorpus(np.array(lens_ids, dtype=str), offsets, column("radius"), column("thickness"),
+                        column("semi_diameter"), column("conic"), asphere, type_code,
+                        np.array(list(types), dtype=str), material_code, np.array(list(materials), dtype=str))
+
+# ---------------- Reading / Writing ----------------
+def save_store(corpus, path=STORE_PATH):
+    """Write the corpus as one uncompressed .npz, atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **corpus._asdict())
+    os.replace(tmp_path, path)
+
+
+def build_store(lens_data_dir=paraxial.LENS_DATA_DIR, path=STORE_PATH):
+    """Parse every <lens>_LensData.csv once and write the packed store. Returns the PackedCorpus."""
+    corpus = pack_prescriptions(paraxial.read_lens_data(lens_data_dir))
+    save_store(corpus, path)
+    return corpus
+
+
+def load_store(path=STORE_PATH):
+    """Read the packed store back (no pickled objects; strings are fixed-width arrays)."""
+    with np.load(path, allow_pickle=False) as data:
+        return PackedCorpus(**{field: data[field] for field in PackedCorpus._fields})
+
+
+def nbytes(corpus):
+    """Bytes held by the corpus arrays."""
+    return sum(array.nbytes for array in corpus)
+
+# ---------------- Per-Lens Access ----------------
+def lens_index(corpus):
+    """{lens_id: position} for lens_slice()."""
+    return {str(lens_id): i for i, lens_id in enumerate(corpus.lens_ids)}
+
+
+def lens_slice(corpus, lens_id, index=None):
+    """Surface range of one lens as a slice into every per-surface column (empty if absent)."""
+    i = (index or lens_index(corpus)).get(lens_id)
+    if i is None:
+        return slice(0, 0)
+    return slice(int(corpus.offsets[i]), int(corpus.offsets[i + 1]))
+
+
+def prescription(corpus, lens_id, index=None):
+    """One lens in the paraxial.read_prescription layout, as views into the corpus arrays."""
+    rows = lens_slice(corpus, lens_id, index)
+    asphere = corpus.asphere[rows]
+    return {
+        "type": [str(t) for t in corpus.type_names[corpus.type_code[rows]]],
+        "radius": corpus.radius[rows],
+        "thickness": corpus.thickness[rows],
+        "material": [str(m) for m in corpus.material_names[corpus.material_code[rows]]],
+        "semi_diameter": corpus.semi_diameter[rows],
+        "a2": asphere[:, 0],
+        "conic": corpus.conic[rows],
+        "asphere": asphere,
+    }
+
+
+def prescriptions(corpus):
+    """{lens_id: prescription} for the whole corpus."""
+    index = lens_index(corpus)
+    return {lens_id: prescription(corpus, lens_id, index) for lens_id in index}
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    corpus = build_store(paraxial.LENS_DATA_DIR, STORE_PATH)
+    print(f"✅ Packed {len(corpus.lens_ids)} lenses / {corpus.offsets[-1]} surfaces "
+          f"({nbytes(corpus) / 1e6:.2f} MB) to {STORE_PATH} ({time.perf_counter() - start:.2f} s)")
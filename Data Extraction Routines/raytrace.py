@@ -0,0 +1,741 @@
+'''
+Batched real-ray tracer for Standard and Even Asphere prescriptions.
+
+Rays for many lenses are traced at once as arrays shaped (lenses,
+wavelengths, rays): every surface is intersected as a conic in closed
+form, refined with Newton iterations on the even-asphere sag (A2..A16),
+and refracted with the vector form of Snell's law (a MIRROR reflects).
+Lenses are kept sorted by surface count so each surface step only touches
+the lenses that still have that surface.
+
+Throughput is measured, on one core over the LensDataExports corpus, as
+ray-surface intersections per second. propagate() alone, tracing 101 rays
+per wavelength, reaches about 6.5e6 per second. The __main__ run below,
+with aiming included, reaches about 5.8e6. Both fall short of the 1e7
+target. Each intersection costs roughly 40 whole-array numpy passes, and
+the updates are already done in place; closing the rest of the gap would
+take a fused (compiled) surface kernel.
+
+Rays are aimed like OpticStudio's real ray aiming: the launch point is
+iterated until the ray crosses the stop surface at its relative pupil
+coordinate times the paraxial stop radius (the EPD comes from the Image
+Space F/# or the Entrance Pupil Diameter when the lens file has one, see
+paraxial.first_order).
+propagate() can also clip rays at per-surface radii (the floating /
+circular apertures of the lens file, or the surface semi-diameters) and
+accumulate the optical path along the way.
+
+On top of the tracer it rebuilds the two analyses that otherwise need an
+OpticStudio run and a text export:
+
+  longitudinal()     Longitudinal aberration vs. relative pupil, per wavelength
+  field_curvature()  Tan/Sag focus shift, real/reference height and distortion
+                     vs. field angle (or object height), per wavelength
+
+Both can be turned into the same Table tuples analysis_parser produces, so
+write_tables() writes them in the CSVExports layout.
+'''
+
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import paraxial
+from materials import material_codes, index_table
+from analysis_parser import Table, write_csv
+
+# ---------------- Settings ----------------
+SUPPORTED_TYPES = {"Standard", "Even Asphere"}
+NEWTON_ITERATIONS = 8
+AIM_ITERATIONS = 8
+CONTINUATION_STEPS = 16      # field / pupil steps for rays the paraxial aim guess loses
+TOLERANCE = 1e-9              # mm, for the asphere intersection and the stop aiming
+PUPIL_EPS = 1e-6              # stands in for pupil 0 (the paraxial limit)
+BLOCK_LENSES = 256            # lenses traced together per surface step
+DIFFERENTIAL = 1e-5           # relative pupil offset of the field-curvature neighbour rays
+FIELD_POINTS = 101            # field points of the FieldCurvature export (0 to the largest field)
+HEIGHT_ITERATIONS = 8         # secant steps onto a real image height (FTYP 3)
+PUPIL = np.linspace(0.0, 1.0, 101)
+
+OUTPUT_ROOT = os.path.join(paraxial.DATA_DIR, "CSVExports", "RayTrace")
+
+# A traced system: surfaces padded to (lenses, surfaces), lenses sorted by surface count
+System = namedtuple("System", ["lens_ids", "curv", "thick", "conic", "coeffs", "index", "aperture",
+                               "semi_diameter", "image", "stop", "supported", "infinite", "field_type", "max_field",
+                               "object_height", "first", "wavelengths", "primary"])
+
+# Ray positions (x, y, z) and direction cosines (k, l, m), each (lenses, wavelengths, rays)
+Rays = namedtuple("Rays", ["x", "y", "z", "k", "l", "m"])
+
+# ---------------- Packing ----------------
+def build_system(prescriptions, wavelengths=paraxial.WAVELENGTHS, primary=paraxial.PRIMARY,
+                 catalog=None, stops=None):
+    """
+    Pack the prescriptions for tracing. Lenses with a surface type other
+    than Standard / Even Asphere, or with a glass that cannot be resolved,
+    are kept but marked unsupported (their results are NaN).
+    """
+    codes, materials = material_codes(prescriptions, catalog)
+    lens_ids, _, thick, _, _, code, image, _ = paraxial.pack(prescriptions, codes, stops)
+    index = paraxial.media(code, index_table(materials, wavelengths))
+    first = paraxial.first_order(prescriptions, wavelengths, primary, catalog, stops)
+
+    n_lenses, n_surf = thick.shape
+    curv = np.zeros((n_lenses, n_surf))
+    conic = np.zeros((n_lenses, n_surf))
+    coeffs = np.zeros((n_lenses, n_surf, len(paraxial.EVEN_ORDERS)))
+    aperture = np.full((n_lenses, n_surf), np.inf)
+    semi_diameter = np.full((n_lenses, n_surf), np.inf)
+    supported = np.isfinite(first["efl"]) & np.isfinite(first["epd"])
+    for i, lens_id in enumerate(lens_ids):
+        p = prescriptions[lens_id]
+        n = len(p["radius"])
+        # The bare vertex curvature: A2 of an even asphere enters through the sag
+        radius = np.array(p["radius"], dtype=np.float64)
+        flat = ~np.isfinite(radius) | (radius == 0)
+        curv[i, :n] = np.where(flat, 0.0, 1.0 / np.where(flat, 1.0, radius))
+        conic[i, :n] = np.nan_to_num(np.array(p["conic"], dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+        # Clip radii for propagate(): circular / floating apertures, and semi-diameters
+        clip = np.array(p.get("aperture", [np.nan] * n), dtype=np.float64)
+        semi = np.array(p["semi_diameter"], dtype=np.float64)
+        aperture[i, :n] = np.where(clip > 0, clip, np.inf)
+        semi_diameter[i, :n] = np.where(semi > 0, semi, np.inf)
+        for s, type_name in enumerate(p["type"][1:n - 1], start=1):
+            if type_name == "Even Asphere":
+                coeffs[i, s] = np.nan_to_num(np.array(p["asphere"][s], dtype=np.float64), nan=0.0)
+            elif type_name not in SUPPORTED_TYPES:
+                supported[i] = False
+        if not np.isfinite(index[i, :, :n]).all():
+            supported[i] = False
+
+    # Field types: 0 angle, 1 object height, 2 paraxial image height, 3 real image height.
+    # Heights need a finite object; real image heights are analysed as angles like OpticStudio does.
+    infinite = ~np.isfinite(thick[:, 0])
+    field_type = np.array([prescriptions[lens_id].get("field_type", 0) for lens_id in lens_ids])
+    max_field = np.array([prescriptions[lens_id].get("max_field", np.nan) for lens_id in lens_ids], dtype=np.float64)
+    object_height = ~infinite & np.isin(field_type, (1, 2))
+
+    # Rays are aimed inside the stop, so its semi-diameter never clips them
+    semi_diameter[np.arange(n_lenses), first["stop_surface"]] = np.inf
+
+    order = np.argsort(-image, kind="stable")
+    first = {key: (value[order] if isinstance(value, np.ndarray) else [value[i] for i in order])
+             for key, value in first.items()}
+    return System([lens_ids[i] for i in order], curv[order], thick[order], conic[order], coeffs[order],
+                  index[order], aperture[order], semi_diameter[order], image[order], first["stop_surface"], supported[order],
+                  infinite[order], field_type[order], max_field[order], object_height[order], first,
+                  np.asarray(wavelengths, dtype=np.float64), primary)
+
+def wavelength_groups(prescriptions):
+    """
+    {(wavelengths, primary): [lens_id, ...]}: the lenses grouped by their
+    own WAVM list (µm, in file order) and 0-based primary wavelength.
+    Lenses without a usable list fall back to paraxial.WAVELENGTHS / PRIMARY.
+    """
+    groups = {}
+    for lens_id, p in prescriptions.items():
+        wavelengths = tuple(float(w) for w in p.get("wavelengths", []))
+        primary = p.get("primary_wavelength", 0) - 1
+        if not wavelengths or not all(np.isfinite(w) and w > 0 for w in wavelengths) \
+                or not 0 <= primary < len(wavelengths):
+            wavelengths, primary = tuple(paraxial.WAVELENGTHS), paraxial.PRIMARY
+        groups.setdefault((wavelengths, primary), []).append(lens_id)
+    return groups
+
+
+def build_systems(prescriptions, catalog=None, stops=None):
+    """One build_system() per wavelength_groups() group, so every lens is traced at its own wavelengths."""
+    return [build_system({lens_id: prescriptions[lens_id] for lens_id in lens_ids}, list(wavelengths), primary,
+                         catalog, stops)
+            for (wavelengths, primary), lens_ids in wavelength_groups(prescriptions).items()]
+
+# ---------------- Surface Geometry ----------------
+def conic_slope(rho2, c, kappa):
+    """dz/d(ρ²) of the conic sag z = cρ² / (1 + sqrt(1 - (1+κ)c²ρ²))."""
+    return c / (2.0 * np.sqrt(1.0 - (1.0 + kappa) * c * c * rho2))
+
+
+def asphere_terms(rho2, coeffs):
+    """Even-asphere polynomial Σ A(2i) ρ^(2i) and its derivative with respect to ρ²."""
+    sag = np.zeros_like(rho2)
+    slope = np.zeros_like(rho2)
+    for i in range(coeffs.shape[-1] - 1, -1, -1):
+        # Horner in ρ²: sag = ρ²(A2 + ρ²(A4 + ...)), slope = A2 + 2A4ρ² + 3A6ρ⁴ + ...
+        a = coeffs[..., i]
+        sag = (sag + a) * rho2
+        slope = slope * rho2 + (i + 1) * a
+    return sag, slope
+
+
+def intersect(x, y, z, k, l, m, c, kappa):
+    """
+    Distance along the ray to the conic through the local origin (the root
+    nearest the vertex); NaN when the ray misses.
+    """
+    # c(x² + y² + (1+κ)z²) - 2z = 0 along P + tD, using k² + l² + m² = 1.
+    # Spheres (κ = 0 on every lens of the step) skip the κ terms, which are exact no-ops there
+    sphere = not kappa.any()
+    kz = z if sphere else (1.0 + kappa) * z
+    a = c if sphere else c * (1.0 + kappa * m * m)
+    h = x * k
+    h += y * l
+    h += kz * m
+    h *= c
+    h -= m
+    cc = x * x
+    cc += y * y
+    cc += kz * z
+    cc *= c
+    cc -= 2.0 * z
+    root = h * h
+    root -= a * cc
+    np.sqrt(root, out=root)
+    np.copysign(root, m, out=root)
+    # The vertex branch is -(h + root)/a; when h and m share a sign (steep
+    # rays near the rim) that form has no cancellation, otherwise the
+    # rationalised -cc/(h - root) is the stable one (and finite for c = 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vertex = h + root
+        vertex /= a
+        rationalised = h - root
+        np.divide(cc, rationalised, out=rationalised)
+        h *= m
+        return np.negative(np.where(h > 0, vertex, rationalised))
+
+
+def newton(x, y, z, k, l, m, c, kappa, coeffs):
+    """Refine points on the base conic onto the full even-asphere sag."""
+    for _ in range(NEWTON_ITERATIONS):
+        rho2 = x * x + y * y
+        sag, slope = asphere_terms(rho2, coeffs)
+        root = np.sqrt(1.0 - (1.0 + kappa) * c * c * rho2)
+        sag = sag + c * rho2 / (1.0 + root)
+        slope = slope + c / (2.0 * root)
+        dt = (z - sag) / (m - 2.0 * slope * (x * k + y * l))
+        x, y, z = x - dt * k, y - dt * l, z - dt * m
+        if not np.nanmax(np.abs(dt), initial=0.0) > TOLERANCE:
+            break
+    return x, y, z
+
+
+def refract(x, y, k, l, m, slope, mu):
+    """
+    New direction cosines at a surface point with sag slope dz/d(ρ²), for
+    n / n' = mu, written over k, l, m. A negative mu (the signed index of a
+    MIRROR) reflects; total internal reflection gives NaN.
+    """
+    # Normal (nx, ny, 1) / |N| from the gradient of z - sag(ρ²)
+    slope = -2.0 * slope
+    nx, ny = slope * x, slope * y
+    inv = nx * nx
+    inv += ny * ny
+    inv += 1.0
+    np.sqrt(inv, out=inv)
+    np.divide(1.0, inv, out=inv)
+    cos_i = nx * k
+    cos_i += ny * l
+    cos_i += m
+    cos_i *= inv
+    if (mu > 0).all():
+        # D' = μD + (cosθ' - μ cosθ)N with N turned along the ray
+        cos_t = cos_i * cos_i
+        np.subtract(1.0, cos_t, out=cos_t)
+        cos_t *= mu * mu
+        np.subtract(1.0, cos_t, out=cos_t)
+        np.sqrt(cos_t, out=cos_t)
+        g = np.copysign(cos_t, cos_i, out=cos_t)
+        cos_i *= mu
+        g -= cos_i
+        g *= inv
+        for d, n in ((k, nx), (l, ny), (m, None)):
+            d *= mu
+            d += g if n is None else n * g
+        return k, l, m
+    # Mirrors: D' = D - 2(D·N)N
+    mirror = mu < 0
+    mu = np.abs(mu)
+    cos_t = np.sqrt(1.0 - mu * mu * (1.0 - cos_i * cos_i))
+    g = np.where(mirror, -2.0 * cos_i, np.copysign(cos_t, cos_i) - mu * cos_i) * inv
+    mu = np.where(mirror, 1.0, mu)
+    for d, n in ((k, nx), (l, ny), (m, None)):
+        d *= mu
+        d += g if n is None else n * g
+    return k, l, m
+
+# ---------------- Trace ----------------
+@np.errstate(invalid="ignore", divide="ignore", over="ignore")
+def propagate(system, rays, record=None, clip=None, path=None):
+    """
+    Trace rays (positions relative to the vertex of surface 1) through
+    every surface before the image.
+
+    record   : optional (lenses,) surface number per lens; the rays as they
+               leave that surface (in its local frame) are returned as well,
+               and the trace stops after the last recorded surface.
+    clip     : optional (lenses, surfaces) radii (system.aperture,
+               system.semi_diameter); rays outside one become NaN from there on
+    path     : optional (lenses, wavelengths, rays) array the optical path
+               length of every segment is added to, in place
+    Returns (rays at each lens's last traced surface in its local frame,
+    recorded rays or None, number of ray-surface intersections).
+
+    Lenses go through in blocks of BLOCK_LENSES so the working arrays of
+    one surface step stay in cache.
+    """
+    rays = [np.array(a, dtype=np.float64) for a in rays]
+    saved = [np.full_like(rays[0], np.nan) for _ in range(6)] if record is not None else None
+    count = 0
+    for start in range(0, len(system.image), BLOCK_LENSES):
+        block = slice(start, start + BLOCK_LENSES)
+        count += trace_block(system, block, [a[block] for a in rays],
+                             record[block] if record is not None else None,
+                             [a[block] for a in saved] if saved is not None else None,
+                             clip[block] if clip is not None else None,
+                             path[block] if path is not None else None)
+    return Rays(*rays), (Rays(*saved) if saved is not None else None), count
+
+
+def trace_block(system, block, rays, record, saved, clip=None, path=None):
+    """Surface loop of propagate() for one block of lenses; rays, saved and path are updated in place."""
+    x, y, z, k, l, m = rays
+    curv, thick, conic, coeffs, index, image = (system.curv[block], system.thick[block], system.conic[block],
+                                                system.coeffs[block], system.index[block], system.image[block])
+    per_lens = x.shape[1] * x.shape[2]
+    last_surface = int(image.max()) - 1 if record is None else int(np.max(record, initial=1))
+    count = 0
+
+    for s in range(1, last_surface + 1):
+        n = int(np.count_nonzero(image > s))
+        if n == 0:
+            break
+        if s > 1:
+            z[:n] -= thick[:n, s - 1, None, None]
+        c, kappa = curv[:n, s, None, None], conic[:n, s, None, None]
+        xs, ys, zs, ks, ls, ms = x[:n], y[:n], z[:n], k[:n], l[:n], m[:n]
+
+        t = intersect(xs, ys, zs, ks, ls, ms, c, kappa)
+        if path is not None:
+            x0, y0, z0 = xs.copy(), ys.copy(), zs.copy()
+        # The views of x .. m are updated in place from here on
+        xs += t * ks
+        ys += t * ls
+        zs += t * ms
+        slope = conic_slope(xs * xs + ys * ys, c, kappa)
+
+        aspheric = np.flatnonzero(coeffs[:n, s].any(axis=1))
+        if aspheric.size:
+            a = coeffs[aspheric, s][:, None, None, :]
+            ca, ka = c[aspheric], kappa[aspheric]
+            xa, ya, za = newton(xs[aspheric], ys[aspheric], zs[aspheric],
+                                ks[aspheric], ls[aspheric], ms[aspheric], ca, ka, a)
+            xs[aspheric], ys[aspheric], zs[aspheric] = xa, ya, za
+            rho2 = xa * xa + ya * ya
+            slope[aspheric] = conic_slope(rho2, ca, ka) + asphere_terms(rho2, a)[1]
+
+        if clip is not None:
+            radius = clip[:n, s, None, None]
+            xs[xs * xs + ys * ys > radius * radius] = np.nan
+        if path is not None:
+            medium = np.abs(index[:n, :, s - 1])[:, :, None]
+            path[:n] += medium * ((xs - x0) * ks + (ys - y0) * ls + (zs - z0) * ms)
+
+        mu = (index[:n, :, s - 1] / index[:n, :, s])[:, :, None]
+        refract(xs, ys, ks, ls, ms, slope, mu)
+        count += n * per_lens
+
+        if record is not None:
+            here = np.flatnonzero(record == s)
+            for dst, src in zip(saved, (x, y, z, k, l, m)):
+                dst[here] = src[here]
+    return count
+
+
+@np.errstate(invalid="ignore", divide="ignore", over="ignore")
+def to_image(system, rays):
+    """Carry rays from the local frame of the last surface to the image plane (z = 0)."""
+    rows = np.arange(len(system.image))
+    t_last = system.thick[rows, system.image - 1][:, None, None]
+    t = (t_last - rays.z) / rays.m
+    return Rays(rays.x + t * rays.k, rays.y + t * rays.l, np.zeros_like(rays.z), rays.k, rays.l, rays.m)
+
+
+def trace_rays(system, rays):
+    """Trace rays to the image plane. Returns (rays at the image, intersections)."""
+    at_last, _, count = propagate(system, rays)
+    return to_image(system, at_last), count
+
+# ---------------- Ray Aiming ----------------
+@np.errstate(invalid="ignore", divide="ignore", over="ignore")
+def launch(system, field, hx, hy):
+    """
+    Rays crossing the paraxial entrance pupil plane at (hx, hy), returned
+    where they cross the tangent plane of surface 1.
+
+    field  : (lenses, rays) object height for lenses with system.object_height,
+             field angle in degrees otherwise
+    hx, hy : launch point in the pupil plane, broadcast to (lenses, wavelengths, rays)
+    Positions are relative to the vertex of surface 1.
+    """
+    z_ep = entrance_pupil(system)[:, None, None]
+    field = field[:, None, :]
+    t0 = np.where(system.infinite, 0.0, system.thick[:, 0])[:, None, None]
+    infinite = system.infinite[:, None, None]
+
+    # Infinite object: parallel beam at the field angle. Finite object: from the object point
+    theta = np.radians(np.where(system.object_height[:, None, None], 0.0, field))
+    y_object = object_point(system, field)
+    dx, dy, dz = hx, hy - y_object, z_ep + t0
+    norm = np.sqrt(dx * dx + dy * dy + dz * dz)
+    k = np.where(infinite, 0.0, dx / norm)
+    l = np.where(infinite, np.sin(theta), dy / norm)
+    m = np.where(infinite, np.cos(theta), dz / norm)
+    # Start on the tangent plane of surface 1, so the intersection picks the vertex side of its sphere
+    x, y = hx - k / m * z_ep, hy - l / m * z_ep
+    shape = (len(system.lens_ids), len(system.wavelengths), field.shape[-1])
+    return Rays(*(np.broadcast_to(a, shape) for a in (x, y, 0.0, k, l, m)))
+
+
+def entrance_pupil(system):
+    """Paraxial entrance pupil position from surface 1 (0 where it is at infinity)."""
+    z_ep = system.first["entrance_pupil"]
+    return np.where(np.isfinite(z_ep), z_ep, 0.0)
+
+
+@np.errstate(invalid="ignore")
+def object_point(system, field):
+    """
+    Object height of each field of a finite-conjugate lens, for field
+    arrays with lenses on the first axis. A field angle puts it where the
+    ray at that angle through the pupil centre starts; the object plane is
+    thick[:, 0] in front of surface 1.
+    """
+    expand = (slice(None),) + (None,) * (np.ndim(field) - 1)
+    z = (entrance_pupil(system) + np.where(system.infinite, 0.0, system.thick[:, 0]))[expand]
+    return np.where(system.object_height[expand], field, -np.tan(np.radians(field)) * z)
+
+
+def stop_radius(system):
+    """Paraxial stop radius per lens and wavelength, from an on-axis ray at pupil PUPIL_EPS."""
+    n_lenses, n_waves = len(system.lens_ids), len(system.wavelengths)
+    r_ep = system.first["epd"][:, None, None] / 2.0
+    h = np.broadcast_to(PUPIL_EPS * r_ep, (n_lenses, n_waves, 1))
+    rays = launch(system, np.zeros((n_lenses, 1)), np.zeros_like(h), h)
+    _, at_stop, count = propagate(system, rays, record=system.stop)
+    return (at_stop.y / PUPIL_EPS)[:, :, 0], count
+
+
+def stop_miss(system, field, target_x, target_y, hx, hy):
+    """How far the rays launched from (hx, hy) cross the stop from the targets, plus intersections."""
+    _, at_stop, count = propagate(system, launch(system, field, hx, hy), record=system.stop)
+    return at_stop.x - target_x, at_stop.y - target_y, count
+
+
+@np.errstate(invalid="ignore", divide="ignore", over="ignore")
+def secant(system, field, target_x, target_y, gain, hx, hy, tolerance=TOLERANCE):
+    """
+    Move the launch points (hx, hy) until the rays cross the stop at the
+    targets. Secant iterations per coordinate, falling back to the paraxial
+    gain where the slope degenerates; each iteration only retraces the
+    lenses and ray columns that still have a ray off target.
+    Returns (hx, hy, miss x, miss y, intersections).
+    """
+    ex, ey, count = stop_miss(system, field, target_x, target_y, hx, hy)
+    hx, hy = np.broadcast_to(hx, ex.shape).copy(), np.broadcast_to(hy, ex.shape).copy()
+    target_x, target_y = np.broadcast_to(target_x, ex.shape), np.broadcast_to(target_y, ex.shape)
+    gain = np.broadcast_to(gain, ex.shape)
+    step_x, step_y = np.nan_to_num(-ex / gain), np.nan_to_num(-ey / gain)
+    waves = np.arange(ex.shape[1])
+    for _ in range(AIM_ITERATIONS):
+        off = (np.abs(ex) > tolerance) | (np.abs(ey) > tolerance)
+        rows = np.flatnonzero(off.any(axis=(1, 2)))
+        if not rows.size:
+            break
+        cols = np.flatnonzero(off[rows].any(axis=(0, 1)))
+        block = np.ix_(rows, waves, cols)
+        hx_new, hy_new = hx[block] + step_x[block], hy[block] + step_y[block]
+        ex_new, ey_new, n = stop_miss(subset(system, rows), field[np.ix_(rows, cols)],
+                                      target_x[block], target_y[block], hx_new, hy_new)
+        count += n
+        dex, dey = ex_new - ex[block], ey_new - ey[block]
+        slope_x = np.where((step_x[block] != 0) & (dex != 0), dex / step_x[block], gain[block])
+        slope_y = np.where((step_y[block] != 0) & (dey != 0), dey / step_y[block], gain[block])
+        # Converged rays stop moving
+        new_x = np.where(np.abs(ex_new) > tolerance, -ex_new / slope_x, 0.0)
+        new_y = np.where(np.abs(ey_new) > tolerance, -ey_new / slope_y, 0.0)
+        step_x[block] = np.where(np.isfinite(new_x), new_x, 0.0)
+        step_y[block] = np.where(np.isfinite(new_y), new_y, 0.0)
+        hx[block], hy[block], ex[block], ey[block] = hx_new, hy_new, ex_new, ey_new
+    return hx, hy, ex, ey, count
+
+
+def aim(system, field, px, py, guess=None, recover=True, tolerance=TOLERANCE):
+    """
+    Real ray aiming: launch points whose rays cross the stop at (px, py)
+    times the paraxial stop radius, starting from the paraxial guess (or
+    from guess, launch points (hx, hy) broadcast to (lenses, wavelengths,
+    rays), when the caller has a better one).
+
+    Rays whose paraxial guess misses a surface (wide-angle lenses at the
+    edge of the field, fast lenses at the rim of the pupil) are aimed again
+    by walking field and pupil out from the axis in CONTINUATION_STEPS,
+    each step starting from a linear extrapolation of the previous two.
+    recover=False skips that walk, for a guess taken from rays already
+    aimed that way, and returns the rays still off target as NaN (lost);
+    tolerance is the allowed miss at the stop in mm.
+
+    field, px, py : (lenses, rays)
+    Returns (launched rays, intersections spent aiming).
+    """
+    r_stop, count = stop_radius(system)
+    r_stop = r_stop[:, system.primary, None, None]
+    gain = r_stop / (system.first["epd"][:, None, None] / 2.0)
+    target_x, target_y = px[:, None, :] * r_stop, py[:, None, :] * r_stop
+
+    if guess is None:
+        guess = (target_x / gain, target_y / gain)
+    hx, hy, ex, ey, n = secant(system, field, target_x, target_y, gain, *guess, tolerance=tolerance)
+    count += n
+    lost = (np.isnan(ex) | np.isnan(ey)) & system.supported[:, None, None]
+    if not recover:
+        off = ~((np.abs(ex) <= tolerance) & (np.abs(ey) <= tolerance))
+        hx, hy = np.where(off, np.nan, hx), np.where(off, np.nan, hy)
+    rows = np.flatnonzero(lost.any(axis=(1, 2)))
+    if recover and rows.size:
+        cols = np.flatnonzero(lost[rows].any(axis=(0, 1)))
+        sub = subset(system, rows)
+        sub_field = field[rows][:, cols]
+        tx, ty, g = target_x[rows][..., cols], target_y[rows][..., cols], gain[rows]
+        previous = current = (np.zeros_like(tx), np.zeros_like(ty))
+        for step in range(1, CONTINUATION_STEPS + 1):
+            t = step / CONTINUATION_STEPS
+            guess = (2 * current[0] - previous[0], 2 * current[1] - previous[1]) if step > 1 else (t * tx / g, t * ty / g)
+            sub_x, sub_y, sub_ex, sub_ey, n = secant(sub, sub_field * t, t * tx, t * ty, g, *guess)
+            count += n
+            previous, current = current, (sub_x, sub_y)
+        block = np.ix_(rows, np.arange(hx.shape[1]), cols)
+        found = lost[block] & np.isfinite(sub_ex) & np.isfinite(sub_ey)
+        hx[block] = np.where(found, sub_x, hx[block])
+        hy[block] = np.where(found, sub_y, hy[block])
+    return launch(system, field, hx, hy), count
+
+
+def subset(system, rows):
+    """The system restricted to the given lens rows (ascending, so the surface-count order holds)."""
+    first = {key: (value[rows] if isinstance(value, np.ndarray) else [value[i] for i in rows])
+             for key, value in system.first.items()}
+    return system._replace(lens_ids=[system.lens_ids[i] for i in rows], curv=system.curv[rows],
+                           thick=system.thick[rows], conic=system.conic[rows], coeffs=system.coeffs[rows],
+                           index=system.index[rows], aperture=system.aperture[rows],
+                           semi_diameter=system.semi_diameter[rows], image=system.image[rows],
+                           stop=system.stop[rows], supported=system.supported[rows],
+                           infinite=system.infinite[rows], field_type=system.field_type[rows],
+                           max_field=system.max_field[rows], object_height=system.object_height[rows],
+                           first=first)
+
+# ---------------- Fields ----------------
+def reference_scale(system):
+    """
+    Paraxial image height on the image surface per unit tan(field angle),
+    or per unit object height: the aimed chief ray of a field PUPIL_EPS
+    degrees (or mm) off axis. Returns (lenses, wavelengths).
+    """
+    n_lenses = len(system.lens_ids)
+    field = np.full((n_lenses, 1), PUPIL_EPS)
+    rays, _ = aim(system, field, np.zeros_like(field), np.zeros_like(field))
+    at_image, _ = trace_rays(system, rays)
+    unit = np.where(system.object_height, PUPIL_EPS, np.tan(np.radians(PUPIL_EPS)))[:, None]
+    return at_image.y[:, :, 0] / unit
+
+
+def field_grid(system, n_fields):
+    """n_fields evenly spaced from 0 to each lens's largest field, (lenses, n_fields)."""
+    return np.nan_to_num(system.max_field)[:, None] * np.linspace(0.0, 1.0, n_fields)
+
+
+def chief_height(system, launch_field):
+    """Real chief ray height on the image surface at the primary wavelength, (lenses, fields)."""
+    zero = np.zeros_like(launch_field)
+    rays, _ = aim(system, launch_field, zero, zero)
+    at_image, _ = trace_rays(system, rays)
+    return at_image.y[:, system.primary]
+
+
+@np.errstate(invalid="ignore", divide="ignore")
+def launch_fields(system, fields):
+    """
+    Convert fields in each lens's field units into what launch()
+    takes (object height for lenses with system.object_height, angle in
+    degrees otherwise). Paraxial image heights go through the paraxial
+    chief ray scale; real image heights are then refined by secant steps
+    on the real chief ray height.
+    """
+    scale = reference_scale(system)[:, system.primary, None]
+    image_height = np.isin(system.field_type, (2, 3))[:, None]
+    unit = np.where(image_height, fields / scale,
+                    np.where(system.object_height[:, None], fields, np.tan(np.radians(fields))))
+
+    rows = np.flatnonzero(system.field_type == 3)
+    if rows.size:
+        sub = subset(system, rows)
+        target, u = fields[rows], unit[rows]
+        error = chief_height(sub, to_launch(sub, u)) - target
+        slope = np.broadcast_to(scale[rows], u.shape)
+        for _ in range(HEIGHT_ITERATIONS):
+            if not np.nanmax(np.abs(error), initial=0.0) > TOLERANCE:
+                break
+            step = np.where(np.abs(error) > TOLERANCE, -error / slope, 0.0)
+            u_new = u + np.where(np.isfinite(step), step, 0.0)
+            error_new = chief_height(sub, to_launch(sub, u_new)) - target
+            secant = (error_new - error) / (u_new - u)
+            slope = np.where(np.isfinite(secant) & (secant != 0), secant, slope)
+            u, error = np.where(np.isfinite(error_new), u_new, u), np.where(np.isfinite(error_new), error_new, error)
+        unit[rows] = u
+    return to_launch(system, unit)
+
+
+def to_launch(system, unit):
+    """tan(field angle) or object height -> the field launch() takes."""
+    return np.where(system.object_height[:, None], unit, np.degrees(np.arctan(unit)))
+
+# ---------------- Analyses ----------------
+def longitudinal(system, pupil=PUPIL):
+    """
+    Longitudinal aberration of the on-axis beam.
+
+    Returns (pupil, aberration (lenses, pupil, wavelengths), intersections):
+    where a meridional ray at each relative pupil height crosses the axis,
+    measured from the image surface.
+    """
+    n_lenses = len(system.lens_ids)
+    pupil = np.asarray(pupil, dtype=np.float64)
+    py = np.broadcast_to(np.maximum(pupil, PUPIL_EPS), (n_lenses, pupil.size))
+    rays, count = aim(system, np.zeros_like(py), np.zeros_like(py), py)
+    at_image, n = trace_rays(system, rays)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        crossing = -at_image.y * at_image.m / at_image.l
+    crossing[~system.supported] = np.nan
+    return pupil, crossing.transpose(0, 2, 1), count + n
+
+
+def curvature_fields(system, n_fields=FIELD_POINTS):
+    """
+    The field axis of each lens's FieldCurvature export, (lenses, n_fields)
+    from 0 to its largest field: heights for field types 1 and 2, degrees
+    otherwise. A real image height (type 3) is plotted against the field
+    angle whose real chief ray reaches it.
+    """
+    fields = field_grid(system, n_fields)
+    rows = np.flatnonzero(system.field_type == 3)
+    if rows.size:
+        largest = launch_fields(subset(system, rows), fields[rows, -1:])
+        fields[rows] = np.nan_to_num(largest) * np.linspace(0.0, 1.0, n_fields)
+    return fields
+
+
+def field_curvature(system, fields=None):
+    """
+    Field curvature and distortion along the real chief ray.
+
+    fields : (n_fields,) or (lenses, n_fields) values of each lens's field
+             axis: paraxial image height for field type 2, object height
+             for type 1, field angle in degrees otherwise (default
+             curvature_fields())
+    Returns (fields (lenses, n_fields), data (lenses, wavelengths, n_fields, 5), intersections)
+    with data columns Tan Shift, Sag Shift, Real Height, Ref. Height, Distortion (%).
+    Tangential and sagittal foci come from neighbour rays DIFFERENTIAL away
+    from the chief ray in the y and x pupil directions.
+    """
+    n_lenses = len(system.lens_ids)
+    fields = curvature_fields(system) if fields is None else np.asarray(fields, dtype=np.float64)
+    fields = np.broadcast_to(fields, (n_lenses, fields.shape[-1]))
+    n_fields = fields.shape[1]
+
+    # Paraxial image heights become the object angle / height that images there
+    scale = reference_scale(system)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        unit = np.where((system.field_type == 2)[:, None], fields / scale[:, system.primary, None],
+                        np.where(system.object_height[:, None], fields, np.tan(np.radians(fields))))
+    launch_field = np.where(system.object_height[:, None], unit, np.degrees(np.arctan(unit)))
+
+    # Chief, tangential (+y pupil) and sagittal (+x pupil) rays, side by side
+    zero = np.zeros_like(fields)
+    d = np.full_like(fields, DIFFERENTIAL)
+    field3 = np.concatenate([launch_field] * 3, axis=1)
+    px = np.concatenate([zero, zero, d], axis=1)
+    py = np.concatenate([zero, d, zero], axis=1)
+    rays, count = aim(system, field3, px, py)
+    at_image, n = trace_rays(system, rays)
+
+    def part(a, j):
+        return a[:, :, j * n_fields:(j + 1) * n_fields]
+
+    yc, lc, mc = part(at_image.y, 0), part(at_image.l, 0), part(at_image.m, 0)
+    yt, lt, mt = part(at_image.y, 1), part(at_image.l, 1), part(at_image.m, 1)
+    xs, ks, ms = part(at_image.x, 2), part(at_image.k, 2), part(at_image.m, 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tan_shift = (yt - yc) / (lc / mc - lt / mt)
+        sag_shift = -xs * ms / ks
+        # Reference height: the paraxial chief ray height on the image surface
+        ref = scale[:, :, None] * unit[:, None, :]
+        distortion = np.where(ref != 0, 100.0 * (yc - ref) / ref, 0.0)
+    data = np.stack([tan_shift, sag_shift, yc, ref, distortion], axis=-1)
+    data[~system.supported] = np.nan
+    return fields, data, count + n
+
+# ---------------- Export Tables ----------------
+def longitudinal_tables(system, pupil, aberration, i):
+    """The Longitudinal export of lens i as analysis_parser Table tuples."""
+    headers = ["Rel. Pupil"] + [f"{w:.4f}" for w in system.wavelengths]
+    return [Table(headers, None, np.column_stack([pupil, aberration[i]]), None)]
+
+
+def field_curvature_tables(system, fields, data, i):
+    """The FieldCurvature export of lens i as analysis_parser Table tuples (one per wavelength)."""
+    axis = "Y Height" if system.field_type[i] in (1, 2) else "Y Angle (deg)"
+    headers = [axis, "Tan Shift", "Sag Shift", "Real Height", "Ref. Height", "Distortion"]
+    return [Table(headers, f"{w:.6f} µm.", np.column_stack([fields[i], data[i, j]]), None)
+            for j, w in enumerate(system.wavelengths)]
+
+
+def write_tables(system, output_root=OUTPUT_ROOT, fields=None, pupil=PUPIL):
+    """
+    Trace both analyses for every supported lens and write them as
+    <output_root>/<Analysis>/<lens>_<Analysis>.csv. Returns the number of lenses written.
+    """
+    pupil, aberration, _ = longitudinal(system, pupil)
+    fields, data, _ = field_curvature(system, fields)
+    for name in ("Longitudinal", "FieldCurvature"):
+        os.makedirs(os.path.join(output_root, name), exist_ok=True)
+
+    written = 0
+    for i, lens_id in enumerate(system.lens_ids):
+        if not system.supported[i]:
+            continue
+        write_csv(os.path.join(output_root, "Longitudinal", f"{lens_id}_Longitudinal.csv"),
+                  longitudinal_tables(system, pupil, aberration, i))
+        write_csv(os.path.join(output_root, "FieldCurvature", f"{lens_id}_FieldCurvature.csv"),
+                  field_curvature_tables(system, fields, data, i))
+        written += 1
+    return written
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    catalog, _ = paraxial.scan_zmx(paraxial.LENS_DIR)
+    prescriptions, stops = paraxial.read_zmx_prescriptions(paraxial.LENS_DIR)
+    # One system per WAVM list, so every lens is traced and labelled at its own wavelengths
+    systems = build_systems(prescriptions, catalog=catalog, stops=stops)
+    loaded = time.perf_counter()
+
+    count = 0
+    for system in systems:
+        count += longitudinal(system)[2] + field_curvature(system)[2]
+    traced = time.perf_counter()
+    print(f"✅ {count:,} ray-surface intersections in {traced - loaded:.2f} s "
+          f"({count / (traced - loaded):,.0f} per second, aiming included)")
+
+    written = sum(write_tables(system, OUTPUT_ROOT) for system in systems)
+    print(f"✅ Wrote Longitudinal and FieldCurvature tables for {written} of {len(prescriptions)} lenses "
+          f"to {OUTPUT_ROOT} ({time.perf_counter() - start:.2f} s total)")
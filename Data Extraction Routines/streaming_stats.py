@@ -0,0 +1,171 @@
+'''
+Single-pass, mergeable column statistics.
+
+An accumulator is a plain dict updated chunk by chunk with update() and
+combined across worker processes with merge(); its size never depends on
+how many values went through it:
+
+  total, nan, posinf, neginf,         value counts
+  finite, zero
+  mean, m2                             Welford / Chan running mean and sum of
+                                       squared deviations (finite values)
+  min, max                             over finite values
+  hist                                 HIST_BINS fixed bins over
+                                       asinh(x / HIST_SCALE), so one layout
+                                       covers A16 coefficients and 1e10 radii
+                                       alike and histograms add across workers
+                                       (exact zeros, common for conics and
+                                       unused coefficients, are kept apart)
+
+quantile() reads approximate quantiles off the histogram (a few per cent
+relative error at the default resolution) and summary() turns an
+accumulator into the row lens_surface_distributions.py writes.
+'''
+
+import math
+
+import numpy as np
+
+# ---------------- Settings ----------------
+HIST_BINS = 4096              # fixed histogram bins (plus one underflow and one overflow bin)
+HIST_SCALE = 1e-30            # asinh(x / HIST_SCALE) is ~linear below this, ~log above
+HIST_LIMIT = 100.0            # transformed range covered: |x| up to ~HIST_SCALE * e**HIST_LIMIT
+QUANTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+
+EDGES = np.linspace(-HIST_LIMIT, HIST_LIMIT, HIST_BINS + 1)
+
+# ---------------- Accumulators ----------------
+def new_stats():
+    """An empty accumulator."""
+    return {"total": 0, "nan": 0, "posinf": 0, "neginf": 0, "non_numeric": 0, "finite": 0, "zero": 0,
+            "mean": 0.0, "m2": 0.0, "min": math.inf, "max": -math.inf,
+            "hist": np.zeros(HIST_BINS + 2, dtype=np.int64)}
+
+
+def transform(values):
+    """Histogram coordinate of finite values."""
+    return np.arcsinh(values / HIST_SCALE)
+
+
+def update(stats, values, non_numeric=0):
+    """
+    Add one chunk of float values (NaN / ±Inf allowed) to stats in place.
+    non_numeric counts entries of the chunk that were present but not numbers.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    finite = values[np.isfinite(values)]
+    stats["total"] += values.size
+    stats["nan"] += int(np.isnan(values).sum())
+    stats["posinf"] += int(np.isposinf(values).sum())
+    stats["neginf"] += int(np.isneginf(values).sum())
+    stats["non_numeric"] += int(non_numeric)
+    if finite.size:
+        chunk = {"finite": finite.size, "mean": float(finite.mean()),
+                 "m2": float(((finite - finite.mean()) ** 2).sum())}
+        combine_moments(stats, chunk)
+        stats["min"] = min(stats["min"], float(finite.min()))
+        stats["max"] = max(stats["max"], float(finite.max()))
+        nonzero = finite[finite != 0]
+        stats["zero"] += finite.size - nonzero.size
+        # Bin 0 / HIST_BINS + 1 catch values past the transformed range
+        bins = np.searchsorted(EDGES, transform(nonzero), side="right")
+        stats["hist"] += np.bincount(bins, minlength=HIST_BINS + 2)[:HIST_BINS + 2]
+    return stats
+
+
+def combine_moments(stats, other):
+    """Chan et al. pairwise update of (finite, mean, m2) in place."""
+    n_a, n_b = stats["finite"], other["finite"]
+    if not n_b:
+        return
+    n = n_a + n_b
+    delta = other["mean"] - stats["mean"]
+    stats["mean"] += delta * n_b / n
+    stats["m2"] += other["m2"] + delta * delta * n_a * n_b / n
+    stats["finite"] = n
+
+
+def merge(a, b):
+    """A new accumulator holding everything a and b saw (either may come from another process)."""
+    merged = {key: (value.copy() if isinstance(value, np.ndarray) else value) for key, value in a.items()}
+    for key in ("total", "nan", "posinf", "neginf", "non_numeric", "zero"):
+        merged[key] += b[key]
+    combine_moments(merged, b)
+    merged["min"] = min(a["min"], b["min"])
+    merged["max"] = max(a["max"], b["max"])
+    merged["hist"] = a["hist"] + b["hist"]
+    return merged
+
+
+def pad_missing(stats, n):
+    """Count n more entries as NaN (rows of files that lack the column)."""
+    stats["total"] += n
+    stats["nan"] += n
+    return stats
+
+# ---------------- Results ----------------
+def variance(stats, ddof=1):
+    """Variance of the finite values (sample variance by default, like pandas)."""
+    n = stats["finite"]
+    return stats["m2"] / (n - ddof) if n > ddof else math.nan
+
+
+def quantile(stats, q):
+    """Approximate q-quantile of the finite values, interpolated inside its histogram bin."""
+    n = stats["finite"]
+    if not n:
+        return math.nan
+    cumulative = np.cumsum(stats["hist"])
+    target = q * n
+    # Exact zeros sit between the negative and the positive bins
+    negative = cumulative[HIST_BINS // 2]
+    if target > negative:
+        if target <= negative + stats["zero"]:
+            return 0.0
+        target -= stats["zero"]
+    b = int(np.searchsorted(cumulative, target, side="left"))
+    if b == 0:
+        return stats["min"]
+    if b > HIST_BINS:
+        return stats["max"]
+    below = cumulative[b - 1]
+    fraction = (target - below) / stats["hist"][b] if stats["hist"][b] else 0.0
+    t = EDGES[b - 1] + fraction * (EDGES[b] - EDGES[b - 1])
+    return float(np.clip(math.sinh(t) * HIST_SCALE, stats["min"], stats["max"]))
+
+
+def bin_centres(stats):
+    """(value at each histogram bin centre, count) for the non-empty in-range bins and zeros, e.g. to plot."""
+    counts = np.append(stats["hist"][1:HIST_BINS + 1], stats["zero"])
+    centres = np.append(np.sinh(0.5 * (EDGES[:-1] + EDGES[1:])) * HIST_SCALE, 0.0)
+    keep = counts > 0
+    return np.clip(centres[keep], stats["min"], stats["max"]), counts[keep]
+
+
+def summary(stats, column):
+    """Summary row for one column (the numeric_column_summary.csv layout plus quantiles)."""
+    total, finite = stats["total"], stats["finite"]
+
+    def fraction(count):
+        return count / total if total else math.nan
+
+    row = {
+        "column": column,
+        "total_entries": int(total),
+        "finite_count": int(finite),
+        "nan_count": int(stats["nan"]),
+        "posinf_count": int(stats["posinf"]),
+        "neginf_count": int(stats["neginf"]),
+        "non_numeric_original_count": int(max(stats["non_numeric"], 0)),
+        "finite_fraction": fraction(finite),
+        "nan_fraction": fraction(stats["nan"]),
+        "posinf_fraction": fraction(stats["posinf"]),
+        "neginf_fraction": fraction(stats["neginf"]),
+        "mean_over_finite": stats["mean"] if finite else math.nan,
+        "std_over_finite": math.sqrt(variance(stats)) if finite > 1 else math.nan,
+        "min_over_finite": stats["min"] if finite else math.nan,
+        "max_over_finite": stats["max"] if finite else math.nan,
+    }
+    for q in QUANTILES:
+        row[f"p{round(q * 100):02d}_over_finite"] = quantile(stats, q)
+    return row
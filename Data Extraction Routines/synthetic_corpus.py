@@ -0,0 +1,245 @@
+'''
+Synthetic lens corpus generator.
+
+Writes an AnalysisExports tree and a LensDataExports folder that look like
+the real OpticStudio / MATLAB output, at any multiple of the current corpus
+size (scale 1 = 1019 lenses):
+
+  AnalysisExports/<lens>/<lens>_<Analysis>.txt
+      same preamble, "Table series:" titles, 16-char right-aligned columns,
+      8 significant digits and "-1.3840295E-004" style E-notation as the
+      exports; a share of the files is written as UTF-16 and a share is
+      left empty like the failed exports in the real tree
+  LensDataExports/<lens>_LensData.csv
+      the Surface..A16 schema written by BatchExportLensData.m
+
+A fixed pool of template lenses is generated once and then written under
+new lens ids, so a 100x corpus costs file I/O rather than number formatting.
+'''
+
+import os
+import math
+import time
+
+import numpy as np
+
+from zmx_reader import COLUMNS, format_value
+
+# ---------------- Settings ----------------
+BASE_LENSES = 1019            # lenses in the real corpus (scale 1)
+TEMPLATES = 500               # distinct lenses generated before reuse
+UTF16_FRACTION = 0.25         # share of exports written as UTF-16
+EMPTY_FRACTION = 0.11         # share of exports left empty (failed exports)
+WAVELENGTHS = [0.486133, 0.587562, 0.656273]
+ANALYSES = ["FieldCurvature", "Longitudinal", "RMSvField", "Vignetting"]
+
+# ---------------- OpticStudio Number Format ----------------
+def zos_number(value):
+    """Format a value like the text exports: 8 significant digits, E-notation below 1e-2."""
+    if value == 0:
+        return "0.00000000"
+    magnitude = abs(value)
+    if magnitude < 1e-2 or magnitude >= 1e8:
+        mantissa, exponent = f"{value:.7E}".split("E")
+        return f"{mantissa}E{exponent[0]}{int(exponent[1:]):03d}"
+    decimals = max(0, 7 - math.floor(math.log10(magnitude)))
+    return f"{value:.{decimals}f}"
+
+
+def zos_row(values):
+    """One table row: every value right-aligned in a 16-character column."""
+    return "".join(f"{zos_number(v):>16}" for v in values)
+
+
+def zos_table(title, headers, block):
+    """A complete 'Table series:' block, including the trailing blank line."""
+    lines = [f"Table series: {title}",
+             "".join(f"{h:>16}" for h in headers),
+             "  --------------" * len(headers)]
+    lines.extend(zos_row(row) for row in block.tolist())
+    return "\n".join(lines) + "\n\n"
+
+
+def preamble(results_for, lens_id, extra_lines, n_tables):
+    """
+    File header written above the tables (lens id goes into the File/Title
+    lines). An empty results_for (FieldCurvature) is followed straight by the
+    File line, as in the real exports; a title is followed by two blank lines.
+    """
+    lines = [f"Results for:\t{results_for}"]
+    if results_for:
+        lines += ["", ""]
+    lines += [f"File:\tC:\\Lenses\\{lens_id}.zmx",
+              f"Title:\t{lens_id}",
+              "Date:\t11/7/2025 5:21:20 PM",
+              "",
+              "0 message(s) in output."]
+    lines.extend(extra_lines)
+    lines.append(f"{n_tables} series table(s) in output.")
+    return "\n".join(lines) + "\n\n"
+
+# ---------------- Curve Models ----------------
+def field_curvature(rng, half_field):
+    y = np.linspace(0.0, half_field, 101)
+    focal = 0.4 * rng.standard_normal()
+    tables = []
+    for k, wavelength in enumerate(WAVELENGTHS):
+        shift = focal + 0.1 * (k - 1)
+        tan = shift - 1e-3 * rng.uniform(1, 5) * y ** 2
+        sag = shift - 5e-4 * rng.uniform(1, 5) * y ** 2
+        ref = 50.0 * np.tan(np.radians(y))
+        distortion = -1e-3 * rng.uniform(0.5, 5) * y ** 2
+        real = ref * (1 + distortion / 100)
+        block = np.column_stack([y, tan, sag, real, ref, distortion])
+        tables.append((f"Data for wavelength : {wavelength:.6f} µm.",
+                       ["Y Angle (deg)", "Tan Shift", "Sag Shift", "Real Height", "Ref. Height", "Distortion"],
+                       block))
+    return "", [], tables
+
+
+def longitudinal(rng, half_field):
+    pupil = np.linspace(0.0, 1.0, 101)
+    spherical = rng.uniform(-0.5, 0.5)
+    columns = [pupil] + [spherical * pupil ** 2 + 0.1 * (k - 1) for k in range(len(WAVELENGTHS))]
+    headers = ["Rel. Pupil"] + [f"{w:.4f}" for w in WAVELENGTHS]
+    return "Listing of Longitudinal Aberration Data", [], [("Units are Millimeters.", headers, np.column_stack(columns))]
+
+
+def rms_v_field(rng, half_field):
+    field = np.linspace(0.0, 21.6, 16)
+    base = rng.uniform(0.05, 0.5)
+    per_wave = [base + rng.uniform(0.01, 0.1) * (field / 21.6) ** 2 * (k + 1) for k in range(len(WAVELENGTHS))]
+    columns = [field, np.mean(per_wave, axis=0)] + per_wave
+    headers = ["Field", "Poly"] + [f"{w:.4f}" for w in WAVELENGTHS]
+    extra = ["RMS units are in waves.", "Reference: Centroid.", "Field units are in Millimeters."]
+    return "RMS Wave Error vs. Field", extra, [("Field is oriented along the +y direction.", headers,
+                                                np.column_stack(columns))]
+
+
+def vignetting(rng, half_field):
+    field = np.linspace(0.0, 21.6, 21)
+    falloff = rng.uniform(0.1, 0.7)
+    illumination = 1.0 - falloff * (field / 21.6) ** 2
+    fnum = rng.uniform(1.4, 8.0) / np.sqrt(illumination)
+    extra = ["Wavelength: 0.587562 µm", "Field values are in Millimeters",
+             "Relative Illumination values are dimensionless."]
+    return "Relative Illumination Data", extra, [("See program documentation for a discussion of Effective F/#.",
+                                                  ["Y Field", "Rel. Ill", "Effective F/#"],
+                                                  np.column_stack([field, illumination, fnum]))]
+
+
+CURVES = {
+    "FieldCurvature": field_curvature,
+    "Longitudinal": longitudinal,
+    "RMSvField": rms_v_field,
+    "Vignetting": vignetting,
+}
+
+
+def lens_rows(rng):
+    """Random but plausible LensDataExports rows for one lens."""
+    n_surfaces = int(rng.integers(6, 24))
+    rows = [{"Surface": 0, "TypeName": "Standard", "Comment": "", "Radius": math.inf, "Thickness": math.inf,
+             "Material": "", "SemiDiameter": math.inf, "Conic": 0.0}]
+    for s in range(1, n_surfaces - 1):
+        asphere = rng.random() < 0.2
+        row = {
+            "Surface": s,
+            "TypeName": "Even Asphere" if asphere else "Standard",
+            "Comment": "",
+            "Radius": math.inf if rng.random() < 0.1 else float(rng.choice([-1, 1]) * rng.uniform(10, 300)),
+            "Thickness": float(rng.uniform(0.5, 15)),
+            "Material": str(rng.choice(["", "N-BK7", "N-SF6", "N-LAK9", "1.62,60.3"])),
+            "SemiDiameter": float(rng.uniform(5, 30)),
+            "Conic": float(rng.uniform(-2, 0)) if asphere else 0.0,
+        }
+        for order in range(2, 18, 2):
+            row[f"A{order}"] = float(rng.normal(0, 10.0 ** (-order - 2))) if asphere else math.nan
+        rows.append(row)
+    rows.append({"Surface": n_surfaces - 1, "TypeName": "Standard", "Comment": "", "Radius": math.inf,
+                 "Thickness": math.inf, "Material": "", "SemiDiameter": float(rng.uniform(15, 25)), "Conic": 0.0})
+    for row in (rows[0], rows[-1]):
+        row.update({f"A{order}": math.nan for order in range(2, 18, 2)})
+    return rows
+
+
+def template_lens(rng):
+    """One template: {analysis: (results_for, extra lines, tables)} plus the lens data CSV body."""
+    half_field = rng.uniform(5, 40)
+    exports = {name: CURVES[name](rng, half_field) for name in ANALYSES}
+    rendered = {}
+    for name, (results_for, extra, tables) in exports.items():
+        body = "".join(zos_table(title, headers, block) for title, headers, block in tables)
+        rendered[name] = (results_for, extra, len(tables), body,
+                          sum(block.shape[0] for _, _, block in tables))
+    csv_rows = lens_rows(rng)
+    csv_body = "".join(",".join(format_value(row[c]) for c in COLUMNS) + "\n" for row in csv_rows)
+    return rendered, csv_body, len(csv_rows)
+
+# ---------------- Corpus Writer ----------------
+def generate_corpus(out_dir, scale=1.0, seed=0, templates=TEMPLATES, verbose=False):
+    """
+    Write a synthetic corpus of round(scale * BASE_LENSES) lenses under out_dir.
+
+    Returns a dict of what was written: paths, lens count, export files
+    (non-empty / empty / UTF-16), table rows per analysis and lens data rows.
+    """
+    rng = np.random.default_rng(seed)
+    n_lenses = max(1, round(scale * BASE_LENSES))
+    pool = [template_lens(rng) for _ in range(min(templates, n_lenses))]
+
+    exports_dir = os.path.join(out_dir, "AnalysisExports")
+    lens_data_dir = os.path.join(out_dir, "LensDataExports")
+    os.makedirs(exports_dir, exist_ok=True)
+    os.makedirs(lens_data_dir, exist_ok=True)
+
+    stats = {
+        "root_dir": exports_dir,
+        "lens_data_dir": lens_data_dir,
+        "lenses": n_lenses,
+        "export_files": 0,
+        "empty_files": 0,
+        "utf16_files": 0,
+        "rows": {name: 0 for name in ANALYSES},
+        "lens_data_rows": 0,
+    }
+    header_line = ",".join(COLUMNS) + "\n"
+
+    start = time.perf_counter()
+    for i in range(n_lenses):
+        lens_id = f"SYN{i:06d}_Example01P"
+        rendered, csv_body, n_surfaces = pool[i % len(pool)]
+        lens_dir = os.path.join(exports_dir, lens_id)
+        os.makedirs(lens_dir, exist_ok=True)
+
+        for name, (results_for, extra, n_tables, body, n_rows) in rendered.items():
+            path = os.path.join(lens_dir, f"{lens_id}_{name}.txt")
+            stats["export_files"] += 1
+            if rng.random() < EMPTY_FRACTION:
+                open(path, "wb").close()
+                stats["empty_files"] += 1
+                continue
+            encoding = "utf-8"
+            if rng.random() < UTF16_FRACTION:
+                encoding = "utf-16"
+                stats["utf16_files"] += 1
+            with open(path, "w", encoding=encoding, newline="\n") as f:
+                f.write(preamble(results_for, lens_id, extra, n_tables) + body)
+            stats["rows"][name] += n_rows
+
+        with open(os.path.join(lens_data_dir, f"{lens_id}_LensData.csv"), "w", encoding="utf-8", newline="") as f:
+            f.write(header_line + csv_body)
+        stats["lens_data_rows"] += n_surfaces
+
+        if verbose and (i + 1) % 1000 == 0:
+            print(f"  {i + 1}/{n_lenses} lenses written ({time.perf_counter() - start:.1f} s)")
+
+    return stats
+
+
+if __name__ == "__main__":
+    OUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_corpus")
+    SCALE = 1
+
+    stats = generate_corpus(OUT_DIR, SCALE, verbose=True)
+    print(f"✅ Wrote {stats['lenses']} synthetic lenses ({stats['export_files']} exports) to {OUT_DIR}")
@@ -0,0 +1,681 @@
+'''
+Synthetic prescriptions sampled from a model fitted to the real corpus.
+
+synthetic_corpus.py writes benchmark trees from hand-picked uniform ranges;
+this module fits the LensDataExports prescriptions themselves and samples
+new lenses that follow them, in vectorised batches of BATCH_LENSES:
+
+  surface count      the donor's (below)
+  medium             air / glass / other (MIRROR, "-") after each interior
+                     surface, a Markov chain along the surface sequence with
+                     one transition matrix per position bin
+  curvature, thickness, semi-diameter
+                     a Gaussian copula: each column has its own empirical
+                     quantiles per (medium, position bin), and the normal
+                     scores of surface s depend on those of surface s - 1
+                     through a lag-1 regression fitted per position bin, so
+                     element thicknesses, air gaps and the semi-diameter
+                     envelope run along the lens like the real ones
+  type, conic, A2..A16
+                     drawn together from the observed surfaces of the same
+                     (medium, position bin), so aspheres keep real
+                     coefficient sets
+  glass              each lens takes a donor: a real lens whose glasses
+                     all resolve (materials.py) and whose first order is
+                     finite; it has the donor's surface count and its
+                     glass surfaces draw from the donor's glass names
+
+Position bins split the interior surfaces front to rear into POSITION_BINS
+bins; the last interior surface (whose thickness is the image distance) has
+a bin of its own. Object and image rows are drawn whole from the observed
+ones. Groups with fewer than MIN_GROUP surfaces fall back to the medium
+pooled over all positions.
+
+The model is fitted on the donor lenses scaled to unit EFL. A sampled lens
+is then made a working optic at its donor's first order: it is traced
+paraxially at the primary wavelength, scaled from its own EFL (which must
+be within EFL_WINDOW of 1) to the donor's, its last thickness is solved
+for the paraxial image, and its interior semi-diameters are scaled so its
+F/# (EFL over the EPD of the stop it traces to) is the donor's. Lenses
+outside the window, with a virtual image, without an aperture stop, with
+a surface wider than its radius or with a glass element of negative edge
+thickness (edge_thickness) are drawn again from the same donor.
+
+Batches come out as prescription_store.PackedCorpus tuples: they can be
+saved as store shards (millions of lenses stay a few .npz files) or written
+out in the LensDataExports CSV schema.
+'''
+
+import os
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import paraxial
+import prescription_store
+import streaming_stats
+from materials import SAME_MEDIUM, material_codes, index_table
+from zmx_reader import EVEN_ORDERS, write_lens_csv
+
+# ---------------- Settings ----------------
+POSITION_BINS = 8             # front-to-rear bins of the interior surfaces (plus one for the last)
+GRID_POINTS = 129             # normal-score knots of each quantile table
+GRID_LIMIT = 4.0              # knots cover normal scores -GRID_LIMIT..GRID_LIMIT
+MIN_GROUP = 30                # surfaces a (medium, bin) group needs before it gets its own tables
+BATCH_LENSES = 25_000         # lenses sampled per batch
+EFL_WINDOW = 3.0              # sampled unit-EFL lenses must trace to an EFL within this factor of 1
+TRACK_WINDOW = 2.0            # ... and have a length (first to last surface) within this factor of the donor's
+REDRAW_ROUNDS = 50            # rejection rounds before an unfilled lens slot draws a new donor
+SEED = 0
+LENS_PREFIX = "SYNP"
+
+STATES = ["air", "glass", "other"]
+CONTINUOUS = ["curvature", "thickness", "semi_diameter"]
+
+STORE_DIR = os.path.join(paraxial.DATA_DIR, "LensStore", "synthetic")
+LENS_DATA_DIR = os.path.join(paraxial.DATA_DIR, "SyntheticLensData")
+
+GRID = np.linspace(-GRID_LIMIT, GRID_LIMIT, GRID_POINTS)
+LEVELS = np.array([0.5 * (1.0 + math.erf(g / math.sqrt(2.0))) for g in GRID])
+
+# Fitted model. Groups are indexed state * (POSITION_BINS + 1) + bin; pools are
+# CSR over the observed surfaces (pool_start / pool_size per group, after fallback)
+SurfaceModel = namedtuple("SurfaceModel", [
+    "counts",                 # (lenses,) observed surface counts
+    "initial",                # (states,) medium after surface 1
+    "transitions",            # (bins, states, states) medium of s given s - 1
+    "knots",                  # (states, bins, continuous, GRID_POINTS) quantile tables
+    "start_chol",             # (continuous, continuous) normal scores of surface 1
+    "coupling",               # (bins, continuous, continuous) E[u_s | u_(s-1)] = coupling @ u_(s-1)
+    "noise_chol",             # (bins, continuous, continuous) Cholesky factor of the residual
+    "pool_start", "pool_size",
+    "pool_type", "pool_material", "pool_conic", "pool_asphere",
+    "object_rows", "image_rows",  # (n, 3 + 1 + 8) radius, thickness, semi-diameter, conic, A2..A16 of observed rows
+    "object_codes", "image_codes",  # (n, 2) type and material codes of those rows
+    "type_names", "material_names",
+    "medium_code",            # (material names,) paraxial material code of every name
+    "medium_index",           # (material ids, 1) index at the primary wavelength
+    "donor_start", "donor_size", "donor_material",  # CSR glass names of every donor lens
+    "donor_efl", "donor_fnum",  # (donors,) first order of the donor lenses
+    "donor_track",            # (donors,) first-to-last surface length of the donor lenses at unit EFL
+])
+
+# ---------------- Fitting ----------------
+def medium_state(material_names):
+    """State index of every material name (air, glass, or other)."""
+    names = np.char.upper(np.char.strip(material_names.astype(str)))
+    return np.where(names == "", 0, np.where((names == "MIRROR") | (names == "-"), 2, 1))
+
+
+def position_bins(surface, n_interior):
+    """Position bin of interior surface `surface` (1-based) of lenses with n_interior interior surfaces."""
+    position = (surface - 1) / np.maximum(n_interior - 1, 1)
+    bins = np.minimum((position * POSITION_BINS).astype(np.int64), POSITION_BINS - 1)
+    return np.where(surface == n_interior, POSITION_BINS, bins)
+
+
+def normal_scores(values):
+    """Normal scores of values from their mid-ranks (ties share one score)."""
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    upper = np.cumsum(counts)
+    level = (upper - 0.5 * counts)[inverse] / values.size
+    return np.interp(level, LEVELS, GRID)
+
+
+def conditional(pairs):
+    """(coupling, residual Cholesky factor) of the second half of pairs given the first."""
+    k = pairs.shape[1] // 2
+    cov = np.cov(pairs, rowvar=False)
+    a, b, c = cov[:k, :k], cov[k:, :k], cov[k:, k:]
+    coupling = b @ np.linalg.pinv(a)
+    residual = c - coupling @ b.T
+    return coupling, cholesky(residual)
+
+
+def cholesky(cov):
+    """Cholesky factor of a covariance, with negative eigenvalues (from sampling noise) clipped."""
+    values, vectors = np.linalg.eigh(0.5 * (cov + cov.T))
+    return np.linalg.cholesky((vectors * np.maximum(values, 1e-9)) @ vectors.T)
+
+
+def medium_tables(material_names, catalog=None):
+    """(paraxial material code of every name, (material ids, 1) index at the primary wavelength)."""
+    codes, materials = material_codes({"": {"material": list(material_names)}}, catalog)
+    return (np.array(codes[""], dtype=np.int64),
+            index_table(materials, [paraxial.WAVELENGTHS[paraxial.PRIMARY]]))
+
+
+def donor_lenses(corpus, medium_code, medium_index, catalog=None):
+    """
+    (positions, EFL, F/#) of the lenses that can donate glasses and a first
+    order: at least one glass, every glass resolved, positive EFL and F/#.
+    """
+    counts = np.diff(corpus.offsets)
+    lens = np.repeat(np.arange(counts.size), counts)
+    glass = medium_state(corpus.material_names)[corpus.material_code] == 1
+    resolved = np.isfinite(medium_index[medium_code[corpus.material_code], 0])
+    unresolved = np.bincount(lens[glass & ~resolved], minlength=counts.size)
+    has_glass = np.bincount(lens[glass], minlength=counts.size) > 0
+    real = corpus_first_order(corpus, catalog)
+    efl, fnum = real["efl"], real["fnum"]
+    with np.errstate(invalid="ignore"):
+        donors = np.flatnonzero((unresolved == 0) & has_glass & (counts >= 3) & (efl > 0) & (fnum > 0))
+    return donors, efl[donors], fnum[donors]
+
+
+def select_lenses(corpus, positions):
+    """The lenses of a PackedCorpus at the given positions, as a PackedCorpus."""
+    counts = np.diff(corpus.offsets)[positions]
+    offsets = np.zeros(counts.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    rows = np.concatenate([np.arange(corpus.offsets[i], corpus.offsets[i + 1]) for i in positions])
+    return prescription_store.PackedCorpus(
+        corpus.lens_ids[positions], offsets, corpus.radius[rows], corpus.thickness[rows],
+        corpus.semi_diameter[rows], corpus.conic[rows], corpus.asphere[rows], corpus.type_code[rows],
+        corpus.type_names, corpus.material_code[rows], corpus.material_names)
+
+
+def is_type(type_names, type_code, name):
+    """Mask of the surfaces of one type."""
+    names = list(type_names)
+    return type_code == names.index(name) if name in names else np.zeros(np.shape(type_code), dtype=bool)
+
+
+def scale_lengths(table, asphere, thin, scale):
+    """
+    Scale a lens by scale (broadcast against the radius column): radius,
+    thickness and semi-diameter scale linearly, A2..A16 as scale^(1 - order)
+    and the focal length (A2) of a Paraxial surface linearly. Returns new
+    (table, asphere).
+    """
+    scaled = {key: values * scale if key in ("radius", "thickness", "semi_diameter") else values
+              for key, values in table.items()}
+    coefficients = asphere * np.asarray(scale)[..., None] ** (1.0 - np.array(EVEN_ORDERS))
+    coefficients[..., 0] = np.where(thin, asphere[..., 0] * scale, coefficients[..., 0])
+    return scaled, coefficients
+
+
+def sag(radius, conic, asphere, even, h):
+    """
+    Sag at height h of surfaces: the conic term, plus A2..A16 on Even Asphere
+    surfaces. NaN where h is past the edge of the conic.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = np.where(np.isfinite(radius) & (radius != 0), 1.0 / radius, 0.0)
+        k = np.where(np.isfinite(conic), conic, 0.0)
+        z = c * h ** 2 / (1.0 + np.sqrt(1.0 - (1.0 + k) * c ** 2 * h ** 2))
+    # Polynomial terms on the (few) Even Asphere surfaces only
+    coefficients = asphere[even]
+    z[even] += (np.where(np.isfinite(coefficients), coefficients, 0.0)
+                * h[even][:, None] ** np.array(EVEN_ORDERS)).sum(axis=1)
+    return z
+
+
+def edge_thickness(radius, thickness, semi_diameter, conic, asphere, even):
+    """
+    Edge thickness of the gap after every surface but the last along the
+    last axis: the thickness plus the rim sag of the next surface minus
+    that of this one, each at its own semi-diameter (the narrower surface
+    is taken to run on flat to the wider one's rim).
+    """
+    rim = sag(radius, conic, asphere, even, semi_diameter)
+    return thickness[..., :-1] + rim[..., 1:] - rim[..., :-1]
+
+
+def scale_corpus(corpus, scale):
+    """A PackedCorpus with every lens scaled by its entry of scale, (lenses,)."""
+    rows_scale = np.repeat(scale, np.diff(corpus.offsets))
+    thin = is_type(corpus.type_names, corpus.type_code, "Paraxial")
+    table, asphere = scale_lengths({"radius": corpus.radius, "thickness": corpus.thickness,
+                                    "semi_diameter": corpus.semi_diameter}, corpus.asphere, thin, rows_scale)
+    return corpus._replace(radius=table["radius"], thickness=table["thickness"],
+                           semi_diameter=table["semi_diameter"], asphere=asphere)
+
+
+def fit_model(corpus, catalog=None):
+    """
+    Fit a SurfaceModel to the donor lenses of a PackedCorpus, scaled to unit
+    EFL so the surface tables describe shapes rather than sizes. catalog
+    ({glass name: (nd, Vd)}, paraxial.scan_zmx) resolves the catalog glass
+    names.
+    """
+    medium_code, medium_index = medium_tables(corpus.material_names, catalog)
+    donors, efl, fnum = donor_lenses(corpus, medium_code, medium_index, catalog)
+    corpus = scale_corpus(select_lenses(corpus, donors), 1.0 / efl)
+
+    n_groups = POSITION_BINS + 1
+    counts = np.diff(corpus.offsets)
+    keep = counts >= 3
+    starts, counts = corpus.offsets[:-1][keep], counts[keep]
+    n_interior = counts - 2
+
+    # Interior surfaces, lens-major, with their lens and position
+    lens = np.repeat(np.arange(counts.size), n_interior)
+    surface = np.arange(lens.size) - np.repeat(np.cumsum(n_interior) - n_interior, n_interior) + 1
+    rows = starts[lens] + surface
+    state = medium_state(corpus.material_names)[corpus.material_code[rows]]
+    bins = position_bins(surface, n_interior[lens])
+    group = state * n_groups + bins
+
+    radius = corpus.radius[rows]
+    with np.errstate(divide="ignore"):
+        curvature = np.where(np.isfinite(radius) & (radius != 0), 1.0 / radius, 0.0)
+    values = np.column_stack([curvature, corpus.thickness[rows], corpus.semi_diameter[rows]])
+    values = np.where(np.isfinite(values), values, 0.0)
+
+    # Quantile tables per (state, bin), falling back to the state over all bins, then to everything
+    knots = np.empty((len(STATES), n_groups, len(CONTINUOUS), GRID_POINTS))
+    scores = np.empty_like(values)
+    for s in range(len(STATES)):
+        in_state = state == s
+        pooled = values[in_state] if in_state.sum() >= MIN_GROUP else values
+        for b in range(n_groups):
+            members = group == s * n_groups + b
+            source = values[members] if members.sum() >= MIN_GROUP else pooled
+            for c in range(len(CONTINUOUS)):
+                knots[s, b, c] = np.quantile(source[:, c], LEVELS)
+                if members.any():
+                    scores[members, c] = normal_scores(values[members, c])
+
+    # Medium chain and lag-1 copula along the sequence
+    first = surface == 1
+    initial = np.bincount(state[first], minlength=len(STATES)) / first.sum()
+    following = ~first
+    previous_state, previous_scores = state[np.flatnonzero(following) - 1], scores[np.flatnonzero(following) - 1]
+    pairs = np.column_stack([previous_scores, scores[following]])
+    all_counts = np.zeros((len(STATES), len(STATES)))
+    np.add.at(all_counts, (previous_state, state[following]), 1)
+    transitions = np.empty((n_groups, len(STATES), len(STATES)))
+    coupling = np.empty((n_groups, len(CONTINUOUS), len(CONTINUOUS)))
+    noise_chol = np.empty_like(coupling)
+    pooled_coupling, pooled_noise = conditional(pairs)
+    for b in range(n_groups):
+        in_bin = bins[following] == b
+        counts_b = np.zeros((len(STATES), len(STATES)))
+        np.add.at(counts_b, (previous_state[in_bin], state[following][in_bin]), 1)
+        for s in range(len(STATES)):
+            row = counts_b[s] if counts_b[s].sum() else all_counts[s] if all_counts[s].sum() else initial
+            transitions[b, s] = row / row.sum()
+        if in_bin.sum() >= MIN_GROUP:
+            coupling[b], noise_chol[b] = conditional(pairs[in_bin])
+        else:
+            coupling[b], noise_chol[b] = pooled_coupling, pooled_noise
+
+    # Discrete pools: surfaces sorted by group, each group pointing at its own rows or its state's
+    order = np.argsort(group, kind="stable")
+    group_counts = np.bincount(group, minlength=len(STATES) * n_groups)
+    group_start = np.cumsum(group_counts) - group_counts
+    pool_start, pool_size = group_start.copy(), group_counts.copy()
+    for s in range(len(STATES)):
+        state_groups = slice(s * n_groups, (s + 1) * n_groups)
+        for g in range(s * n_groups, (s + 1) * n_groups):
+            if group_counts[g] < MIN_GROUP:
+                # The state's groups are contiguous in the sorted pool
+                pool_start[g] = group_start[state_groups][0]
+                pool_size[g] = group_counts[state_groups].sum()
+    pool_start[pool_size == 0], pool_size[pool_size == 0] = 0, group.size
+    pool_rows = rows[order]
+
+    def whole_rows(index):
+        return np.column_stack([corpus.radius[index], corpus.thickness[index], corpus.semi_diameter[index],
+                                corpus.conic[index], corpus.asphere[index]])
+
+    # The glass names of every donor
+    glass_rows, glass_lens = rows[state == 1], lens[state == 1]
+    donor_material = [np.unique(corpus.material_code[glass_rows[glass_lens == d]]) for d in range(counts.size)]
+    donor_size = np.array([m.size for m in donor_material], dtype=np.int64)
+
+    # Donor lengths: every interior thickness but the last (the image distance)
+    inside = surface < n_interior[lens]
+    track = np.bincount(lens[inside], weights=values[inside, 1], minlength=counts.size)
+
+    object_index, image_index = starts, starts + counts - 1
+    return SurfaceModel(
+        counts, initial, transitions, knots, cholesky(np.cov(scores[first], rowvar=False)), coupling, noise_chol,
+        pool_start, pool_size, corpus.type_code[pool_rows], corpus.material_code[pool_rows],
+        corpus.conic[pool_rows], corpus.asphere[pool_rows],
+        whole_rows(object_index), whole_rows(image_index),
+        np.column_stack([corpus.type_code[object_index], corpus.material_code[object_index]]),
+        np.column_stack([corpus.type_code[image_index], corpus.material_code[image_index]]),
+        corpus.type_names, corpus.material_names,
+        medium_code, medium_index, np.cumsum(donor_size) - donor_size, donor_size,
+        np.concatenate(donor_material), efl[keep], fnum[keep], track)
+
+# ---------------- First Order ----------------
+def corpus_first_order(corpus, catalog=None):
+    """paraxial.first_order() of every lens of a PackedCorpus, in corpus order."""
+    return paraxial.first_order(prescription_store.prescriptions(corpus), catalog=catalog)
+
+
+def make_optic(model, counts, table, asphere, type_code, material_code, donor):
+    """
+    Scale, focus and stop down a batch of drawn lenses in place (see the
+    module docstring). Returns the mask of lenses that came out as working
+    optics at their donor's EFL and F/#.
+    """
+    n_lenses, n_surf = table["radius"].shape
+    lenses, surfaces = np.arange(n_lenses), np.arange(n_surf)
+    image, last = counts - 1, counts - 2
+    active = surfaces[None, :] < counts[:, None]
+    interior = (surfaces[None, :] >= 1) & (surfaces[None, :] < image[:, None])
+    even = is_type(model.type_names, type_code, "Even Asphere")
+    thin = is_type(model.type_names, type_code, "Paraxial")
+
+    # Packed arrays as paraxial.pack() lays them out, at the primary wavelength only
+    radius, a2 = table["radius"], asphere[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        curv = np.where(np.isfinite(radius) & (radius != 0), 1.0 / radius, 0.0)
+        curv = curv + np.where(even & np.isfinite(a2), 2.0 * a2, 0.0)
+        power = np.where(thin & np.isfinite(a2) & (a2 != 0), 1.0 / a2, 0.0)
+    thick = np.where(active & np.isfinite(table["thickness"]), table["thickness"], 0.0)
+    thick[:, 0] = table["thickness"][:, 0]
+    code = np.where(active, model.medium_code[material_code], SAME_MEDIUM)
+    index = paraxial.media(code, model.medium_index)
+
+    # EFL, and the image distance of the axial ray from the object point
+    ones, zeros = np.ones((n_lenses, 1)), np.zeros((n_lenses, 1))
+    _, nu1, n_img = paraxial.trace(curv, thick, power, index, image, ones, zeros)
+    t0 = thick[:, 0]
+    infinite = ~np.isfinite(t0)
+    y_object = np.where(infinite, 1.0, t0)[:, None]
+    nu_object = np.where(infinite[:, None], 0.0, index[:, :, 0])
+    heights, nu, _ = paraxial.trace(curv, thick, power, index, image, y_object, nu_object)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        efl = -1.0 / nu1[:, 0]
+        distance = -heights[lenses, 0, last] * n_img[:, 0] / nu[:, 0]
+    track = np.where(interior & (surfaces[None, :] < last[:, None]), thick, 0.0).sum(axis=1) / efl
+    ok = ((efl > 1.0 / EFL_WINDOW) & (efl < EFL_WINDOW) & np.isfinite(distance)
+          & (distance * np.sign(n_img[:, 0]) > 0)
+          & (track <= model.donor_track[donor] * TRACK_WINDOW) & (track >= model.donor_track[donor] / TRACK_WINDOW))
+
+    # Scale to the donor's EFL, then put the image surface at the paraxial image
+    scale = np.where(ok, model.donor_efl[donor] / efl, 1.0)[:, None]
+    scaled, asphere[:] = scale_lengths(table, asphere, thin, scale)
+    table.update(scaled)
+    table["thickness"][lenses, last] = distance * scale[:, 0]
+
+    # Stop down (or open up) the interior semi-diameters to the donor's F/#
+    thick = np.where(active & np.isfinite(table["thickness"]), table["thickness"], 0.0)
+    thick[:, 0] = table["thickness"][:, 0]
+    no_stop = np.full(n_lenses, -1, dtype=np.int64)
+    metrics = paraxial.first_order_arrays(curv / scale, thick, table["semi_diameter"], power / scale, index,
+                                          image, no_stop, np.full(n_lenses, np.nan),
+                                          [paraxial.WAVELENGTHS[paraxial.PRIMARY]], 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aperture = model.donor_efl[donor] / model.donor_fnum[donor] / metrics["epd"]
+    ok &= np.isfinite(aperture) & (aperture > 0)
+    table["semi_diameter"] = np.where(interior & ok[:, None], table["semi_diameter"] * aperture[:, None],
+                                      table["semi_diameter"])
+
+    # No surface may be wider than its radius, and no glass element thinner than nothing at its rim
+    limit = np.where(np.isfinite(table["radius"]) & (table["radius"] != 0), np.abs(table["radius"]), np.inf)
+    ok &= ~(interior & (table["semi_diameter"] > limit)).any(axis=1)
+    glass = (interior & (surfaces[None, :] < last[:, None])
+             & (medium_state(model.material_names)[material_code] == 1))[:, :-1]
+    edge = edge_thickness(table["radius"], table["thickness"], table["semi_diameter"], table["conic"], asphere, even)
+    ok &= ~(glass & ~(edge >= 0)).any(axis=1)
+    return ok
+
+# ---------------- Sampling ----------------
+def from_scores(knots, state, bins, scores):
+    """
+    Column values from normal scores through the (state, bin) quantile
+    tables, (lenses, surfaces, continuous). Between knots of opposite sign
+    or next to a zero knot the nearest knot is taken, so flats and zero
+    gaps stay exact instead of turning into huge radii.
+    """
+    position = (np.clip(scores, -GRID_LIMIT, GRID_LIMIT) + GRID_LIMIT) / (GRID[1] - GRID[0])
+    i = np.minimum(position.astype(np.int64), GRID_POINTS - 2)
+    w = position - i
+    n_bins, n_columns = knots.shape[1], knots.shape[2]
+    table = ((state * n_bins + bins)[..., None] * n_columns + np.arange(n_columns)) * GRID_POINTS + i
+    flat = knots.ravel()
+    lo, hi = flat[table], flat[table + 1]
+    values = lo + w * (hi - lo)
+    return np.where(lo * hi <= 0, np.where(w < 0.5, lo, hi), values)
+
+
+def draw_lenses(model, donor, rng):
+    """
+    One lens per entry of donor (donor lens positions) straight from the
+    model, with the donor's surface count and glasses, passed through
+    make_optic(): ({column: (lenses, surfaces)}, asphere, type code,
+    material code, mask of the accepted lenses).
+    """
+    n_groups = POSITION_BINS + 1
+    counts = model.counts[donor]
+    n_lenses = counts.size
+    n_interior = counts - 2
+    width = int(n_interior.max())
+    lenses = np.arange(n_lenses)
+
+    # Medium chain and normal scores, one surface position at a time across the batch
+    state = np.zeros((n_lenses, width), dtype=np.int64)
+    bins = np.zeros((n_lenses, width), dtype=np.int64)
+    scores = np.zeros((n_lenses, width, len(CONTINUOUS)))
+    for j in range(width):
+        surface = j + 1
+        bins[:, j] = b = position_bins(np.minimum(surface, n_interior), n_interior)
+        eps = rng.standard_normal((n_lenses, len(CONTINUOUS)))
+        if j == 0:
+            probabilities = np.broadcast_to(model.initial, (n_lenses, len(STATES)))
+            scores[:, 0] = eps @ model.start_chol.T
+        else:
+            probabilities = model.transitions[b, state[:, j - 1]]
+            scores[:, j] = (np.einsum("nij,nj->ni", model.coupling[b], scores[:, j - 1])
+                            + np.einsum("nij,nj->ni", model.noise_chol[b], eps))
+        cumulative = np.cumsum(probabilities, axis=1)
+        state[:, j] = np.minimum((rng.random((n_lenses, 1)) > cumulative).sum(axis=1), len(STATES) - 1)
+    values = from_scores(model.knots, state, bins, scores)
+
+    # Discrete columns drawn together from the surfaces of the same group
+    group = state * n_groups + bins
+    pick = model.pool_start[group] + (rng.random(group.shape) * model.pool_size[group]).astype(np.int64)
+    with np.errstate(divide="ignore"):
+        radius = np.where(values[..., 0] != 0, 1.0 / values[..., 0], np.inf)
+
+    # Full (lenses, surfaces) tables: object row, interior rows, image row
+    n_surf = width + 2
+    shape = (n_lenses, n_surf)
+    table = {"radius": np.full(shape, np.nan), "thickness": np.full(shape, np.nan),
+             "semi_diameter": np.full(shape, np.nan), "conic": np.full(shape, np.nan)}
+    asphere = np.full(shape + (len(EVEN_ORDERS),), np.nan)
+    type_code = np.zeros(shape, dtype=np.int16)
+    material_code = np.zeros(shape, dtype=np.int32)
+    table["radius"][:, 1:-1] = radius
+    table["thickness"][:, 1:-1] = values[..., 1]
+    table["semi_diameter"][:, 1:-1] = values[..., 2]
+    table["conic"][:, 1:-1] = model.pool_conic[pick]
+    asphere[:, 1:-1] = model.pool_asphere[pick]
+    type_code[:, 1:-1] = model.pool_type[pick]
+    material_code[:, 1:-1] = model.pool_material[pick]
+    for column, whole, codes in ((np.zeros(n_lenses, dtype=np.int64), model.object_rows, model.object_codes),
+                                 (counts - 1, model.image_rows, model.image_codes)):
+        drawn = rng.integers(whole.shape[0], size=n_lenses)
+        for k, key in enumerate(("radius", "thickness", "semi_diameter", "conic")):
+            table[key][lenses, column] = whole[drawn, k]
+        asphere[lenses, column] = whole[drawn, 4:]
+        type_code[lenses, column] = codes[drawn, 0]
+        material_code[lenses, column] = codes[drawn, 1]
+
+    # Glass surfaces take the names of the donor lens
+    glass_pick = (model.donor_start[donor][:, None]
+                  + (rng.random((n_lenses, width)) * model.donor_size[donor][:, None]).astype(np.int64))
+    material_code[:, 1:-1] = np.where(state == 1, model.donor_material[glass_pick], material_code[:, 1:-1])
+
+    ok = make_optic(model, counts, table, asphere, type_code, material_code, donor)
+    return table, asphere, type_code, material_code, ok
+
+
+def sample_corpus(model, n_lenses, rng, first_id=0, prefix=LENS_PREFIX):
+    """
+    One batch of n_lenses synthetic lenses as a PackedCorpus (ids prefix +
+    zero-padded counter).
+
+    Each lens slot draws its donor once and keeps drawing lenses of that
+    donor's surface count and first order, several copies a round, until
+    make_optic() accepts one, so rejection skews neither the surface counts
+    nor the EFL and F/# (slow lenses pass the rim checks more easily);
+    slots still empty after REDRAW_ROUNDS rounds draw a new donor.
+    """
+    slots = rng.integers(model.counts.size, size=n_lenses)
+    parts, accepted, rounds = [], 1.0, 0
+    while slots.size:
+        copies = int(np.clip(np.ceil(1.0 / accepted), 1, max(BATCH_LENSES // slots.size, 1)))
+        donor = np.repeat(slots, copies)
+        counts = model.counts[donor]
+        table, asphere, type_code, material_code, ok = draw_lenses(model, donor, rng)
+        accepted = max(ok.mean(), 0.01)
+        # First accepted copy of every slot
+        slot = np.flatnonzero(ok) // copies
+        filled, first = np.unique(slot, return_index=True)
+        chosen = np.flatnonzero(ok)[first]
+        active = np.arange(counts.max())[None, :] < counts[chosen][:, None]
+        parts.append((counts[chosen], {key: values[chosen][active] for key, values in table.items()},
+                      asphere[chosen][active], type_code[chosen][active], material_code[chosen][active]))
+        slots = np.delete(slots, filled)
+        rounds += 1
+        if rounds % REDRAW_ROUNDS == 0:
+            slots = rng.integers(model.counts.size, size=slots.size)
+
+    counts = np.concatenate([part[0] for part in parts])
+    offsets = np.zeros(n_lenses + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    def column(values):
+        return np.concatenate(values)
+
+    lens_ids = np.array([f"{prefix}{first_id + i:08d}" for i in range(n_lenses)], dtype=str)
+    return prescription_store.PackedCorpus(
+        lens_ids, offsets, column([part[1]["radius"] for part in parts]),
+        column([part[1]["thickness"] for part in parts]), column([part[1]["semi_diameter"] for part in parts]),
+        column([part[1]["conic"] for part in parts]), column([part[2] for part in parts]),
+        column([part[3] for part in parts]), model.type_names, column([part[4] for part in parts]),
+        model.material_names)
+
+
+def sample_batches(model, n_lenses, batch=BATCH_LENSES, seed=SEED, prefix=LENS_PREFIX):
+    """Yield PackedCorpus batches until n_lenses lenses have been sampled."""
+    rng = np.random.default_rng(seed)
+    for first_id in range(0, n_lenses, batch):
+        yield sample_corpus(model, min(batch, n_lenses - first_id), rng, first_id, prefix)
+
+# ---------------- Output ----------------
+def write_store_shards(model, n_lenses, out_dir=STORE_DIR, batch=BATCH_LENSES, seed=SEED):
+    """Sample n_lenses lenses into out_dir/synthetic_XXXXX.npz store shards. Returns the shard paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for k, corpus in enumerate(sample_batches(model, n_lenses, batch, seed)):
+        path = os.path.join(out_dir, f"synthetic_{k:05d}.npz")
+        prescription_store.save_store(corpus, path)
+        paths.append(path)
+    return paths
+
+
+def lens_rows(corpus, lens_id, index=None):
+    """One lens of a PackedCorpus as LensDataExports rows."""
+    p = prescription_store.prescription(corpus, lens_id, index)
+    rows = []
+    for s in range(len(p["radius"])):
+        row = {"Surface": s, "TypeName": p["type"][s], "Comment": "", "Radius": float(p["radius"][s]),
+               "Thickness": float(p["thickness"][s]), "Material": p["material"][s],
+               "SemiDiameter": float(p["semi_diameter"][s]), "Conic": float(p["conic"][s])}
+        row.update({f"A{order}": float(p["asphere"][s, k]) for k, order in enumerate(EVEN_ORDERS)})
+        rows.append(row)
+    return rows
+
+
+def write_lens_data(corpus, out_dir=LENS_DATA_DIR):
+    """Write every lens of a PackedCorpus as <lens>_LensData.csv (the LensDataExports schema)."""
+    os.makedirs(out_dir, exist_ok=True)
+    index = prescription_store.lens_index(corpus)
+    for lens_id in index:
+        write_lens_csv(os.path.join(out_dir, f"{lens_id}_LensData.csv"), lens_rows(corpus, lens_id, index))
+    return len(index)
+
+# ---------------- Checks ----------------
+def interior_columns(corpus):
+    """(radius, thickness, semi-diameter, lag-1 semi-diameter pairs) of the interior surfaces."""
+    interior = np.ones(int(corpus.offsets[-1]), dtype=bool)
+    interior[corpus.offsets[:-1]] = False
+    interior[corpus.offsets[1:] - 1] = False
+    index = np.flatnonzero(interior)
+    follows = np.isin(index - 1, index)
+    pairs = np.column_stack([corpus.semi_diameter[index[follows] - 1], corpus.semi_diameter[index[follows]]])
+    return corpus.radius[index], corpus.thickness[index], corpus.semi_diameter[index], pairs
+
+
+def rim_checks(corpus):
+    """(fraction of glass elements with negative edge thickness, of interior surfaces wider than their radius)."""
+    radius, _, semi_diameter, _ = interior_columns(corpus)
+    wide = np.isfinite(radius) & (radius != 0) & (semi_diameter > np.abs(radius))
+    even = is_type(corpus.type_names, corpus.type_code, "Even Asphere")
+    edge = edge_thickness(corpus.radius, corpus.thickness, corpus.semi_diameter, corpus.conic, corpus.asphere, even)
+    # Glass gaps between two interior surfaces of the same lens
+    last = np.zeros(int(corpus.offsets[-1]), dtype=bool)
+    last[corpus.offsets[1:] - 2] = True
+    last[corpus.offsets[1:] - 1] = True
+    glass = (medium_state(corpus.material_names)[corpus.material_code] == 1) & ~last
+    glass[corpus.offsets[:-1]] = False
+    edge = edge[glass[:-1]]
+    return (~(edge >= 0)).mean(), wide.mean()
+
+
+def compare(real, synthetic, catalog=None):
+    """
+    Print quantiles, sequence statistics and the first-order spread (EFL,
+    F/# and BFL/EFL from paraxial.first_order) of the real and a synthetic
+    corpus side by side.
+    """
+    for name, (a, b) in zip(["Radius", "Thickness", "SemiDiameter"],
+                            zip(interior_columns(real)[:3], interior_columns(synthetic)[:3])):
+        rows = [streaming_stats.summary(streaming_stats.update(streaming_stats.new_stats(), v), name)
+                for v in (a, b)]
+        quantiles = [k for k in rows[0] if k[0] == "p" and k[1:3].isdigit()]
+        print(f"   {name:<13}" + "  ".join(f"{k[:3]} {rows[0][k]:>9.3g}/{rows[1][k]:<9.3g}" for k in quantiles))
+    for label, corpus in (("real", real), ("synthetic", synthetic)):
+        pairs = interior_columns(corpus)[3]
+        pairs = pairs[np.isfinite(pairs).all(axis=1) & (pairs > 0).all(axis=1)]
+        glass = medium_state(corpus.material_names)[corpus.material_code] == 1
+        asphere = np.isfinite(corpus.asphere[:, 1]) & (corpus.asphere[:, 1] != 0)
+        print(f"   {label:<10} lag-1 SemiDiameter corr {np.corrcoef(np.log(pairs).T)[0, 1]:.3f}, "
+              f"glass {glass.mean():.3f}, A4 != 0 {asphere.mean():.4f}, "
+              f"surfaces/lens {np.diff(corpus.offsets).mean():.2f}")
+    for label, corpus in (("real", real), ("synthetic", synthetic)):
+        negative, wide = rim_checks(corpus)
+        print(f"   {label:<10} glass elements with edge thickness < 0 {negative:.3f}, "
+              f"surfaces wider than their radius {wide:.3f}")
+    for label, corpus in (("real", real), ("synthetic", synthetic)):
+        results = corpus_first_order(corpus, catalog)
+        efl, fnum, bfl = results["efl"], results["fnum"], results["bfl"]
+        finite = np.isfinite(efl)
+        ratio = (bfl / efl)[finite & np.isfinite(bfl)]
+        fnum = np.abs(fnum[finite & np.isfinite(fnum)])
+        print(f"   {label:<10} finite EFL {finite.mean():.3f}, EFL < 0 {(efl[finite] < 0).mean():.3f}, "
+              f"median F/# {np.median(fnum):.2f}, BFL/EFL p5-p95 "
+              f"{np.percentile(ratio, 5):.3g}..{np.percentile(ratio, 95):.3g}")
+
+
+if __name__ == "__main__":
+    SYNTHETIC_LENSES = 1_000_000
+
+    start = time.perf_counter()
+    if os.path.exists(prescription_store.STORE_PATH):
+        real = prescription_store.load_store(prescription_store.STORE_PATH)
+    else:
+        real = prescription_store.pack_prescriptions(paraxial.read_lens_data(paraxial.LENS_DATA_DIR))
+    catalog, _ = paraxial.scan_zmx(paraxial.LENS_DIR)
+    model = fit_model(real, catalog)
+    fitted = time.perf_counter()
+
+    paths = write_store_shards(model, SYNTHETIC_LENSES, STORE_DIR)
+    sampled = time.perf_counter()
+    print(f"✅ Fitted the surface model on {len(real.lens_ids)} lenses ({fitted - start:.2f} s)")
+    print(f"✅ Sampled {SYNTHETIC_LENSES:,} synthetic lenses into {len(paths)} store shards in {STORE_DIR} "
+          f"({sampled - fitted:.1f} s, {SYNTHETIC_LENSES / (sampled - fitted):,.0f} lenses/s)")
+
+    # Real / synthetic side by side on the first shard
+    print("   Interior quantiles, real/synthetic:")
+    compare(real, prescription_store.load_store(paths[0]), catalog)
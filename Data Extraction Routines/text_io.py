@@ -0,0 +1,102 @@
+'''
+Shared text readers for the OpticStudio exports, lens files and CSVs.
+
+The codec is picked once from the BOM / first bytes of the file and the
+bytes are decoded a single time, instead of decoding the whole file as
+UTF-8 and reading and decoding it again as UTF-16 on failure. Exports can
+also be memory-mapped so only the table region (from the first
+"Table series:" line on) is decoded.
+'''
+
+import os
+import mmap
+import codecs
+
+SNIFF_BYTES = 4096
+MMAP_THRESHOLD = 1 << 20
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def sniff_encoding(head):
+    """
+    Pick the codec for a file from its first bytes.
+
+    A BOM decides outright. Without one, NUL bytes in every other position
+    mean BOM-less UTF-16 (the side they sit on gives the byte order), and
+    anything else is read as UTF-8.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    sample = head[:512]
+    if len(sample) >= 2 and sample.count(0) * 4 >= len(sample):
+        odd_nuls = sample[1::2].count(0)
+        even_nuls = sample[0::2].count(0)
+        return "utf-16-le" if odd_nuls >= even_nuls else "utf-16-be"
+    return "utf-8"
+
+
+def sniff_file_encoding(path):
+    """Codec for a file on disk (reads only its first few bytes)."""
+    with open(path, "rb") as f:
+        return sniff_encoding(f.read(SNIFF_BYTES))
+
+
+def decode(raw, encoding):
+    """Decode bytes once; 8-bit text that is not valid UTF-8 falls back to latin-1."""
+    try:
+        text = raw.decode(encoding)
+    except UnicodeDecodeError:
+        if not encoding.startswith("utf-8"):
+            raise
+        text = raw.decode("latin-1")
+    return text.replace("\r\n", "\n") if "\r" in text else text
+
+
+def read_text(path):
+    """Read a whole text file with a single read and a single decode."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    return decode(raw, sniff_encoding(raw[:SNIFF_BYTES]))
+
+
+def decode_from_marker(buf, marker):
+    """Decode a bytes-like buffer from the first occurrence of marker on ('' if absent)."""
+    head = buf[:SNIFF_BYTES]
+    encoding = sniff_encoding(head)
+    if encoding == "utf-16":
+        encoding = "utf-16-be" if head.startswith(codecs.BOM_UTF16_BE) else "utf-16-le"
+    elif encoding == "utf-8-sig":
+        encoding = "utf-8"
+    needle = marker.encode(encoding)
+    start = buf.find(needle)
+    # UTF-16 code units must start on an even offset
+    while start != -1 and encoding.startswith("utf-16") and start % 2:
+        start = buf.find(needle, start + 1)
+    if start == -1:
+        return ""
+    return decode(buf[start:], encoding)
+
+
+def read_from_marker(path, marker):
+    """
+    Decode a file from the first occurrence of marker on, so the preamble
+    before it is never decoded. Returns '' if the file is empty or never
+    contains marker.
+
+    Files larger than MMAP_THRESHOLD are memory-mapped; for the typical
+    30 kB export a single read() is cheaper than setting up a mapping.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ""
+        if size < MMAP_THRESHOLD:
+            return decode_from_marker(f.read(), marker)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return decode_from_marker(mm, marker)
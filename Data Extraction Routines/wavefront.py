@@ -0,0 +1,337 @@
+'''
+RMS wavefront error vs. field and relative illumination on the batched
+real-ray tracer (raytrace.py), without an OpticStudio run.
+
+For every lens, all field points (and wavelengths) are traced as one array
+of aimed pupil rays:
+
+  rms_wavefront()         OPD on the reference sphere centred on the image
+                          centroid with piston and tilt fitted out
+                          (OpticStudio's "Reference: Centroid"), RMS in waves
+                          per wavelength; the polychromatic RMS shares one
+                          centroid and tilt across wavelengths
+  relative_illumination() projected solid angle of the unvignetted exit
+                          pupil seen from the image point, relative to the
+                          axis, and the Effective F/# it implies, at the
+                          primary wavelength
+
+Both clip rays at the floating / circular apertures of the .zmx files;
+relative illumination also clips at the surface semi-diameters (except the
+stop's), which is how OpticStudio's Vignetting export falls off while its
+RMS-vs-field export is left unvignetted by them.
+Fields run from 0 to the largest field of the lens in its own field units
+(degrees for FTYP 0, millimetres otherwise; a real image height is found by
+aiming the chief ray onto it).
+
+write_tables() writes the results in the CSVExports layout that
+process_RMSvField.py and process_Vignetting.py produce, with lenses spread
+over a process pool. Each lens is traced at its own WAVM wavelengths (one
+System per wavelength group, raytrace.build_systems), so the per-wavelength
+RMS columns are those of its OpticStudio export.
+'''
+
+import os
+import time
+
+import numpy as np
+
+import paraxial
+import raytrace
+from analysis_parser import Table, write_csv, run_shards
+
+# ---------------- Settings ----------------
+GRID = 32                     # pupil samples across the diameter (RMS grid; RI uses GRID // 2 rings)
+RMS_FIELDS = 16               # field points of the RMSvField export
+RI_FIELDS = 21                # field points of the Vignetting export
+AIM_GRID = 6                  # coarse polar pupil aimed exactly, the rest start from a fit to it
+AIM_ORDER = 4                 # order of the (px, py) polynomial fitted to the coarse launch points
+AIM_TOLERANCE = 1e-4          # mm at the stop for the full pupil sample
+CHUNK_LENSES = 16             # lenses traced together per pool task
+WORKERS = os.cpu_count()
+
+OUTPUT_ROOT = os.path.join(paraxial.DATA_DIR, "CSVExports", "RayTrace")
+
+# ---------------- Pupil Sampling ----------------
+def square_pupil(grid=GRID):
+    """Square grid of pupil points inside the unit circle, chief ray (0, 0) first."""
+    axis = (np.arange(grid) + 0.5) / grid * 2.0 - 1.0
+    px, py = np.meshgrid(axis, axis)
+    keep = px * px + py * py <= 1.0
+    return np.concatenate([[0.0], px[keep]]), np.concatenate([[0.0], py[keep]])
+
+
+def polar_pupil(grid=GRID):
+    """
+    Centre plus rings x spokes on the unit disk (rim included), for
+    integrating areas over the pupil. Returns (px, py, rings, spokes).
+    """
+    rings, spokes = max(grid // 2, 1), max(2 * grid, 8)
+    r = np.arange(1, rings + 1) / rings
+    phi = np.arange(spokes) * 2.0 * np.pi / spokes
+    px = np.concatenate([[0.0], (r[:, None] * np.sin(phi)).ravel()])
+    py = np.concatenate([[0.0], (r[:, None] * np.cos(phi)).ravel()])
+    return px, py, rings, spokes
+
+# ---------------- Tracing ----------------
+@np.errstate(invalid="ignore", divide="ignore")
+def trace_pupil(system, launch_field, px, py, clip):
+    """
+    Aim and trace a pupil sample at every field, with vignetting.
+
+    launch_field : (lenses, fields); px, py : (pupil,)
+    clip         : (lenses, surfaces) clip radii for raytrace.propagate
+    Returns (rays at the image (lenses, wavelengths, fields * pupil), optical
+    path to the image plane, intersections). Vignetted rays are NaN.
+
+    Only a coarse AIM_GRID pupil is aimed from the paraxial guess; the full
+    sample starts from a polynomial fit to its launch points, which leaves
+    the secant a step or two instead of a full run per ray. Rays that do
+    not reach the stop within AIM_TOLERANCE from that start count as
+    vignetted.
+    """
+    n_lenses, n_fields = launch_field.shape
+    guess, count = launch_guess(system, launch_field, px, py)
+    field = np.repeat(launch_field, px.size, axis=1)
+    px = np.broadcast_to(np.tile(px, n_fields), field.shape)
+    py = np.broadcast_to(np.tile(py, n_fields), field.shape)
+    rays, n = raytrace.aim(system, field, px, py, guess=guess, recover=False,
+                           tolerance=AIM_TOLERANCE)
+    count += n
+
+    # Optical path from the object point, or from the plane through the vertex
+    # of surface 1 normal to a collimated beam
+    n0 = np.abs(system.index[:, :, 0])[:, :, None]
+    t0 = np.where(system.infinite, 0.0, system.thick[:, 0])[:, None, None]
+    y_object = raytrace.object_point(system, field)[:, None, :]
+    to_object = np.sqrt(rays.x ** 2 + (rays.y - y_object) ** 2 + (rays.z + t0) ** 2)
+    along_beam = rays.x * rays.k + rays.y * rays.l + rays.z * rays.m
+    path = n0 * np.where(system.infinite[:, None, None], along_beam, to_object)
+
+    at_last, _, n = raytrace.propagate(system, rays, clip=clip, path=path)
+    at_image = raytrace.to_image(system, at_last)
+    rows = np.arange(n_lenses)
+    n_image = np.abs(system.index[rows, :, system.image - 1])[:, :, None]
+    t_last = system.thick[rows, system.image - 1][:, None, None]
+    path += n_image * (t_last - at_last.z) / at_last.m
+    return at_image, path, count + n
+
+
+def pupil_basis(px, py, order=AIM_ORDER):
+    """Monomials px^i py^j with i + j <= order, (samples, terms)."""
+    return np.column_stack([px ** i * py ** (total - i) for total in range(order + 1) for i in range(total + 1)])
+
+
+def launch_guess(system, launch_field, px, py):
+    """
+    Starting launch points for the pupil sample (px, py) at every field:
+    the coarse polar pupil is aimed and its launch points fitted per lens,
+    wavelength and field. Returns ((hx, hy) (lenses, wavelengths, fields *
+    pupil), intersections).
+    """
+    n_lenses, n_fields = launch_field.shape
+    cx, cy, _, _ = polar_pupil(AIM_GRID)
+    field = np.repeat(launch_field, cx.size, axis=1)
+    coarse, count = raytrace.aim(system, field, np.broadcast_to(np.tile(cx, n_fields), field.shape),
+                                 np.broadcast_to(np.tile(cy, n_fields), field.shape))
+    # Back from the tangent plane of surface 1 to the entrance pupil plane
+    z_ep = raytrace.entrance_pupil(system)[:, None, None]
+    shape = (n_lenses, len(system.wavelengths), n_fields, cx.size)
+    basis = pupil_basis(px, py)
+    guess = []
+    for position, direction in ((coarse.x, coarse.k), (coarse.y, coarse.l)):
+        h = (position + direction / coarse.m * z_ep).reshape(shape)
+        fit = basis @ least_squares(h, pupil_basis(cx, cy))[..., None]
+        guess.append(fit[..., 0].reshape(shape[:2] + (-1,)))
+    return tuple(guess), count
+
+
+def sphere_distance(x, y, k, l, m, xc, yc, z_xp):
+    """
+    Signed distance back along each ray from the image plane to the
+    reference sphere centred at (xc, yc, 0) through the chief ray's exit
+    pupil point (the chief ray is sample 0 of the last axis). An exit pupil
+    at infinity (image-space telecentric) references a plane normal to the
+    chief ray instead.
+    """
+    to_pupil = z_xp / m[..., :1]
+    pupil_x = x[..., :1] + to_pupil * k[..., :1] - xc
+    pupil_y = y[..., :1] + to_pupil * l[..., :1] - yc
+    radius2 = pupil_x ** 2 + pupil_y ** 2 + z_xp ** 2
+
+    qx, qy = x - xc, y - yc
+    b = qx * k + qy * l
+    t = -b + np.copysign(np.sqrt(b * b - (qx * qx + qy * qy - radius2)), z_xp)
+    plane = -(qx * k[..., :1] + qy * l[..., :1]) / (k * k[..., :1] + l * l[..., :1] + m * m[..., :1])
+    return np.where(np.isfinite(z_xp), t, plane)
+
+
+def least_squares(values, basis):
+    """
+    Coefficients (..., terms) of the least-squares fit of values
+    (..., samples) on basis (samples, terms); NaN samples (vignetted or
+    lost rays) are left out of the fit.
+    """
+    valid = np.isfinite(values)
+    weighted = basis * valid[..., None]
+    values = np.where(valid, values, 0.0)
+    normal = np.einsum("...si,...sj->...ij", weighted, weighted)
+    rhs = np.einsum("...si,...s->...i", weighted, values)
+    # Terms without any sample (a wavelength lost entirely) are pinned to zero
+    normal = normal + np.eye(basis.shape[-1]) * (np.diagonal(normal, axis1=-2, axis2=-1) == 0)[..., None]
+    return np.linalg.solve(normal, rhs[..., None])[..., 0]
+
+
+def residual(values, basis):
+    """values (..., samples) minus their least-squares fit on basis (samples, terms), NaN kept."""
+    fit = least_squares(values, basis)
+    return np.where(np.isfinite(values), values - np.einsum("si,...i->...s", basis, fit), np.nan)
+
+
+@np.errstate(invalid="ignore", divide="ignore")
+def rms_wavefront(system, fields=None, grid=GRID):
+    """
+    RMS wavefront error referenced to the image centroid (piston and tilt removed).
+
+    fields : (lenses, n_fields) in each lens's field units (default
+             RMS_FIELDS points from 0 to the largest field)
+    Returns (fields, rms (lenses, n_fields, wavelengths) in waves,
+    poly (lenses, n_fields), intersections).
+    """
+    if fields is None:
+        fields = raytrace.field_grid(system, RMS_FIELDS)
+    n_lenses, n_fields = fields.shape
+    px, py = square_pupil(grid)
+    at_image, path, count = trace_pupil(system, raytrace.launch_fields(system, fields), px, py, system.aperture)
+
+    shape = (n_lenses, len(system.wavelengths), n_fields, px.size)
+    x, y = at_image.x.reshape(shape), at_image.y.reshape(shape)
+    k, l, m = at_image.k.reshape(shape), at_image.l.reshape(shape), at_image.m.reshape(shape)
+    path = path.reshape(shape)
+
+    z_xp = system.first["exit_pupil"][:, None, None, None]
+    n_image = np.abs(system.index[np.arange(n_lenses), :, system.image - 1])[:, :, None, None]
+    waves = system.wavelengths[None, :, None, None] * 1e-3
+
+    def reference_path(xc, yc):
+        """Optical path to the reference sphere centred at (xc, yc) on the image plane."""
+        t = sphere_distance(x, y, k, l, m, xc, yc, z_xp)
+        return path + n_image * t
+
+    # Monochromatic: each wavelength about its own centroid, piston and tilt fitted out
+    xc, yc = np.nanmean(x, axis=-1, keepdims=True), np.nanmean(y, axis=-1, keepdims=True)
+    mono = residual(reference_path(xc, yc) / waves, np.column_stack([np.ones_like(px), px, py]))
+    rms = np.sqrt(np.nanmean(mono * mono, axis=-1))
+    rms[~system.supported] = np.nan
+
+    # Polychromatic: one sphere about the polychromatic centroid and one tilt for all
+    # wavelengths (so lateral colour counts), a piston per wavelength
+    n_waves, n_pupil = len(system.wavelengths), px.size
+    xc, yc = np.nanmean(x, axis=(1, 3), keepdims=True), np.nanmean(y, axis=(1, 3), keepdims=True)
+    shared = reference_path(xc, yc).transpose(0, 2, 1, 3).reshape(n_lenses, n_fields, n_waves * n_pupil)
+    pistons = np.repeat(np.eye(n_waves), n_pupil, axis=0)
+    joint = residual(shared, np.column_stack([pistons, np.tile(px, n_waves), np.tile(py, n_waves)]))
+    joint = joint.reshape(n_lenses, n_fields, n_waves, n_pupil) / waves.transpose(0, 2, 1, 3)
+    poly = np.sqrt(np.nanmean(joint * joint, axis=(-2, -1)))
+    poly[~system.supported] = np.nan
+    return fields, rms.transpose(0, 2, 1), poly, count
+
+
+@np.errstate(invalid="ignore", divide="ignore")
+def relative_illumination(system, fields=None, grid=GRID):
+    """
+    Relative illumination and Effective F/# at the primary wavelength.
+
+    The pupil is sampled on a polar grid; each cell whose corners all pass
+    the apertures adds its area in image-space direction cosines (the
+    projected solid angle, times n'^2). Effective F/# = 1 / (2 sqrt(Ω / π)).
+    Returns (fields, rel_ill (lenses, n_fields), effective_fnum, intersections).
+    """
+    if fields is None:
+        fields = raytrace.field_grid(system, RI_FIELDS)
+    n_lenses, n_fields = fields.shape
+    mono = system._replace(index=system.index[:, [system.primary]],
+                           wavelengths=system.wavelengths[[system.primary]], primary=0)
+    # The axis is traced alongside to normalise by
+    with_axis = np.concatenate([np.zeros((n_lenses, 1)), fields], axis=1)
+    px, py, rings, spokes = polar_pupil(grid)
+    at_image, _, count = trace_pupil(mono, raytrace.launch_fields(mono, with_axis), px, py,
+                                       np.minimum(system.aperture, system.semi_diameter))
+
+    shape = (n_lenses, n_fields + 1, px.size)
+    k, l = at_image.k.reshape(shape), at_image.l.reshape(shape)
+    # Corner indices of every cell: ring j..j+1, spoke i..i+1 (ring 0 is the centre point)
+    ring = np.arange(rings)[:, None]
+    spoke = np.arange(spokes)[None, :]
+    inner = np.where(ring == 0, 0, 1 + (ring - 1) * spokes + spoke)
+    inner_next = np.where(ring == 0, 0, 1 + (ring - 1) * spokes + (spoke + 1) % spokes)
+    outer = 1 + ring * spokes + spoke
+    outer_next = 1 + ring * spokes + (spoke + 1) % spokes
+    corners = [a.ravel() for a in np.broadcast_arrays(inner, outer, outer_next, inner_next)]
+
+    # Shoelace area of each quadrilateral (triangles at the centre)
+    area = np.zeros(shape[:2] + (corners[0].size,))
+    for a, b in zip(corners, corners[1:] + corners[:1]):
+        area += k[..., a] * l[..., b] - k[..., b] * l[..., a]
+    solid_angle = np.abs(np.nansum(0.5 * area, axis=-1))
+    n_image = np.abs(system.index[np.arange(n_lenses), system.primary, system.image - 1])[:, None]
+    solid_angle = solid_angle * n_image ** 2
+
+    rel_ill = solid_angle[:, 1:] / solid_angle[:, :1]
+    effective_fnum = 1.0 / (2.0 * np.sqrt(solid_angle[:, 1:] / np.pi))
+    rel_ill[~system.supported] = np.nan
+    effective_fnum[~system.supported] = np.nan
+    return fields, rel_ill, effective_fnum, count
+
+# ---------------- Export Tables ----------------
+def rms_tables(system, fields, rms, poly, i):
+    """The RMSvField export of lens i as analysis_parser Table tuples."""
+    headers = ["Field", "Poly"] + [f"{w:.4f}" for w in system.wavelengths]
+    return [Table(headers, None, np.column_stack([fields[i], poly[i], rms[i]]), None)]
+
+
+def vignetting_tables(fields, rel_ill, effective_fnum, i):
+    """The Vignetting export of lens i as analysis_parser Table tuples."""
+    headers = ["Y Field", "Rel. Ill", "Effective F/#"]
+    return [Table(headers, None, np.column_stack([fields[i], rel_ill[i], effective_fnum[i]]), None)]
+
+
+def analyse_chunk(system, grid=GRID):
+    """Pool worker: both analyses for one chunk of lenses, as [(lens_id, rms tables, vignetting tables)]."""
+    fields, rms, poly, _ = rms_wavefront(system, grid=grid)
+    ri_fields, rel_ill, effective_fnum, _ = relative_illumination(system, grid=grid)
+    return [(lens_id, rms_tables(system, fields, rms, poly, i),
+             vignetting_tables(ri_fields, rel_ill, effective_fnum, i))
+            for i, lens_id in enumerate(system.lens_ids) if system.supported[i]]
+
+
+def write_tables(systems, output_root=OUTPUT_ROOT, grid=GRID, workers=WORKERS):
+    """
+    Compute both analyses for every supported lens of the systems (one per
+    wavelength group, raytrace.build_systems) and write them as
+    <output_root>/<Analysis>/<lens>_<Analysis>.csv, CHUNK_LENSES lenses per
+    pool task. Returns the number of lenses written.
+    """
+    chunks = []
+    for system in systems:
+        rows = np.flatnonzero(system.supported)
+        # Chunks keep the surface-count order raytrace.subset relies on
+        chunks += [raytrace.subset(system, rows[i:i + CHUNK_LENSES]) for i in range(0, rows.size, CHUNK_LENSES)]
+    results = run_shards(analyse_chunk, chunks, workers, grid)
+
+    for name in ("RMSvField", "Vignetting"):
+        os.makedirs(os.path.join(output_root, name), exist_ok=True)
+    for lens_id, rms, vignetting in results:
+        write_csv(os.path.join(output_root, "RMSvField", f"{lens_id}_RMSvField.csv"), rms)
+        write_csv(os.path.join(output_root, "Vignetting", f"{lens_id}_Vignetting.csv"), vignetting)
+    return len(results)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    catalog, _ = paraxial.scan_zmx(paraxial.LENS_DIR)
+    prescriptions, stops = paraxial.read_zmx_prescriptions(paraxial.LENS_DIR)
+    systems = raytrace.build_systems(prescriptions, catalog=catalog, stops=stops)
+
+    written = write_tables(systems, OUTPUT_ROOT)
+    print(f"✅ Wrote RMSvField and Vignetting tables for {written} of {len(prescriptions)} lenses "
+          f"to {OUTPUT_ROOT} ({time.perf_counter() - start:.2f} s)")
@@ -0,0 +1,314 @@
+'''
+Pure-Python streaming reader for OpticStudio .zmx prescriptions.
+
+Reads the SURF/TYPE/CURV/DISZ/GLAS/DIAM/CONI/PARM records straight from
+the lens files (ASCII or UTF-16, .zmx or .ZMX) and emits the same
+Surface/TypeName/.../A2..A16 schema that BatchExportLensData.m writes to
+LensDataExports, so lens data no longer needs an OpticStudio round-trip.
+'''
+
+import os
+import re
+import csv
+import math
+import time
+
+from text_io import read_text
+from materials import glass_record
+
+# ---------------- Paths ----------------
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Prime Lenses + Data"))
+LENS_DIR = DATA_DIR
+# The OpticStudio exports stay authoritative; .zmx conversions go next to them
+EXPORT_DIR = os.path.join(DATA_DIR, "LensDataExports")
+OUTPUT_DIR = os.path.join(DATA_DIR, "LensDataExports_zmx")
+
+# ---------------- Schema ----------------
+EVEN_ORDERS = list(range(2, 18, 2))
+COLUMNS = ["Surface", "TypeName", "Comment", "Radius", "Thickness", "Material",
+           "SemiDiameter", "Conic"] + [f"A{order}" for order in EVEN_ORDERS]
+
+# .zmx TYPE keyword -> LDE TypeName as OpticStudio reports it
+TYPE_NAMES = {
+    "STANDARD": "Standard",
+    "EVENASPH": "Even Asphere",
+    "ODDASPHE": "Odd Asphere",
+    "XOSPHERE": "Extended Odd Asphere",
+    "XASPHERE": "Extended Asphere",
+    "PARAXIAL": "Paraxial",
+    "COORDBRK": "Coordinate Break",
+    "TOROIDAL": "Toroidal",
+    "BICONICX": "Biconic",
+    "TILTSURF": "Tilted",
+}
+
+# ---------------- Parsing ----------------
+number_prefix = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
+
+def to_float(token, default=math.nan):
+    """
+    Parse a .zmx number (INFINITY included), returning default if it is not one.
+    Like OpticStudio, hand-edited values such as "1,5168" or "-6.03510E-08??"
+    are read up to the first character that cannot belong to the number.
+    """
+    try:
+        return float(token)
+    except (TypeError, ValueError):
+        pass
+    match = number_prefix.match(token or "")
+    return float(match.group(0)) if match else default
+
+
+def new_surface(number):
+    """Empty surface record with the defaults OpticStudio assumes."""
+    return {
+        "Surface": number,
+        "TypeName": "Standard",
+        "Comment": "",
+        "curv": 0.0,
+        "Thickness": 0.0,
+        "Material": "",
+        "SemiDiameter": 0.0,
+        "Conic": 0.0,
+        "aperture": math.nan,
+        "parm": {},
+        "stop": False,
+        "model_glass": None,
+    }
+
+
+def glass_material(tokens):
+    """Material string for a GLAS record: catalog name, or 'n,V' for a ___BLANK model glass."""
+    name = tokens[1] if len(tokens) > 1 else ""
+    if name != "___BLANK":
+        return name
+    nd, vd = to_float(tokens[4] if len(tokens) > 4 else None), to_float(tokens[5] if len(tokens) > 5 else None)
+    return f"{nd:.2f},{vd:.1f}"
+
+
+def parse_zmx(lines):
+    """
+    Stream the records of one lens file.
+
+    Returns a dict with the system header (name, fnum, enpd, field and
+    wavelength lists, stop surface) and the list of raw surface records.
+    """
+    system = {
+        "name": "",
+        "fnum": math.nan,
+        "enpd": math.nan,
+        "ftyp": [],
+        "fields": [],
+        "wavelengths": [],
+        "primary_wavelength": 1,
+        "stop": None,
+        "surfaces": [],
+    }
+    wavm = {}
+    surface = None
+
+    for line in lines:
+        tokens = line.split()
+        if not tokens:
+            continue
+        key = tokens[0]
+
+        if key == "SURF":
+            surface = new_surface(int(tokens[1]))
+            system["surfaces"].append(surface)
+        elif surface is not None and line[:1].isspace():
+            if key == "TYPE":
+                surface["TypeName"] = TYPE_NAMES.get(tokens[1], tokens[1].title()) if len(tokens) > 1 else ""
+            elif key == "CURV":
+                surface["curv"] = to_float(tokens[1], 0.0)
+            elif key == "DISZ":
+                surface["Thickness"] = to_float(tokens[1], 0.0)
+            elif key == "GLAS":
+                surface["Material"] = glass_material(tokens)
+                surface["model_glass"] = glass_record(tokens)
+            elif key == "DIAM":
+                surface["SemiDiameter"] = to_float(tokens[1], 0.0)
+            elif key in ("FLAP", "CLAP"):
+                # Floating / circular aperture: <min radius> <max radius>
+                surface["aperture"] = to_float(tokens[2] if len(tokens) > 2 else None)
+            elif key == "CONI":
+                surface["Conic"] = to_float(tokens[1], 0.0)
+            elif key == "PARM" and len(tokens) > 2:
+                surface["parm"][int(tokens[1])] = to_float(tokens[2], 0.0)
+            elif key == "COMM":
+                surface["Comment"] = line.strip()[5:]
+            elif key == "STOP":
+                surface["stop"] = True
+                system["stop"] = surface["Surface"]
+        elif key == "NAME":
+            system["name"] = line[5:].strip()
+        elif key == "FNUM":
+            system["fnum"] = to_float(tokens[1] if len(tokens) > 1 else None)
+        elif key == "ENPD":
+            system["enpd"] = to_float(tokens[1] if len(tokens) > 1 else None)
+        elif key == "FTYP":
+            system["ftyp"] = [int(to_float(t, 0)) for t in tokens[1:]]
+        elif key in ("YFLN", "YFLD"):
+            system["fields"] = [to_float(t) for t in tokens[1:]]
+        elif key == "WAVM" and len(tokens) > 2:
+            wavm[int(tokens[1])] = to_float(tokens[2])
+        elif key == "WAVL":
+            system["wavelengths"] = [to_float(t) for t in tokens[1:]]
+        elif key == "PWAV":
+            system["primary_wavelength"] = int(to_float(tokens[1], 1))
+
+    # FTYP <field type> <?> <n fields> <n wavelengths> ...; WAVM/YFLN are padded past those counts
+    ftyp = system["ftyp"]
+    if wavm:
+        n_waves = ftyp[3] if len(ftyp) > 3 and ftyp[3] > 0 else len(wavm)
+        system["wavelengths"] = [wavm[i] for i in sorted(wavm)][:n_waves]
+    if len(ftyp) > 2 and ftyp[2] > 0:
+        system["fields"] = system["fields"][:ftyp[2]]
+    return system
+
+
+def surface_rows(system):
+    """Convert parsed surface records into LensDataExports rows (dicts keyed by COLUMNS)."""
+    surfaces = system["surfaces"]
+    rows = []
+    for i, surface in enumerate(surfaces):
+        curv = surface["curv"]
+        row = {
+            "Surface": surface["Surface"],
+            "TypeName": surface["TypeName"],
+            "Comment": surface["Comment"],
+            "Radius": math.inf if curv == 0 else 1.0 / curv,
+            # OpticStudio reports the image surface thickness as infinite
+            "Thickness": math.inf if i == len(surfaces) - 1 else surface["Thickness"],
+            "Material": surface["Material"],
+            "SemiDiameter": surface["SemiDiameter"],
+            "Conic": surface["Conic"],
+        }
+        # An object at infinity has an infinite semi-diameter unless one was set.
+        # The exports agree for 838 of the 942 lenses with an object at infinity
+        # and DIAM 0; the other 104 write 0, and nothing in their .zmx (DIAM
+        # flag, VERS) tells them apart, so compare_exports() reports them
+        if i == 0 and math.isinf(surface["Thickness"]) and surface["SemiDiameter"] == 0:
+            row["SemiDiameter"] = math.inf
+
+        # Coefficients as the LDE reports them: every even-asphere term, the
+        # focal length (PARM 1) of a paraxial surface, nothing for other types
+        type_name = surface["TypeName"]
+        for n, order in enumerate(EVEN_ORDERS, start=1):
+            row[f"A{order}"] = surface["parm"].get(n, 0.0) if type_name == "Even Asphere" else math.nan
+        if type_name == "Paraxial":
+            row["A2"] = surface["parm"].get(1, math.nan)
+            row["Conic"] = math.inf
+        elif type_name == "Coordinate Break":
+            row["Conic"] = math.inf
+            if not row["Material"]:
+                row["Material"] = "-"
+        rows.append(row)
+    return rows
+
+
+def read_zmx(path):
+    """Read one .zmx file and return (system header dict, LensDataExports rows)."""
+    system = parse_zmx(read_text(path).splitlines())
+    return system, surface_rows(system)
+
+# ---------------- CSV Output ----------------
+def format_value(value):
+    """Format a cell the way MATLAB writetable does (Inf/NaN, 15 significant digits)."""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "Inf" if value > 0 else "-Inf"
+        return f"{value:.15g}"
+    return str(value)
+
+
+def write_lens_csv(path, rows):
+    """Write one lens as a LensDataExports CSV."""
+    with open(path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow([format_value(row[col]) for col in COLUMNS])
+
+
+def export_folder(lens_dir=LENS_DIR, output_dir=OUTPUT_DIR, verbose=False):
+    """
+    Convert every .zmx/.ZMX in lens_dir into <name>_LensData.csv. Returns the
+    number written. Refuses to write into EXPORT_DIR, so the OpticStudio
+    exports are never overwritten.
+    """
+    if os.path.normcase(os.path.abspath(output_dir)) == os.path.normcase(os.path.abspath(EXPORT_DIR)):
+        raise ValueError(f"Refusing to overwrite the OpticStudio exports in {EXPORT_DIR}")
+    os.makedirs(output_dir, exist_ok=True)
+    names = sorted(f for f in os.listdir(lens_dir) if f.lower().endswith(".zmx"))
+    written = 0
+    for fname in names:
+        try:
+            _, rows = read_zmx(os.path.join(lens_dir, fname))
+        except Exception as e:
+            print(f"⚠️ Skipping {fname}: {e}")
+            continue
+        if not rows:
+            print(f"⚠️ No surfaces found in {fname}")
+            continue
+        out_name = os.path.splitext(fname)[0] + "_LensData.csv"
+        write_lens_csv(os.path.join(output_dir, out_name), rows)
+        written += 1
+        if verbose:
+            print(f"✅ Saved: {out_name} ({len(rows)} surfaces)")
+    return written
+
+
+def same_cell(value, cell):
+    """Does a reader value match a LensDataExports cell (numbers to 1e-12 relative)?"""
+    if not isinstance(value, float):
+        return str(value) == cell
+    try:
+        exported = float(cell)
+    except ValueError:
+        return False
+    if math.isnan(value) or math.isnan(exported):
+        return math.isnan(value) and math.isnan(exported)
+    if math.isinf(value) or math.isinf(exported):
+        return value == exported
+    return abs(value - exported) <= 1e-12 * max(1.0, abs(exported))
+
+
+def compare_exports(lens_dir=LENS_DIR, export_dir=EXPORT_DIR, row=0):
+    """
+    Compare one row (the object surface by default) of every lens against its
+    LensDataExports CSV. Returns (lenses compared, {column: [lens_id, ...]}
+    for every column that differs).
+    """
+    zmx = {os.path.splitext(f)[0]: f for f in sorted(os.listdir(lens_dir)) if f.lower().endswith(".zmx")}
+    compared, differ = 0, {}
+    for fname in sorted(os.listdir(export_dir)):
+        lens_id = fname[:-len("_LensData.csv")]
+        if not fname.endswith("_LensData.csv") or lens_id not in zmx:
+            continue
+        with open(os.path.join(export_dir, fname), newline="", encoding="utf-8-sig") as f:
+            exported = list(csv.DictReader(f))
+        rows = read_zmx(os.path.join(lens_dir, zmx[lens_id]))[1]
+        if len(exported) <= row or len(rows) <= row:
+            continue
+        compared += 1
+        for col in COLUMNS:
+            if not same_cell(rows[row][col], exported[row].get(col, "")):
+                differ.setdefault(col, []).append(lens_id)
+    return compared, differ
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    count = export_folder(LENS_DIR, OUTPUT_DIR)
+    print(f"\n✅ Exported {count} lenses to {OUTPUT_DIR} ({time.perf_counter() - start:.2f} s)")
+
+    compared, differ = compare_exports()
+    print(f"Object surface vs LensDataExports over {compared} lenses:")
+    for col, lens_ids in differ.items():
+        print(f"   ⚠️ {col}: {len(lens_ids)} differ (e.g. {lens_ids[0]})")
+    if not differ:
+        print("   ✅ every column matches")
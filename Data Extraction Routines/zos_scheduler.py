@@ -0,0 +1,410 @@
+'''
+Out-of-process OpticStudio job scheduler.
+
+Keeps WORKERS worker processes alive, each holding one backend session (a
+standalone OpticStudio application for the "opticstudio" backend), and hands
+them (lens, analysis) jobs:
+
+  - jobs are dispatched by the scheduler, preferring a worker that already
+    has the job's lens loaded, so a lens is loaded once per worker
+  - a job running longer than JOB_TIMEOUT (a hung LoadFile or
+    ApplyAndWaitForCompletion) gets its worker killed and restarted; the job
+    is retried up to MAX_ATTEMPTS times before it is marked failed
+  - a worker that dies mid-job is restarted the same way, and workers are
+    recycled after RECYCLE_AFTER jobs to bound leaks in long runs
+  - every finished attempt is appended to a JSON-lines journal, so a rerun
+    skips jobs that already succeeded and failed lenses are listed (and
+    optionally copied to failed/) instead of sorted out by hand
+
+Backends are registered by name (register_backend) so worker processes can
+be spawned on Windows; the "fake" backend runs in-process on Linux and can
+be told to hang, crash or fail on chosen lenses, to exercise all of the above.
+'''
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import traceback
+import multiprocessing as mp
+from collections import namedtuple
+from queue import Empty
+
+# ---------------- Paths ----------------
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Prime Lenses + Data"))
+LENS_DIR = DATA_DIR
+OUTPUT_ROOT = os.path.join(DATA_DIR, "AnalysisExports")
+JOURNAL_NAME = "zos_jobs.jsonl"
+
+# ---------------- Settings ----------------
+WORKERS = 2                   # OpticStudio instances kept alive (one licence seat each)
+JOB_TIMEOUT = 300.0           # seconds before a job's worker is killed
+STARTUP_TIMEOUT = 180.0       # seconds a new worker may take to open its session
+MAX_ATTEMPTS = 2              # tries per job before it is marked failed
+MAX_START_FAILURES = 5        # workers in a row that fail to start before the run gives up
+RECYCLE_AFTER = 200           # jobs per worker before it is restarted
+POLL_INTERVAL = 0.2           # seconds between timeout checks
+ANALYSES = ["FieldCurvature", "Longitudinal", "RMSvField", "Vignetting"]
+
+# One unit of work; output_path is where the text export ends up
+Job = namedtuple("Job", ["lens_path", "analysis", "output_path"])
+
+# ---------------- Backends ----------------
+# name -> (start(worker_id, options) -> session, run(session, job) -> None, stop(session))
+# start / run / stop are called inside the worker process.
+BACKENDS = {}
+
+
+def register_backend(name, start, run, stop):
+    """Register a backend under name; the functions must be importable module-level functions."""
+    BACKENDS[name] = {"start": start, "run": run, "stop": stop}
+
+
+def lens_id(job):
+    """Lens name of a job (the lens file name without extension)."""
+    return os.path.splitext(os.path.basename(job.lens_path))[0]
+
+
+def job_key(job):
+    """Journal key of a job: '<lens>/<analysis>'."""
+    return f"{lens_id(job)}/{job.analysis}"
+
+
+def partial_path(path):
+    """Where a backend writes before the export is moved into place (never matches an export grammar)."""
+    return os.path.splitext(path)[0] + ".partial.txt"
+
+
+def finish_output(path):
+    """Move a completed partial export into place, so a killed job never leaves a half-written export."""
+    os.replace(partial_path(path), path)
+
+# ---------------- Fake Backend ----------------
+def fake_start(worker_id, options):
+    """Session of the fake backend: the options plus the currently loaded lens."""
+    if options.get("fail_start"):
+        raise RuntimeError("fake backend asked to fail at start")
+    return {"worker": worker_id, "options": options, "lens": None, "loads": 0}
+
+
+def fake_run(session, job):
+    """
+    Pretend to load the lens and run the analysis. Lenses listed under the
+    options 'hang' / 'crash' / 'fail' hang, kill the worker process or raise.
+    """
+    options, name = session["options"], lens_id(job)
+    if session["lens"] != name:
+        session["lens"] = name
+        session["loads"] += 1
+    if name in options.get("hang", ()):
+        time.sleep(1e6)
+    if name in options.get("crash", ()):
+        os._exit(3)
+    if name in options.get("fail", ()):
+        raise RuntimeError(f"fake analysis failure on {name}")
+    time.sleep(options.get("delay", 0.0))
+    os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+    with open(partial_path(job.output_path), "w", encoding="utf-8") as f:
+        f.write(f"{job.analysis} of {name} (worker {session['worker']}, load {session['loads']})\n")
+    finish_output(job.output_path)
+
+
+def fake_stop(session):
+    pass
+
+
+register_backend("fake", fake_start, fake_run, fake_stop)
+
+# ---------------- OpticStudio Backend ----------------
+# Analysis name -> ZOSAPI.Analysis.AnalysisIDM member
+ANALYSIS_IDS = {
+    "FieldCurvature": "FieldCurvatureAndDistortion",
+    "Longitudinal": "LongitudinalAberration",
+    "RMSvField": "RMSField",
+    "Vignetting": "RelativeIllumination",
+}
+
+
+def zos_start(worker_id, options):
+    """Open a standalone OpticStudio application through ZOS-API (pythonnet, Windows only)."""
+    import clr
+    import winreg
+
+    key = winreg.OpenKey(winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER), r"Software\Zemax", 0, winreg.KEY_READ)
+    zemax_root = winreg.QueryValueEx(key, "ZemaxRoot")[0]
+    winreg.CloseKey(key)
+    clr.AddReference(os.path.join(os.sep, zemax_root, r"ZOS-API\Libraries\ZOSAPI_NetHelper.dll"))
+    import ZOSAPI_NetHelper
+
+    if not ZOSAPI_NetHelper.ZOSAPI_Initializer.Initialize(options.get("install_dir", "")):
+        raise RuntimeError("Cannot find OpticStudio")
+    zemax_dir = ZOSAPI_NetHelper.ZOSAPI_Initializer.GetZemaxDirectory()
+    clr.AddReference(os.path.join(os.sep, zemax_dir, "ZOSAPI.dll"))
+    clr.AddReference(os.path.join(os.sep, zemax_dir, "ZOSAPI_Interfaces.dll"))
+    import ZOSAPI
+
+    connection = ZOSAPI.ZOSAPI_Connection()
+    application = connection.CreateNewApplication()
+    if application is None:
+        raise RuntimeError("Unable to start a standalone OpticStudio application")
+    if not application.IsValidLicenseForAPI:
+        raise RuntimeError(f"License is not valid for ZOSAPI use ({application.LicenseStatus})")
+    return {"zosapi": ZOSAPI, "connection": connection, "application": application,
+            "system": application.PrimarySystem, "lens": None}
+
+
+def zos_run(session, job):
+    """Load the job's lens (unless it is already loaded) and write the analysis text export."""
+    system, zosapi = session["system"], session["zosapi"]
+    if session["lens"] != job.lens_path:
+        session["lens"] = None
+        if not system.LoadFile(job.lens_path, False):
+            raise RuntimeError(f"LoadFile failed for {job.lens_path}")
+        session["lens"] = job.lens_path
+    analysis = system.Analyses.New_Analysis(getattr(zosapi.Analysis.AnalysisIDM, ANALYSIS_IDS[job.analysis]))
+    try:
+        analysis.ApplyAndWaitForCompletion()
+        os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+        if not analysis.GetResults().GetTextFile(partial_path(job.output_path)):
+            raise RuntimeError(f"GetTextFile failed for {job_key(job)}")
+    finally:
+        analysis.Close()
+    finish_output(job.output_path)
+
+
+def zos_stop(session):
+    session["application"].CloseApplication()
+
+
+register_backend("opticstudio", zos_start, zos_run, zos_stop)
+
+# ---------------- Worker Process ----------------
+def worker_main(backend_name, worker_id, options, inbox, outbox):
+    """
+    Worker loop: open one backend session, then run jobs from inbox until a
+    None arrives, reporting ("ready" | "done" | "error", worker_id, key, info)
+    on outbox.
+    """
+    backend = BACKENDS[backend_name]
+    try:
+        session = backend["start"](worker_id, options)
+    except Exception as e:
+        outbox.put(("start_failed", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+    outbox.put(("ready", worker_id, None, None))
+    try:
+        for key, job in iter(inbox.get, None):
+            try:
+                backend["run"](session, job)
+                outbox.put(("done", worker_id, key, None))
+            except Exception as e:
+                outbox.put(("error", worker_id, key, f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=3)}"))
+    finally:
+        try:
+            backend["stop"](session)
+        except Exception:
+            pass
+
+# ---------------- Journal ----------------
+def load_journal(path):
+    """{job key: last journal record}; a torn last line from an interrupted run is ignored."""
+    records = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["job"]] = record
+    except OSError:
+        pass
+    return records
+
+
+def append_journal(f, record):
+    """Append one record and flush it to disk before the scheduler moves on."""
+    f.write(json.dumps(record, sort_keys=True) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def failed_jobs(journal):
+    """Keys of jobs whose last record is a final failure."""
+    return sorted(key for key, record in journal.items() if record["status"] == "failed")
+
+# ---------------- Jobs ----------------
+def lens_jobs(lens_dir=LENS_DIR, output_root=OUTPUT_ROOT, analyses=ANALYSES):
+    """One job per (lens file, analysis), exports going to output_root/<lens>/<lens>_<Analysis>.txt."""
+    jobs = []
+    for fname in sorted(os.listdir(lens_dir)):
+        stem, ext = os.path.splitext(fname)
+        if ext.lower() not in (".zmx", ".zar"):
+            continue
+        for analysis in analyses:
+            jobs.append(Job(os.path.join(lens_dir, fname), analysis,
+                            os.path.join(output_root, stem, f"{stem}_{analysis}.txt")))
+    return jobs
+
+# ---------------- Scheduler ----------------
+def run_jobs(jobs, journal_path, backend="opticstudio", workers=WORKERS, options=None, job_timeout=JOB_TIMEOUT,
+             startup_timeout=STARTUP_TIMEOUT, max_attempts=MAX_ATTEMPTS, max_start_failures=MAX_START_FAILURES,
+             recycle_after=RECYCLE_AFTER, failed_dir=None, retry_failed=False, verbose=True):
+    """
+    Run jobs on a pool of backend worker processes and journal every attempt.
+
+    Jobs already "done" in the journal are skipped (and "failed" ones too,
+    unless retry_failed). With failed_dir, the lens file of every job that
+    fails for good is copied there. Returns {"done", "failed", "skipped",
+    "restarts", "seconds"}.
+    """
+    options = options or {}
+    journal = load_journal(journal_path)
+    skip = {"done", "failed"} if not retry_failed else {"done"}
+    pending = [job for job in jobs if journal.get(job_key(job), {}).get("status") not in skip]
+    stats = {"done": 0, "failed": 0, "skipped": len(jobs) - len(pending), "restarts": 0, "seconds": 0.0}
+    start_failures = [0]
+    if not pending:
+        return stats
+
+    attempts = {job_key(job): 0 for job in pending}
+    by_key = {job_key(job): job for job in pending}
+    ctx = mp.get_context("spawn")
+    outbox = ctx.Queue()
+    pool = {}
+    next_id = [0]
+    start = time.perf_counter()
+
+    def spawn():
+        worker_id = next_id[0]
+        next_id[0] += 1
+        inbox = ctx.Queue()
+        process = ctx.Process(target=worker_main, args=(backend, worker_id, options, inbox, outbox), daemon=True)
+        process.start()
+        pool[worker_id] = {"process": process, "inbox": inbox, "ready": False, "key": None, "lens": None,
+                           "since": time.monotonic(), "jobs": 0}
+
+    def retire(worker_id, kill=False):
+        worker = pool.pop(worker_id)
+        if kill:
+            worker["process"].kill()
+        else:
+            worker["inbox"].put(None)
+        worker["process"].join(5)
+        if worker["process"].is_alive():
+            worker["process"].kill()
+            worker["process"].join()
+
+    def restart(worker_id, kill=True, start_failed=False):
+        retire(worker_id, kill)
+        start_failures[0] += start_failed
+        if start_failures[0] >= max_start_failures:
+            return
+        stats["restarts"] += 1
+        spawn()
+
+    def finish(key, status, worker_id, error=None):
+        """Journal one attempt and either requeue the job or settle it as done / failed."""
+        job = by_key[key]
+        attempts[key] += 1
+        final = status == "done" or attempts[key] >= max_attempts
+        record = {"job": key, "status": "done" if status == "done" else "failed" if final else "retry",
+                  "attempt": attempts[key], "worker": worker_id, "time": time.time()}
+        if error:
+            record.update(cause=status, error=error)
+        append_journal(journal_file, record)
+        if not final:
+            pending.append(job)
+            return
+        stats["done" if status == "done" else "failed"] += 1
+        if verbose:
+            mark = "✅" if status == "done" else "⚠️"
+            print(f"{mark} {key}: {record['status']}" + (f" ({error.splitlines()[0]})" if error else ""))
+        if status != "done" and failed_dir:
+            os.makedirs(failed_dir, exist_ok=True)
+            shutil.copy2(job.lens_path, os.path.join(failed_dir, os.path.basename(job.lens_path)))
+
+    # Jobs of one lens stay together so a worker loads each lens once
+    pending.sort(key=lambda job: (lens_id(job), job.analysis))
+    pending.reverse()
+    os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+    with open(journal_path, "a", encoding="utf-8") as journal_file:
+        for _ in range(min(workers, len(pending))):
+            spawn()
+        try:
+            while (pending or any(w["key"] for w in pool.values())) and pool:
+                # Hand work to idle workers, preferring the lens they already have loaded
+                for worker_id, worker in pool.items():
+                    if not worker["ready"] or worker["key"] or not pending:
+                        continue
+                    same = [i for i, job in enumerate(pending) if job.lens_path == worker["lens"]]
+                    job = pending.pop(same[-1] if same else -1)
+                    worker.update(key=job_key(job), lens=job.lens_path, since=time.monotonic())
+                    worker["inbox"].put((job_key(job), job))
+
+                try:
+                    message, worker_id, key, info = outbox.get(timeout=POLL_INTERVAL)
+                except Empty:
+                    message = None
+                if message is not None and worker_id in pool:
+                    worker = pool[worker_id]
+                    if message == "ready":
+                        worker.update(ready=True, since=time.monotonic())
+                        start_failures[0] = 0
+                    elif message == "start_failed":
+                        if verbose:
+                            print(f"⚠️ Worker {worker_id} could not start: {info}")
+                        restart(worker_id, start_failed=True)
+                    elif key == worker["key"]:
+                        worker.update(key=None, jobs=worker["jobs"] + 1)
+                        finish(key, "done" if message == "done" else "error", worker_id, info)
+                        if worker["jobs"] >= recycle_after:
+                            restart(worker_id, kill=False)
+
+                # Timeouts and dead workers
+                now = time.monotonic()
+                for worker_id, worker in list(pool.items()):
+                    limit = job_timeout if worker["key"] else startup_timeout
+                    dead = not worker["process"].is_alive()
+                    if not dead and (worker["ready"] and not worker["key"] or now - worker["since"] < limit):
+                        continue
+                    if worker["key"]:
+                        reason = "crashed" if dead else f"timed out after {job_timeout:g} s"
+                        finish(worker["key"], "timeout" if not dead else "crashed", worker_id,
+                               f"worker {worker_id} {reason}")
+                        restart(worker_id)
+                        continue
+                    if verbose:
+                        print(f"⚠️ Worker {worker_id} {'exited' if dead else 'did not start'}; restarting")
+                    restart(worker_id, start_failed=not worker["ready"])
+        finally:
+            for worker_id in list(pool):
+                retire(worker_id, kill=bool(pool[worker_id]["key"]))
+
+        # Workers kept failing to start: whatever is left is failed for this run (retry_failed picks it up later)
+        for job in pending:
+            append_journal(journal_file, {"job": job_key(job), "status": "failed", "attempt": attempts[job_key(job)],
+                                          "worker": None, "time": time.time(), "cause": "no_workers",
+                                          "error": "no workers left"})
+            stats["failed"] += 1
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+if __name__ == "__main__":
+    if os.name == "nt":
+        jobs = lens_jobs(LENS_DIR, OUTPUT_ROOT)
+        stats = run_jobs(jobs, os.path.join(OUTPUT_ROOT, JOURNAL_NAME), backend="opticstudio",
+                         failed_dir=os.path.join(LENS_DIR, "failed"))
+    else:
+        # No OpticStudio here: exercise the scheduler against the fake backend in a scratch folder
+        scratch = tempfile.mkdtemp(prefix="zos_scheduler_")
+        jobs = lens_jobs(LENS_DIR, os.path.join(scratch, "AnalysisExports"))[:40]
+        lenses = sorted({lens_id(job) for job in jobs})
+        options = {"delay": 0.01, "hang": lenses[1:2], "crash": lenses[3:4], "fail": lenses[5:6]}
+        stats = run_jobs(jobs, os.path.join(scratch, JOURNAL_NAME), backend="fake", options=options,
+                         job_timeout=2.0, failed_dir=os.path.join(scratch, "failed"), verbose=False)
+        print(f"Fake run in {scratch}: hang={options['hang']} crash={options['crash']} fail={options['fail']}")
+    print(f"✅ {stats['done']} done, {stats['failed']} failed, {stats['skipped']} skipped, "
+          f"{stats['restarts']} worker restarts ({stats['seconds']:.1f} s)")
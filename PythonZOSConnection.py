@@ -101,130 +101,27 @@ print('Serial #: ', TheApplication.SerialCode)
 
 # Insert Code Here
 ##################
-import pandas as pd
-import math
+import sys
 
+# The LDE reader lives with the other extraction routines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data Extraction Routines"))
+import lde_export
+from zmx_reader import write_lens_csv
+
+# Read the whole LDE of the current system: one GetSurfaceAt per surface
+# (object surface 0 included), each row property read once and Par cells
+# only where the surface type carries coefficients
 LDE = TheSystem.LDE
 num_surfaces = LDE.NumberOfSurfaces
 print(f"Found {num_surfaces} surfaces")
 
-def safe_get_property(obj, prop_name, cast=None, default=None):
-    """
-    Safely attempt to get obj.<prop_name>. If the .NET call raises or returns None,
-    return default. Optionally cast the value (e.g., float or str).
-    """
-    try:
-        val = getattr(obj, prop_name)
-    except Exception as e:
-        # Property access raised (common for some special rows) -> return default
-        # Uncomment next line if you want to debug which properties fail:
-        # print(f"DEBUG: getattr failed for prop '{prop_name}': {e}")
-        return default
-    # val may be a .NET null -> treat as None
-    if val is None:
-        return default
-    # try casting
-    try:
-        if cast is not None:
-            return cast(val)
-        return val
-    except Exception:
-        return default
-
-# Predefine the keys/columns (keeps CSV consistent)
-columns = [
-    "Surface", "Comment", "Type", "Radius", "Thickness", "Material",
-    "SemiDiameter", "Conic", "A4", "A6", "A8"
-]
-
-lens_data = []
-
-for i in range(1, num_surfaces + 1):
-    surf = None
-    try:
-        surf = LDE.GetSurfaceAt(i)
-    except Exception as e:
-        print(f"⚠️ Could not GetSurfaceAt({i}): {e}")
-        # append a row of defaults so indexing remains consistent
-        lens_data.append({
-            "Surface": i,
-            "Comment": "",
-            "Type": "",
-            "Radius": float("nan"),
-            "Thickness": float("nan"),
-            "Material": "",
-            "SemiDiameter": float("nan"),
-            "Conic": float("nan"),
-            "A4": float("nan"),
-            "A6": float("nan"),
-            "A8": float("nan"),
-        })
-        continue
-
-    # Build the row using safe_get_property for each attribute
-    row = {
-        "Surface": i,
-        "Comment": safe_get_property(surf, "Comment", cast=str, default=""),
-        "Type": safe_get_property(surf, "Type", cast=str, default=""),
-        "Radius": safe_get_property(surf, "Radius", cast=float, default=float("nan")),
-        "Thickness": safe_get_property(surf, "Thickness", cast=float, default=float("nan")),
-        "Material": safe_get_property(surf, "Material", cast=str, default=""),
-        "SemiDiameter": safe_get_property(surf, "SemiDiameter", cast=float, default=float("nan")),
-        "Conic": safe_get_property(surf, "Conic", cast=float, default=float("nan")),
-        # initialize asphere coeffs
-        "A4": float("nan"),
-        "A6": float("nan"),
-        "A8": float("nan"),
-        "A10": float("nan"),
-        "A12": float("nan"),
-    }
-
-    # Try to read Asphere object and coefficients, each access wrapped
-    try:
-        asp = None
-        try:
-            asp = surf.Asphere
-        except Exception as e:
-            # Some surfaces may throw on .Asphere access; ignore and keep NaNs
-            # Uncomment to debug: print(f"DEBUG: surf.Asphere access failed for surface {i}: {e}")
-            asp = None
-
-        if asp is not None:
-            # Coefficients sometimes indexed starting at 0 or 1 depending on API - use try/except
-            try:
-                row["A4"] = safe_get_property(asp, "Coefficient", cast=lambda fn: fn(4), default=float("nan"))
-            except Exception:
-                try:
-                    # fallback: asp.Coefficient might be a callable method accessed differently
-                    row["A4"] = float(asp.Coefficient(4))
-                except Exception:
-                    row["A4"] = float("nan")
-
-            try:
-                row["A6"] = safe_get_property(asp, "Coefficient", cast=lambda fn: fn(6), default=float("nan"))
-            except Exception:
-                try:
-                    row["A6"] = float(asp.Coefficient(6))
-                except Exception:
-                    row["A6"] = float("nan")
-
-            try:
-                row["A8"] = safe_get_property(asp, "Coefficient", cast=lambda fn: fn(8), default=float("nan"))
-            except Exception:
-                try:
-                    row["A8"] = float(asp.Coefficient(8))
-                except Exception:
-                    row["A8"] = float("nan")
-    except Exception as e:
-        # Catch-all to prevent single-surface errors from stopping the whole run
-        print(f"⚠️ Unexpected error while reading Asphere for surface {i}: {e}")
-
-    lens_data.append(row)
-
-# Convert to DataFrame and export
-df = pd.DataFrame(lens_data, columns=columns)
+lens_data = lde_export.read_lde(LDE, lde_export.par_columns(ZOSAPI))
+
+# Export in the LensDataExports schema
 csv_path = os.path.join(os.getcwd(), "lens_data.csv")
-df.to_csv(csv_path, index=False)
+write_lens_csv(csv_path, lens_data)
+
+print(f"✅ Exported lens data for {len(lens_data)} surfaces to {csv_path}")
 
-print(f"✅ Exported lens data for {num_surfaces} surfaces to {csv_path}")
-print(df.head(15))
\ No newline at end of file
+# To export a whole folder of lenses into the prescription store instead, run
+# "Data Extraction Routines/lde_export.py" (standalone OpticStudio session).